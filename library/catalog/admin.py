@@ -1,5 +1,13 @@
 from django.contrib import admin
-from .models import Author, Genre, Language, Book, BookInstance
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from django.contrib import messages
+from . import circulation, profiling
+from .forms import VersionedModelForm
+from .models import Author, Genre, Language, Book, BookInstance, Hold, RequestProfile
+from .pagination import EstimatedCountPaginator
 
 # Register your models here.
 # admin: root:adminpassword
@@ -8,8 +16,27 @@ from .models import Author, Genre, Language, Book, BookInstance
 # Регистрация моделей в админ-панели
 # admin.site.register(Book)
 # admin.site.register(Author)
-admin.site.register(Genre)
-admin.site.register(Language)
+# search_fields нужны для виджетов автодополнения (autocomplete_fields) в формах книги
+@admin.register(Genre)
+class GenreAdmin(admin.ModelAdmin):
+    search_fields = ('name',)
+
+
+@admin.register(Language)
+class LanguageAdmin(admin.ModelAdmin):
+    search_fields = ('name',)
+
+
+# Если связанных записей больше, чем INLINE_LIMIT, вместо таблицы (inline) в форме
+# показывается ссылка на отфильтрованный список этих записей
+INLINE_LIMIT = 50
+
+
+# Ссылка на список связанных записей в админ-панели, отфильтрованный по объекту
+def related_changelist_link(model, field, obj, count):
+    url = reverse('admin:{0}_{1}_changelist'.format(model._meta.app_label, model._meta.model_name))
+    return format_html('<a href="{0}?{1}__id__exact={2}">{3}: {4}</a>',
+                       url, field, obj.pk, model._meta.verbose_name_plural, count)
 
 
 # admin.site.register(BookInstance)
@@ -22,6 +49,8 @@ class BooksInLine(admin.TabularInline):
     # которые отображаются по-умолчанию
     extra = 0
     model = Book
+    # Автодополнение вместо выпадающих списков со всеми языками и жанрами
+    autocomplete_fields = ('language', 'genre')
 
 
 class AuthorAdmin(admin.ModelAdmin):
@@ -29,9 +58,27 @@ class AuthorAdmin(admin.ModelAdmin):
     list_display = ('last_name', 'first_name', 'date_of_birth', 'date_of_death')
     # Отображение полей имени и фамилии друг под другом,
     # полей даты рождения и даты смерти - рядом
-    fields = ['first_name', 'last_name', ('date_of_birth', 'date_of_death')]
+    fields = ['first_name', 'last_name', ('date_of_birth', 'date_of_death'), 'books_link']
+    readonly_fields = ('books_link',)
     # inlines - Отображение связанной таблицы
     inlines = [BooksInLine]
+    search_fields = ('last_name', 'first_name')
+    # Общее количество записей не подсчитывается отдельным COUNT(*), количество в списке - оценка
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    # Таблица книг показывается, только если книг немного
+    def get_inlines(self, request, obj):
+        if obj is not None and obj.book_set.count() > INLINE_LIMIT:
+            return []
+        return self.inlines
+
+    def books_link(self, obj):
+        if obj.pk is None:
+            return '-'
+        return related_changelist_link(Book, 'author', obj, obj.book_set.count())
+
+    books_link.short_description = 'Книги'
 
 
 admin.site.register(Author, AuthorAdmin)
@@ -45,6 +92,7 @@ class BooksInstanceInLine(admin.TabularInline):
     # которые отображаются по-умолчанию
     extra = 0
     model = BookInstance
+    autocomplete_fields = ('borrower',)
 
 
 # Декоратор @admin.register(Book) делает то же, что и admin.site.register(Book, BookAdmin)
@@ -54,9 +102,35 @@ class BooksInstanceInLine(admin.TabularInline):
 class BookAdmin(admin.ModelAdmin):
     # Отображение в админ-панели книги в формате Название, Автор, Жанры
     list_display = ('title', 'author', 'display_genre')
+    # Скрытая версия книги: изменение, сделанное после открытия формы, не перезаписывается
+    form = VersionedModelForm
+    # Автор загружается в том же запросе, что и список книг
+    list_select_related = ('author',)
     # Отображение информации об экземплярах книги в информации о книге
     # inlines - Отображение связанной таблицы
     inlines = [BooksInstanceInLine]
+    readonly_fields = ('copies_link',)
+    autocomplete_fields = ('author', 'language', 'genre')
+    search_fields = ('title', 'isbn')
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    # Жанры всех книг страницы загружаются одним дополнительным запросом (для display_genre)
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('genre')
+
+    # Таблица экземпляров показывается, только если экземпляров немного
+    def get_inlines(self, request, obj):
+        if obj is not None and obj.bookinstance_set.count() > INLINE_LIMIT:
+            return []
+        return self.inlines
+
+    def copies_link(self, obj):
+        if obj.pk is None:
+            return '-'
+        return related_changelist_link(BookInstance, 'book', obj, obj.bookinstance_set.count())
+
+    copies_link.short_description = 'Экземпляры'
 
 
 # Регистрация класса Admin для BookInstance с помощью декоратора
@@ -66,14 +140,115 @@ class BookInstanceAdmin(admin.ModelAdmin):
     list_display = ('book', 'status', 'borrower', 'due_back', 'id')
     # Добавление в админ-панель фильтра книг по статусу и дате возврата
     list_filter = ('status', 'due_back')
+    # Книга и заёмщик загружаются в том же запросе, что и список экземпляров
+    list_select_related = ('book', 'borrower')
+    autocomplete_fields = ('book', 'borrower')
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
 
     # Группировка в инормации по доступности книги в разделы: Книга, Импринт, ID
     # и Статус, Дата возврата
+    form = VersionedModelForm
     fieldsets = (
         (None, {
-            'fields': ('book', 'imprint', 'id')
+            'fields': ('book', 'imprint', 'id', 'loaded_version')
         }),
         ('Доступность', {
             'fields': ('status', 'due_back', 'borrower')
         })
     )
+    actions = ['return_copies']
+
+    # Экземпляр, ставший доступным через форму (возврат, конец обслуживания), резервируется для очереди заявок
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if obj.status == circulation.AVAILABLE and (not change or 'status' in form.changed_data):
+            circulation.serve_holds([obj.pk])
+
+    # Возврат выбранных экземпляров через catalog/circulation.py: экземпляр резервируется для очереди заявок
+    @admin.action(description='Принять возврат выбранных экземпляров', permissions=['change'])
+    def return_copies(self, request, queryset):
+        returned = 0
+        for pk in queryset.values_list('pk', flat=True):
+            try:
+                circulation.return_copy(pk)
+                returned += 1
+            except circulation.CirculationError as error:
+                self.message_user(request, '{0}: {1}'.format(pk, error), messages.WARNING)
+        self.message_user(request, 'Принято экземпляров: {0}'.format(returned))
+
+
+# Очередь заявок на книги. Отмена заявки освобождает зарезервированный для неё экземпляр.
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+    list_display = ('book', 'user', 'created', 'copy')
+    list_select_related = ('book', 'user')
+    autocomplete_fields = ('book', 'user')
+    readonly_fields = ('created', 'copy')
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    # Новая заявка ставится в очередь через catalog/circulation.py (с резервированием доступного экземпляра)
+    def save_model(self, request, obj, form, change):
+        hold = circulation.place_hold(obj.book_id, obj.user)
+        obj.pk, obj.created, obj.copy_id = hold.pk, hold.created, hold.copy_id
+
+    def delete_model(self, request, obj):
+        circulation.cancel_hold(obj.pk)
+
+    # Действие "Удалить выбранные" тоже отменяет заявки по одной
+    def delete_queryset(self, request, queryset):
+        for pk in queryset.values_list('pk', flat=True):
+            circulation.cancel_hold(pk)
+
+
+# Профили запросов, снятые сотрудниками по ?profile= (см. catalog/profiling.py): сводка и скачивание файла
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created', 'method', 'path', 'view_name', 'status_code', 'mode', 'duration', 'user')
+    list_filter = ('mode', 'view_name')
+    list_select_related = ('user',)
+    search_fields = ('path', 'view_name')
+    # Дамп профиля не выводится в форме (он скачивается ссылкой) и не загружается в список
+    exclude = ('data',)
+    readonly_fields = ('created', 'user', 'method', 'path', 'view_name', 'status_code', 'mode', 'duration',
+                       'download_link', 'summary')
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if request.resolver_match.url_name.endswith('_changelist'):
+            queryset = queryset.defer('data')
+        return queryset
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        urls = [
+            path('<int:pk>/download/', self.admin_site.admin_view(self.download_view),
+                 name='catalog_requestprofile_download'),
+        ]
+        return urls + super().get_urls()
+
+    def download_view(self, request, pk):
+        if not self.has_view_permission(request):
+            return HttpResponse(status=403)
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        response = HttpResponse(bytes(profile.data), content_type='application/octet-stream')
+        response['Content-Disposition'] = 'attachment; filename="{0}"'.format(profiling.filename(profile))
+        return response
+
+    def download_link(self, obj):
+        return format_html('<a href="{0}">{1}</a>', reverse('admin:catalog_requestprofile_download', args=[obj.pk]),
+                           profiling.filename(obj))
+
+    download_link.short_description = 'Файл профиля'
+
+    def summary(self, obj):
+        return format_html('<pre>{0}</pre>', profiling.summary(obj))
+
+    summary.short_description = 'Сводка'
@@ -0,0 +1,249 @@
+# JSON API каталога только для чтения: книги, авторы, жанры, языки и наличие экземпляров.
+# Ответы строятся из строк QuerySet.values() без создания объектов моделей; названия жанров и языков
+# берутся из справочников в памяти (catalog/lookups.py).
+# Каждый ответ несёт ETag и Last-Modified по версиям моделей, от которых он зависит (см. catalog/versions.py):
+# клиент повторяет запрос с If-None-Match / If-Modified-Since и, если данные не менялись, получает 304 без тела.
+from django.db import connection
+from django.db.models.functions import Collate, Upper
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.http import condition, require_safe
+
+from . import lookups, versions
+from .models import Author, Book, BookInstance, Genre, Language
+from .pagination import InvalidCursor, KeysetPaginator
+
+# Размер страницы списков по умолчанию и наибольший (параметр ?limit=)
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Количество вариантов автодополнения по умолчанию и наибольшее
+AUTOCOMPLETE_SIZE = 20
+MAX_AUTOCOMPLETE_SIZE = 50
+
+BOOK_FIELDS = ['id', 'title', 'isbn', 'author_id', 'author__first_name', 'author__last_name', 'language_id']
+AUTHOR_FIELDS = ['id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death']
+COPY_FIELDS = ['id', 'imprint', 'status', 'due_back']
+STATUS_NAMES = dict(BookInstance.LOAN_STATUS)
+
+
+# Условный GET по версиям моделей names. Версии читаются один раз за запрос (одним запросом к БД)
+# и используются и для ETag, и для Last-Modified.
+def versioned(*names):
+    def request_versions(request):
+        if not hasattr(request, 'catalog_versions'):
+            request.catalog_versions = versions.get_versions(names)
+        return request.catalog_versions
+
+    def etag(request, *args, **kwargs):
+        return versions.make_etag(request_versions(request), request.get_full_path())
+
+    def last_modified(request, *args, **kwargs):
+        return versions.modified_at(request_versions(request))
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def json_response(data):
+    response = JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+    # Кэшировать можно, но перед использованием - проверить у сервера (ответ 304 дешёвый)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+# Страница списка по ключу: ?cursor= из ссылок next/previous, ?limit= - размер страницы
+def paginate(request, queryset, ordering):
+    try:
+        limit = max(1, min(int(request.GET.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        limit = PAGE_SIZE
+    paginator = KeysetPaginator(queryset, limit, ordering=ordering)
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        raise Http404('Неверная ссылка на страницу')
+
+    def link(cursor):
+        if cursor is None:
+            return None
+        params = request.GET.copy()
+        params['cursor'] = cursor
+        return '{0}?{1}'.format(request.path, params.urlencode())
+
+    return page.object_list, link(page.next_cursor), link(page.previous_cursor)
+
+
+def book_data(row, genres):
+    author = None
+    if row['author_id'] is not None:
+        author = {'id': row['author_id'], 'first_name': row['author__first_name'],
+                  'last_name': row['author__last_name'], 'url': reverse('api-author-detail', args=[row['author_id']])}
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'isbn': row['isbn'],
+        'author': author,
+        'language': lookups.language_name(row['language_id']),
+        'genres': genres,
+        'url': reverse('api-book-detail', args=[row['id']]),
+    }
+
+
+# Список книг: /catalog/api/books/?limit=50&cursor=...
+@require_safe
+@versioned(versions.BOOK, versions.AUTHOR, versions.GENRE, versions.LANGUAGE)
+def book_list(request):
+    rows, next_url, previous_url = paginate(request, Book.objects.values(*BOOK_FIELDS), ['id'])
+    genres = lookups.book_genres([row['id'] for row in rows])
+    return json_response({
+        'results': [book_data(row, genres[row['id']]) for row in rows],
+        'next': next_url,
+        'previous': previous_url,
+    })
+
+
+# Книга с аннотацией и количеством экземпляров
+@require_safe
+@versioned(versions.BOOK, versions.AUTHOR, versions.GENRE, versions.LANGUAGE, versions.BOOK_INSTANCE)
+def book_detail(request, pk):
+    queryset = Book.objects.with_copy_counts().values(*BOOK_FIELDS, 'summary', 'num_copies', 'num_available',
+                                                       'num_borrowed')
+    row = get_object_or_404(queryset, pk=pk)
+    data = book_data(row, lookups.book_genres([pk])[pk])
+    data.update({
+        'summary': row['summary'],
+        'copies': {'total': row['num_copies'], 'available': row['num_available'], 'borrowed': row['num_borrowed']},
+        'copies_url': reverse('api-book-copies', args=[pk]),
+    })
+    return json_response(data)
+
+
+# Экземпляры книги и их доступность (без сведений о читателях)
+@require_safe
+@versioned(versions.BOOK, versions.BOOK_INSTANCE)
+def book_copies(request, pk):
+    if not Book.objects.filter(pk=pk).exists():
+        raise Http404('Книга не найдена')
+    rows = BookInstance.objects.filter(book_id=pk).order_by('due_back', 'pk').values(*COPY_FIELDS)
+    return json_response({'book': pk, 'results': [{
+        'id': row['id'],
+        'imprint': row['imprint'],
+        'status': row['status'],
+        'status_name': STATUS_NAMES.get(row['status'], ''),
+        'available': row['status'] == 'д',
+        'due_back': row['due_back'],
+    } for row in rows]})
+
+
+def author_data(row):
+    data = dict(row)
+    data['url'] = reverse('api-author-detail', args=[row['id']])
+    return data
+
+
+# Список авторов по фамилии и имени (индекс author_name_idx): /catalog/api/authors/?limit=50&cursor=...
+@require_safe
+@versioned(versions.AUTHOR)
+def author_list(request):
+    rows, next_url, previous_url = paginate(request, Author.objects.values(*AUTHOR_FIELDS),
+                                            ['last_name', 'first_name', 'id'])
+    return json_response({'results': [author_data(row) for row in rows], 'next': next_url, 'previous': previous_url})
+
+
+# Автор и список его книг
+@require_safe
+@versioned(versions.AUTHOR, versions.BOOK)
+def author_detail(request, pk):
+    data = author_data(get_object_or_404(Author.objects.values(*AUTHOR_FIELDS), pk=pk))
+    books = Book.objects.filter(author_id=pk).order_by('title', 'pk').values('id', 'title', 'isbn')
+    data['books'] = [dict(book, url=reverse('api-book-detail', args=[book['id']])) for book in books]
+    return json_response(data)
+
+
+@require_safe
+@versioned(versions.GENRE)
+def genre_list(request):
+    return json_response({'results': [{'id': pk, 'name': name} for pk, name in lookups.genre_choices()]})
+
+
+@require_safe
+@versioned(versions.LANGUAGE)
+def language_list(request):
+    return json_response({'results': [{'id': pk, 'name': name} for pk, name in lookups.language_choices()]})
+
+
+# Автодополнение для полей форм (catalog/forms.py, AutocompleteSelect): /catalog/api/autocomplete/authors/?q=Тол
+# Ищутся записи, имя которых начинается с q без учёта регистра. Поиск и сортировка идут по одному индексу
+# *_prefix_idx (миграция 0012), из которого читаются только первые limit строк, поэтому время ответа
+# не зависит от размера таблицы. Ответ: {"results": [{"id": ..., "text": ...}]}.
+def autocomplete_limit(request):
+    try:
+        return max(1, min(int(request.GET.get('limit', AUTOCOMPLETE_SIZE)), MAX_AUTOCOMPLETE_SIZE))
+    except ValueError:
+        return AUTOCOMPLETE_SIZE
+
+
+def autocomplete_response(rows, text):
+    return json_response({'results': [{'id': row['id'], 'text': text(row)} for row in rows]})
+
+
+# Выражение индекса *_prefix_idx для столбца field
+def prefix_key(field):
+    if connection.vendor == 'postgresql':
+        return Collate(Upper(field), 'C')
+    if connection.vendor == 'sqlite':
+        return Collate(field, 'NOCASE')
+    return Upper(field)
+
+
+# Записи queryset, у которых field начинается с prefix, в порядке индекса field: field, order..., id
+def starting_with(queryset, field, prefix, *order):
+    key = field + '_key'
+    # LIKE в SQLite сам не учитывает регистр (только для латиницы), в остальных БД сравнивается UPPER()
+    if connection.vendor != 'sqlite':
+        prefix = prefix.upper()
+    queryset = queryset.alias(**{key: prefix_key(field)}).filter(**{key + '__startswith': prefix})
+    return queryset.order_by(key, *order, 'id')
+
+
+# Авторы по началу фамилии или имени; два слова - начало фамилии и имени в любом порядке ("Толст Лев", "Лев Т").
+# Совпадения по фамилии и по имени выбираются отдельными запросами, каждый по своему индексу с LIMIT
+# (условие OR с общей сортировкой читало и сортировало бы все совпадения); совпадения по фамилии идут первыми.
+def author_matches(query, limit):
+    fields = ['id', 'last_name', 'first_name']
+    words = query.replace(',', ' ').split()
+    if not words:
+        return list(Author.objects.order_by('last_name', 'first_name', 'id').values(*fields)[:limit])
+    first, rest = words[0], ' '.join(words[1:])
+    by_last_name = starting_with(Author.objects.all(), 'last_name', first, 'first_name')
+    by_first_name = starting_with(Author.objects.all(), 'first_name', first, 'last_name')
+    if rest:
+        by_last_name = by_last_name.filter(first_name__istartswith=rest)
+        by_first_name = by_first_name.filter(last_name__istartswith=rest)
+    rows = list(by_last_name.values(*fields)[:limit])
+    if len(rows) < limit:
+        # Найдены все совпадения по фамилии
+        found = {row['id'] for row in rows}
+        rows += [row for row in by_first_name.values(*fields)[:limit] if row['id'] not in found][:limit - len(rows)]
+    return rows
+
+
+@require_safe
+@versioned(versions.AUTHOR)
+def author_autocomplete(request):
+    rows = author_matches(request.GET.get('q', ''), autocomplete_limit(request))
+    return autocomplete_response(rows, lambda row: '{0}, {1}'.format(row['last_name'], row['first_name']))
+
+
+@require_safe
+@versioned(versions.GENRE)
+def genre_autocomplete(request):
+    rows = starting_with(Genre.objects.all(), 'name', request.GET.get('q', '').strip())
+    return autocomplete_response(rows.values('id', 'name')[:autocomplete_limit(request)], lambda row: row['name'])
+
+
+@require_safe
+@versioned(versions.LANGUAGE)
+def language_autocomplete(request):
+    rows = starting_with(Language.objects.all(), 'name', request.GET.get('q', '').strip())
+    return autocomplete_response(rows.values('id', 'name')[:autocomplete_limit(request)], lambda row: row['name'])
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CatalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'catalog'
+
+    # Подключение обработчиков сигналов (поисковый индекс и т. д.)
+    def ready(self):
+        from . import signals  # noqa: F401
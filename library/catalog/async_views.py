@@ -0,0 +1,100 @@
+# Асинхронные варианты страниц каталога для развёртывания через ASGI (library/asgi.py), адреса /catalog/async/...
+# В Django 4.0 у ORM ещё нет асинхронных методов (acount, aget и асинхронная итерация по QuerySet
+# появились в Django 4.1), поэтому вся работа с БД одного запроса - пользователь и его права, запросы
+# и предзагрузка связанных объектов - выполняется одним переходом sync_to_async в поток ORM.
+# Шаблон отрисовывается уже в цикле событий по готовым данным, без обращений к БД.
+# Выборка данных (запросы, пагинация по ключу, prefetch) берётся из синхронных представлений views.py.
+# Страницы книги и автора, как и синхронные, берутся из кэша страниц (catalog/caching.py): проверка кэша
+# выполняется в том же переходе в поток ORM, а при попадании данные не загружаются.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.shortcuts import render
+from django.views.generic.detail import SingleObjectMixin
+
+from . import caching, counters, views
+
+
+# Загружает пользователя запроса и его права: после этого шаблоны проверяют user и perms без запросов к БД
+def load_user(request):
+    request.user.get_all_permissions()
+    return request.user
+
+
+# Домашняя страница: счётчики каталога и посещения (сессия) загружаются одним переходом в поток ORM.
+# Два отдельных вызова sync_to_async (thread_sensitive) в Django 4.0 всё равно выполнялись бы
+# в одном потоке по очереди, только с лишним переключением между циклом событий и потоком.
+def load_index(request):
+    load_user(request)
+    return counters.get_counts(), views.get_visits(request)
+
+
+async def index(request):
+    counts, num_visits = await sync_to_async(load_index)(request)
+    response = render(request, 'index.html', context={
+        'num_books': counts[counters.BOOKS],
+        'num_instances': counts[counters.INSTANCES],
+        'num_instances_available': counts[counters.INSTANCES_AVAILABLE],
+        'num_authors': counts[counters.AUTHORS],
+        'num_visits': num_visits,
+    })
+    response.set_signed_cookie(views.VISITS_COOKIE, num_visits + 1, salt=views.VISITS_COOKIE_SALT,
+                               max_age=views.VISITS_COOKIE_MAX_AGE, httponly=True, samesite='Lax')
+    return response
+
+
+# Проверка доступа, объект или страница списка и контекст шаблона синхронного представления view_class.
+# Возвращает (имена шаблонов, контекст, запись кэша) или готовый ответ (перенаправление на вход,
+# страница из кэша). Запись кэша - (ключ, имена и значения версий данных) для store_page() или None.
+def load_view(view_class, request, kwargs):
+    load_user(request)
+    view = view_class()
+    view.setup(request, **kwargs)
+    if isinstance(view, LoginRequiredMixin) and not request.user.is_authenticated:
+        return view.handle_no_permission()
+    if isinstance(view, PermissionRequiredMixin) and not view.has_permission():
+        return view.handle_no_permission()
+
+    entry = None
+    if isinstance(view, caching.CachedPageMixin) and caching.get_timeout():
+        key, cached = view.get_cached_page()
+        if cached is not None:
+            return cached
+        names = view.get_data_versions()
+        entry = (key, names, caching.get_versions(names) if names else [])
+
+    if isinstance(view, SingleObjectMixin):
+        view.object = view.get_object()
+        context = view.get_context_data(object=view.object)
+    else:
+        view.object_list = view.get_queryset()
+        context = view.get_context_data()
+        # Страница ?page=N - срез QuerySet: выполняем его и подсчёт страниц здесь, а не при отрисовке
+        list(context['object_list'])
+        if context.get('paginator') is not None:
+            context['paginator'].count
+    return view.get_template_names(), context, entry
+
+
+def as_async_view(view_class):
+    async def view(request, **kwargs):
+        result = await sync_to_async(load_view)(view_class, request, kwargs)
+        if not isinstance(result, tuple):
+            return result
+        template_names, context, entry = result
+        response = render(request, template_names, context)
+        if entry is not None:
+            key, names, versions = entry
+            await sync_to_async(caching.store_page)(key, response, names, versions)
+        return response
+
+    view.view_class = view_class
+    return view
+
+
+book_list = as_async_view(views.BookListView)
+book_detail = as_async_view(views.BookDetailView)
+author_list = as_async_view(views.AuthorListView)
+author_detail = as_async_view(views.AuthorDetailView)
+loaned_books_by_user = as_async_view(views.LoanedBooksByUserListView)
+loaned_books_all = as_async_view(views.LoanedBooksAllListView)
+loaned_books_all_books = as_async_view(views.LoanedBooksAllListViewAll)
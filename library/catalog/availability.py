@@ -0,0 +1,74 @@
+# Сводка доступности книги: количество экземпляров в каждом статусе (BookInstance.LOAN_STATUS)
+# и ближайшая дата возврата взятого экземпляра хранятся в полях Book, чтобы список книг показывал
+# доступность без подсчёта экземпляров для каждой книги.
+# Сохранение и удаление экземпляра изменяют счётчики атомарным UPDATE ... SET copies_x = copies_x + n
+# (catalog/signals.py); ближайшая дата возврата после возврата книги не выводится из старого значения,
+# поэтому она пересчитывается по индексу экземпляров книги. Массовые изменения (book_instances_updated,
+# catalog_bulk_loaded) пересчитывают сводку только затронутых книг.
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Book, BookInstance
+from .search import INDEX_CHUNK_SIZE, chunks
+
+# Поле счётчика для каждого статуса экземпляра
+STATUS_FIELDS = {
+    'т': 'copies_maintenance',
+    'в': 'copies_on_loan',
+    'д': 'copies_available',
+    'з': 'copies_reserved',
+}
+ON_LOAN = 'в'
+
+
+# Изменение счётчиков при переходе count экземпляров книги book_id из old_status в new_status.
+# Статус None - экземпляра не было (создание) или больше нет (удаление).
+def status_changed(book_id, old_status, new_status, count=1):
+    if book_id is None or old_status == new_status:
+        return
+    fields = {}
+    if old_status in STATUS_FIELDS:
+        fields[STATUS_FIELDS[old_status]] = F(STATUS_FIELDS[old_status]) - count
+    if new_status in STATUS_FIELDS:
+        fields[STATUS_FIELDS[new_status]] = F(STATUS_FIELDS[new_status]) + count
+    if fields:
+        Book.objects.filter(pk=book_id).update(**fields)
+
+
+# Ближайшая дата возврата взятых экземпляров книги (подзапрос для UPDATE)
+def next_due_back():
+    return Subquery(BookInstance.objects.filter(book=OuterRef('pk'), status=ON_LOAN, due_back__isnull=False)
+                    .order_by('due_back').values('due_back')[:1])
+
+
+def refresh_due_back(book_ids):
+    book_ids = {pk for pk in book_ids if pk is not None}
+    for chunk in chunks(book_ids, INDEX_CHUNK_SIZE):
+        Book.objects.filter(pk__in=chunk).update(next_due_back=next_due_back())
+
+
+def status_count(status):
+    return Coalesce(Subquery(BookInstance.objects.filter(book=OuterRef('pk'), status=status).order_by()
+                             .values('book').annotate(count=Count('pk')).values('count'),
+                             output_field=IntegerField()), Value(0))
+
+
+# id всех книг по возрастанию: каждая порция читается отдельным запросом от последнего прочитанного id
+def all_book_ids():
+    last = 0
+    while True:
+        ids = list(Book.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:INDEX_CHUNK_SIZE])
+        yield from ids
+        if len(ids) < INDEX_CHUNK_SIZE:
+            return
+        last = ids[-1]
+
+
+# Пересчёт сводки по таблице экземпляров для книг book_ids (None - все книги) порциями по INDEX_CHUNK_SIZE:
+# число параметров запроса ограничено, а UPDATE каждой порции блокирует только её строки, и выдачи
+# и возвраты других книг (status_changed) не ждут пересчёта всего каталога
+def rebuild(book_ids=None):
+    fields = {field: status_count(status) for status, field in STATUS_FIELDS.items()}
+    book_ids = all_book_ids() if book_ids is None else sorted({pk for pk in book_ids if pk is not None})
+    return sum(Book.objects.filter(pk__in=chunk).update(next_due_back=next_due_back(), **fields)
+               for chunk in chunks(book_ids, INDEX_CHUNK_SIZE))
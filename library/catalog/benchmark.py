@@ -0,0 +1,171 @@
+# Инструменты для замера производительности представлений каталога.
+# Для каждого запроса считаются: количество SQL-запросов, суммарное время SQL,
+# время отрисовки шаблона и общее время обработки запроса.
+# Используются тестами (catalog/tests.py) и командой manage.py benchmark_views.
+import datetime
+import json
+import math
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+from django.contrib.auth.models import Permission, User
+from django.db import connection
+from django.template.backends.django import Template
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .generator import CatalogGenerator
+from .models import BookInstance
+
+
+# Результат замера одного запроса к представлению
+class ViewMetrics:
+    def __init__(self, name, method='get'):
+        self.name = name
+        self.method = method
+        self.status_code = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self.total_time = 0.0
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'method': self.method,
+            'status_code': self.status_code,
+            'queries': self.queries,
+            'sql_ms': round(self.sql_time * 1000, 3),
+            'render_ms': round(self.render_time * 1000, 3),
+            'total_ms': round(self.total_time * 1000, 3),
+        }
+
+    def __str__(self):
+        return '{name:<24} {method:<5} {status_code!s:<5} {queries:>7} {sql_ms:>10} {render_ms:>10} {total_ms:>10}'.format(
+            **self.as_dict())
+
+
+REPORT_HEADER = '{0:<24} {1:<5} {2:<5} {3:>7} {4:>10} {5:>10} {6:>10}'.format(
+    'view', 'meth', 'code', 'queries', 'sql ms', 'render ms', 'total ms')
+
+
+# Контекстный менеджер замера: перехватывает SQL-запросы текущего соединения
+# и время отрисовки шаблонов верхнего уровня (вложенные шаблоны виджетов не суммируются повторно).
+@contextmanager
+def measure(name, method='get'):
+    metrics = ViewMetrics(name, method)
+    original_render = Template.render
+    depth = [0]
+
+    def timed_render(template, context=None, request=None):
+        depth[0] += 1
+        start = time.perf_counter()
+        try:
+            return original_render(template, context, request)
+        finally:
+            depth[0] -= 1
+            if depth[0] == 0:
+                metrics.render_time += time.perf_counter() - start
+
+    start = time.perf_counter()
+    with CaptureQueriesContext(connection) as captured, mock.patch.object(Template, 'render', timed_render):
+        yield metrics
+    metrics.total_time = time.perf_counter() - start
+    metrics.queries = len(captured.captured_queries)
+    metrics.sql_time = sum(float(query['time']) for query in captured.captured_queries)
+
+
+# Выполняет один запрос тестовым клиентом и возвращает его метрики
+# data - данные формы или строка JSON (отправляется как application/json)
+def measure_request(client, name, method, url, data=None):
+    kwargs = {'content_type': 'application/json'} if isinstance(data, str) else {}
+    with measure(name, method) as metrics:
+        response = getattr(client, method)(url, data, **kwargs)
+        # Потоковый ответ формируется при чтении - читаем его внутри замера
+        if response.streaming:
+            b''.join(response.streaming_content)
+    metrics.status_code = response.status_code
+    return metrics
+
+
+# Процентиль (0-100) по методу ближайшего ранга; values должны быть отсортированы
+def percentile(values, percent):
+    if not values:
+        return None
+    rank = max(math.ceil(len(values) * percent / 100), 1)
+    return values[rank - 1]
+
+
+# План обхода всех маршрутов catalog/urls.py:
+# (имя маршрута, метод, url, данные формы или JSON, роль пользователя, изменяет ли запрос данные)
+def route_plan(book, author, copy):
+    renewal_date = datetime.date.today() + datetime.timedelta(weeks=2)
+    return [
+        ('index', 'get', reverse('index'), None, None, False),
+        ('book', 'get', reverse('book'), None, None, False),
+        ('book-detail', 'get', reverse('book-detail', args=[book.pk]), None, None, False),
+        ('authors', 'get', reverse('authors'), None, None, False),
+        ('author-detail', 'get', reverse('author-detail', args=[author.pk]), None, None, False),
+        ('search', 'get', reverse('search'), {'q': book.title}, None, False),
+        ('api-search', 'get', reverse('api-search'), {'q': book.title}, None, False),
+        ('async-index', 'get', reverse('async-index'), None, None, False),
+        ('async-book', 'get', reverse('async-book'), None, None, False),
+        ('async-book-detail', 'get', reverse('async-book-detail', args=[book.pk]), None, None, False),
+        ('async-authors', 'get', reverse('async-authors'), None, None, False),
+        ('async-author-detail', 'get', reverse('async-author-detail', args=[author.pk]), None, None, False),
+        ('async-my-borrowed', 'get', reverse('async-my-borrowed'), None, 'reader', False),
+        ('async-all-borrowed', 'get', reverse('async-all-borrowed'), None, 'librarian', False),
+        ('async-all-books', 'get', reverse('async-all-books'), None, 'librarian', False),
+        ('api-books', 'get', reverse('api-books'), None, None, False),
+        ('api-book-detail', 'get', reverse('api-book-detail', args=[book.pk]), None, None, False),
+        ('api-book-copies', 'get', reverse('api-book-copies', args=[book.pk]), None, None, False),
+        ('api-authors', 'get', reverse('api-authors'), None, None, False),
+        ('api-author-detail', 'get', reverse('api-author-detail', args=[author.pk]), None, None, False),
+        ('api-genres', 'get', reverse('api-genres'), None, None, False),
+        ('api-languages', 'get', reverse('api-languages'), None, None, False),
+        ('api-autocomplete-authors', 'get', reverse('api-autocomplete-authors'), {'q': author.last_name[:3]},
+         None, False),
+        ('api-autocomplete-genres', 'get', reverse('api-autocomplete-genres'), {'q': 'Р'}, None, False),
+        ('api-autocomplete-languages', 'get', reverse('api-autocomplete-languages'), {'q': 'Р'}, None, False),
+        ('my-borrowed', 'get', reverse('my-borrowed'), None, 'reader', False),
+        ('all-borrowed', 'get', reverse('all-borrowed'), None, 'librarian', False),
+        ('all-books', 'get', reverse('all-books'), None, 'librarian', False),
+        ('renew-book-librarian', 'get', reverse('renew-book-librarian', args=[copy.pk]), None, 'librarian', False),
+        ('renew-book-librarian', 'post', reverse('renew-book-librarian', args=[copy.pk]),
+         {'due_back': renewal_date.isoformat()}, 'librarian', True),
+        ('bulk-loans', 'get', reverse('bulk-loans'), None, 'librarian', False),
+        ('bulk-loans', 'post', reverse('bulk-loans'),
+         {'copies': str(copy.pk), 'due_back': renewal_date.isoformat()}, 'librarian', True),
+        ('api-bulk-loans', 'post', reverse('api-bulk-loans'),
+         json.dumps({'copies': [str(copy.pk)], 'due_back': renewal_date.isoformat()}), 'librarian', True),
+        ('api-circulation', 'post', reverse('api-circulation', args=['hold']),
+         json.dumps({'book': book.pk, 'user': copy.borrower_id or User.objects.order_by('pk').first().pk}),
+         'librarian', True),
+        ('export', 'get', reverse('export', args=['loans', 'csv']), None, 'librarian', False),
+        ('cache-stats', 'get', reverse('cache-stats'), None, 'librarian', False),
+        ('author-create', 'get', reverse('author-create'), None, 'librarian', False),
+        ('author-update', 'get', reverse('author-update', args=[author.pk]), None, 'librarian', False),
+        ('author-delete', 'get', reverse('author-delete', args=[author.pk]), None, 'librarian', False),
+        ('book-create', 'get', reverse('book-create'), None, 'librarian', False),
+        ('book-update', 'get', reverse('book-update', args=[book.pk]), None, 'librarian', False),
+        ('book-delete', 'get', reverse('book-delete', args=[book.pk]), None, 'librarian', False),
+    ]
+
+
+# Пользователи для обхода маршрутов: читатель и библиотекарь с правом can_mark_returned
+def benchmark_users():
+    reader, _ = User.objects.get_or_create(username='benchmark_reader')
+    librarian, _ = User.objects.get_or_create(username='benchmark_librarian')
+    librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+    return {'reader': reader, 'librarian': librarian}
+
+
+# Наполняет базу синтетическим каталогом (см. catalog/generator.py) и выдаёт
+# каждому из пользователей borrowers по loans_per_user взятых книг.
+def seed_catalog(authors=1000, books=3000, copies=6000, borrowers=(), loans_per_user=60, seed=0):
+    CatalogGenerator(seed=seed).generate(authors=authors, books=books, copies=copies, borrowers=50)
+    loans = BookInstance.objects.filter(status='в').order_by('pk').values_list('pk', flat=True)
+    for number, user in enumerate(borrowers):
+        ids = list(loans[number * loans_per_user:(number + 1) * loans_per_user])
+        BookInstance.objects.filter(pk__in=ids).update(borrower=user)
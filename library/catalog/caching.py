@@ -0,0 +1,194 @@
+# Кэш страниц каталога с версионированными ключами.
+# Ключ страницы включает версии данных, которые она показывает: при изменении данных сигналы
+# (catalog/signals.py) увеличивают версию, и следующий запрос строит страницу заново - старые записи
+# просто вытесняются из кэша. Версии бывают общие ('books', 'authors', ...) и отдельных объектов
+# ('book:<id>', 'author:<id>'): изменение экземпляра книги сбрасывает только страницы этой книги и её автора.
+# Версии, страницы и счётчики попаданий хранятся в кэше Django (settings.CACHES): в тестах это
+# локальная память процесса, на сервере из нескольких процессов - общий кэш (Redis, Memcached).
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+
+# Общая версия всего каталога (массовая загрузка данных)
+CATALOG = 'catalog'
+BOOKS = 'books'
+AUTHORS = 'authors'
+GENRES = 'genres'
+LANGUAGES = 'languages'
+# Доступность экземпляров в списке книг (статусы экземпляров и даты возврата)
+AVAILABILITY = 'availability'
+
+# Имена кэшируемых страниц и фрагментов (для счётчиков попаданий)
+BOOK_LIST = 'book-list'
+BOOK_DETAIL = 'book-detail'
+AUTHOR_DETAIL = 'author-detail'
+SIDEBAR = 'sidebar'
+NAMES = (BOOK_LIST, BOOK_DETAIL, AUTHOR_DETAIL, SIDEBAR)
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE', 'default')]
+
+
+# Время хранения страниц и фрагментов в секундах; 0 - кэширование отключено
+def get_timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+
+def book_version(pk):
+    return 'book:{0}'.format(pk)
+
+
+def author_version(pk):
+    return 'author:{0}'.format(pk)
+
+
+def version_key(name):
+    return 'catalog:version:{0}'.format(name)
+
+
+# Увеличивает версии names. Внутри транзакции версии увеличиваются ещё раз после её фиксации:
+# страница, построенная до фиксации (другим процессом по старым данным), сохранена в кэше уже под
+# увеличенной версией и после фиксации отдаваться не должна.
+def bump(*names):
+    increment(names)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: increment(names))
+
+
+# Версии хранятся без срока действия; если версия вытеснена из кэша,
+# она создаётся заново от текущего времени и не совпадает ни с одной прежней.
+def increment(names):
+    cache = get_cache()
+    for name in names:
+        try:
+            cache.incr(version_key(name))
+        except ValueError:
+            cache.add(version_key(name), time.time_ns() // 1000, timeout=None)
+
+
+# Текущие версии names одним обращением к кэшу
+def get_versions(names):
+    cache = get_cache()
+    keys = [version_key(name) for name in names]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, time.time_ns() // 1000, timeout=None)
+            values[key] = cache.get(key)
+    return [values[key] for key in keys]
+
+
+# Счётчики попаданий и промахов (общие для всех процессов, если кэш общий)
+def count(name, hit):
+    cache = get_cache()
+    key = 'catalog:stats:{0}:{1}'.format(name, 'hits' if hit else 'misses')
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Первое обращение или счётчик вытеснен; при одновременном создании одно увеличение может потеряться
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def stats():
+    keys = {(name, kind): 'catalog:stats:{0}:{1}'.format(name, kind) for name in NAMES for kind in ('hits', 'misses')}
+    values = get_cache().get_many(keys.values())
+    result = {}
+    for name in NAMES:
+        hits, misses = values.get(keys[name, 'hits'], 0), values.get(keys[name, 'misses'], 0)
+        result[name] = {'hits': hits, 'misses': misses,
+                        'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None}
+    return result
+
+
+def make_key(name, versions, parts):
+    data = '|'.join([name] + [str(value) for value in versions] + [str(part) for part in parts])
+    return 'catalog:{0}:{1}'.format(name, hashlib.md5(data.encode()).hexdigest())
+
+
+# Права, от которых зависит разметка страниц и боковой панели (perms.* в шаблонах)
+PAGE_PERMISSIONS = ('catalog.can_mark_returned',)
+
+
+# Страница зависит от пользователя (имя и ссылки для сотрудников в боковой панели, кнопки изменения),
+# поэтому анонимные посетители получают общую копию, а вошедшие - свою. В вариант входят и права
+# пользователя: после выдачи или отзыва права страница строится заново, а не берётся из кэша.
+def user_variant(request):
+    user = request.user
+    if not user.is_authenticated:
+        return 'anonymous'
+    return (user.pk, user.get_username(), user.is_staff,
+            tuple(perm for perm in PAGE_PERMISSIONS if user.has_perm(perm)))
+
+
+# Примесь для DetailView и ListView: готовая страница берётся из кэша без запросов к данным.
+# page_name - имя страницы для счётчиков, get_page_versions() - версии данных страницы.
+# get_data_versions() - версии, имена которых известны только по данным (например, автор книги): вызывается
+# при построении страницы до загрузки данных, имена и значения версий хранятся вместе со страницей
+# и сверяются с текущими при попадании.
+# Асинхронные представления (catalog/async_views.py) используют get_cached_page() и store_page() так же.
+class CachedPageMixin:
+    page_name = None
+
+    def get_page_versions(self):
+        return [CATALOG]
+
+    def get_data_versions(self):
+        return []
+
+    # Ключ страницы запроса и готовый ответ из кэша или None
+    def get_cached_page(self):
+        request = self.request
+        key = make_key(self.page_name, get_versions(self.get_page_versions()),
+                       [request.get_full_path(), user_variant(request)])
+        cached = get_cache().get(key)
+        if cached is not None and cached[2] and get_versions(cached[2]) != cached[3]:
+            cached = None
+        count(self.page_name, cached is not None)
+        if cached is None:
+            return key, None
+        content, content_type = cached[:2]
+        return key, HttpResponse(content, content_type=content_type)
+
+    def get(self, request, *args, **kwargs):
+        if not get_timeout():
+            return super().get(request, *args, **kwargs)
+        key, cached = self.get_cached_page()
+        if cached is not None:
+            return cached
+
+        names = self.get_data_versions()
+        versions = get_versions(names) if names else []
+        response = super().get(request, *args, **kwargs)
+        response.render()
+        store_page(key, response, names, versions)
+        return response
+
+
+# Сохранение отрисованной страницы; names и versions - версии данных, прочитанные до загрузки данных
+def store_page(key, response, names, versions):
+    if response.status_code == 200:
+        get_cache().set(key, (response.content, response['Content-Type'], names, versions), get_timeout())
+
+
+# Боковая панель base_generic.html: зависит только от пользователя, его прав и текущего адреса
+# (ссылки входа/выхода).
+def render_sidebar(context):
+    request = context['request']
+    timeout = get_timeout()
+    if not timeout:
+        return render_to_string('catalog/sidebar.html', context.flatten())
+    cache = get_cache()
+    key = make_key(SIDEBAR, get_versions([CATALOG]), [request.path, user_variant(request)])
+    html = cache.get(key)
+    count(SIDEBAR, html is not None)
+    if html is None:
+        html = render_to_string('catalog/sidebar.html', context.flatten())
+        cache.set(key, html, timeout)
+    return html
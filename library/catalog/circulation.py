@@ -0,0 +1,221 @@
+# Операции выдачи и возврата экземпляров книг.
+# Выдача, возврат и очередь заявок рассчитаны на одновременную работу нескольких столов выдачи:
+# экземпляр и заявка выбираются SELECT ... FOR UPDATE SKIP LOCKED - строку, которую уже обрабатывает
+# другая транзакция, запрос пропускает и берёт следующую, не дожидаясь снятия блокировки.
+# Поэтому один экземпляр не выдаётся дважды, а одновременные выдачи одной книги не выстраиваются в очередь.
+# Изменения сохраняются через save(update_fields=...), и сигналы обновляют счётчики, сводку доступности и кэш.
+# Эти общие для всех выдач строки обновляются уже после фиксации транзакции (signals.deferred_writes),
+# поэтому транзакция выдачи блокирует только свой экземпляр и заявку.
+# В SQLite блокировок строк нет, запись в БД там и так выполняется по одной транзакции.
+import datetime
+import uuid
+from collections import Counter
+from functools import partial
+
+from django.db import models, transaction
+
+from .models import Book, BookInstance, Hold
+from .signals import book_instances_updated, deferred_writes
+
+AVAILABLE = 'д'
+ON_LOAN = 'в'
+RESERVED = 'з'
+
+# Срок выдачи по умолчанию
+LOAN_PERIOD = datetime.timedelta(weeks=3)
+
+
+# Ошибка выдачи, возврата или заявки; текст показывается библиотекарю
+class CirculationError(Exception):
+    pass
+
+
+# Массовое продление и возврат экземпляров. ids - идентификаторы (строки), due_back - новая дата возврата,
+# status - новый статус; при возврате (статус 'д') дата возврата и заёмщик очищаются.
+# Все подходящие экземпляры изменяются одним UPDATE ... WHERE id IN (...) в одной транзакции.
+# Возвращает список изменённых идентификаторов и словарь {идентификатор: причина ошибки}.
+def bulk_update_loans(ids, due_back=None, status=None):
+    failures = {}
+    pks = {}
+    for value in ids:
+        try:
+            pks[uuid.UUID(str(value))] = value
+        except ValueError:
+            failures[value] = 'Неверный идентификатор'
+
+    fields = {}
+    if due_back is not None:
+        fields['due_back'] = due_back
+    if status:
+        fields['status'] = status
+        if status == AVAILABLE:
+            fields.update(due_back=None, borrower=None)
+
+    with transaction.atomic():
+        stored = {pk: (old_status, book_id) for pk, old_status, book_id in BookInstance.objects.select_for_update()
+                  .filter(pk__in=list(pks)).values_list('pk', 'status', 'book_id')}
+        updated = []
+        for pk, value in pks.items():
+            if pk not in stored:
+                failures[value] = 'Экземпляр не найден'
+            elif not status and stored[pk][0] != ON_LOAN:
+                failures[value] = 'Экземпляр не выдан - продлить нельзя'
+            elif status and due_back is None and stored[pk][0] == status:
+                failures[value] = 'Статус не изменился'
+            else:
+                updated.append(pk)
+
+        if updated and fields:
+            # Версия увеличивается: формы, открытые до массового изменения, не перезапишут его
+            BookInstance.objects.filter(pk__in=updated).update(version=models.F('version') + 1, **fields)
+            status_changes = Counter((stored[pk][0], status) for pk in updated) if status else {}
+            book_instances_updated.send(sender=BookInstance, pks=updated, fields=list(fields),
+                                        book_ids={stored[pk][1] for pk in updated},
+                                        status_changes=status_changes)
+            if status == AVAILABLE:
+                serve_holds(updated)
+    return [pks[pk] for pk in updated], failures
+
+
+# Первый свободный (не заблокированный другой транзакцией) экземпляр книги в статусе status или None
+def lock_copy(book_id, status=AVAILABLE):
+    copies = BookInstance.objects.select_for_update(skip_locked=True).filter(book_id=book_id, status=status)
+    return next(iter(copies.order_by()[:1]), None)
+
+
+# Первая заявка очереди книги без экземпляра или None
+def lock_next_hold(book_id):
+    holds = Hold.objects.select_for_update(skip_locked=True).filter(book_id=book_id, copy__isnull=True)
+    return next(iter(holds.order_by('created', 'id')[:1]), None)
+
+
+def check_book(book_id):
+    if not Book.objects.filter(pk=book_id).exists():
+        raise CirculationError('Книга не найдена')
+
+
+# Доступный экземпляр не выдаётся в обход очереди: его ждут заявки без экземпляра, созданные раньше
+# заявки читателя hold (или любые, если заявки у читателя нет)
+def check_queue(book_id, hold):
+    waiting = Hold.objects.filter(book_id=book_id, copy__isnull=True)
+    if hold is not None:
+        waiting = waiting.filter(models.Q(created__lt=hold.created) | models.Q(created=hold.created, id__lt=hold.id))
+    if waiting.exists():
+        raise CirculationError('Книгу ждут читатели из очереди заявок')
+
+
+# Освободившийся экземпляр резервируется для первой заявки очереди, если она есть, иначе становится доступным.
+# Возвращает заявку, для которой зарезервирован экземпляр, или None.
+def release_copy(copy):
+    hold = lock_next_hold(copy.book_id)
+    copy.status = RESERVED if hold else AVAILABLE
+    copy.borrower = None
+    copy.due_back = None
+    copy.save(update_fields=['status', 'borrower', 'due_back'])
+    if hold:
+        hold.copy = copy
+        hold.save(update_fields=['copy'])
+    else:
+        # Заявка, созданная одновременно, ещё не видна этой транзакции (см. serve_book_holds)
+        transaction.on_commit(partial(serve_book_holds, copy.book_id))
+    return hold
+
+
+# Экземпляры pks стали доступными в обход return_copy (массовый возврат, форма админ-панели):
+# экземпляры книг, которые ждут заявки, резервируются для них по очереди
+def serve_holds(pks):
+    book_ids = set(BookInstance.objects.filter(pk__in=pks).values_list('book_id', flat=True))
+    waiting = set(Hold.objects.filter(book_id__in=book_ids, copy__isnull=True).values_list('book_id', flat=True))
+    if not waiting:
+        return
+    copies = BookInstance.objects.select_for_update().filter(pk__in=pks, book_id__in=waiting, status=AVAILABLE)
+    for copy in copies.order_by('pk'):
+        # Заявки книги закончились - остальные её экземпляры остаются доступными
+        if copy.book_id in waiting and release_copy(copy) is None:
+            waiting.discard(copy.book_id)
+
+
+# Доступные экземпляры книги book_id резервируются для заявок её очереди.
+# Вызывается после фиксации place_hold и возврата без заявки: при READ COMMITTED возврат может не увидеть
+# ещё не зафиксированную заявку и сделать экземпляр доступным, а заявка - не увидеть ещё не зафиксированный
+# возврат и встать в очередь без экземпляра. Обе стороны проверяют очередь после своей фиксации,
+# и хотя бы одна из проверок видит и заявку, и доступный экземпляр.
+def serve_book_holds(book_id):
+    with deferred_writes(), transaction.atomic():
+        if Hold.objects.filter(book_id=book_id, copy__isnull=True).exists():
+            serve_holds(BookInstance.objects.filter(book_id=book_id, status=AVAILABLE).values_list('pk', flat=True))
+
+
+# Выдача книги book_id читателю user: зарезервированный для его заявки экземпляр или любой доступный.
+# Возвращает выданный экземпляр; если выдавать нечего - CirculationError.
+def checkout(book_id, user, due_back=None):
+    due_back = due_back or datetime.date.today() + LOAN_PERIOD
+    with deferred_writes(), transaction.atomic():
+        hold = Hold.objects.select_for_update().filter(book_id=book_id, user=user).first()
+        copy = None
+        if hold is not None and hold.copy_id is not None:
+            copy = BookInstance.objects.select_for_update().filter(pk=hold.copy_id, status=RESERVED).first()
+        if copy is None:
+            check_book(book_id)
+            check_queue(book_id, hold)
+            copy = lock_copy(book_id)
+        if copy is None:
+            raise CirculationError('Нет доступных экземпляров')
+        copy.status = ON_LOAN
+        copy.borrower = user
+        copy.due_back = due_back
+        copy.save(update_fields=['status', 'borrower', 'due_back'])
+        if hold is not None:
+            hold.delete()
+    return copy
+
+
+# Возврат экземпляра copy_id. Возвращает заявку, для которой экземпляр зарезервирован, или None.
+def return_copy(copy_id):
+    with deferred_writes(), transaction.atomic():
+        copy = BookInstance.objects.select_for_update().filter(pk=copy_id).first()
+        if copy is None:
+            raise CirculationError('Экземпляр не найден')
+        if copy.status != ON_LOAN:
+            raise CirculationError('Экземпляр не выдан')
+        return release_copy(copy)
+
+
+# Заявка читателя user на книгу book_id. Если есть доступный экземпляр, он сразу резервируется,
+# иначе заявка встаёт в конец очереди. Повторная заявка возвращает существующую.
+def place_hold(book_id, user):
+    with deferred_writes(), transaction.atomic():
+        check_book(book_id)
+        hold, created = Hold.objects.get_or_create(book_id=book_id, user=user)
+        if created:
+            copy = lock_copy(book_id)
+            if copy is not None:
+                copy.status = RESERVED
+                copy.save(update_fields=['status'])
+                hold.copy = copy
+                hold.save(update_fields=['copy'])
+            else:
+                transaction.on_commit(partial(serve_book_holds, book_id))
+    return hold
+
+
+# Отмена заявки: зарезервированный для неё экземпляр переходит следующей заявке очереди
+def cancel_hold(hold_id):
+    with deferred_writes(), transaction.atomic():
+        hold = Hold.objects.select_for_update().filter(pk=hold_id).first()
+        if hold is None:
+            raise CirculationError('Заявка не найдена')
+        copy = None
+        if hold.copy_id is not None:
+            copy = BookInstance.objects.select_for_update().filter(pk=hold.copy_id, status=RESERVED).first()
+        hold.delete()
+        if copy is not None:
+            release_copy(copy)
+
+
+# Место заявки в очереди книги (1 - первая); для заявки с зарезервированным экземпляром - 0
+def queue_position(hold):
+    if hold.copy_id is not None:
+        return 0
+    return Hold.objects.filter(book_id=hold.book_id, copy__isnull=True).filter(
+        models.Q(created__lt=hold.created) | models.Q(created=hold.created, id__lte=hold.id)).count()
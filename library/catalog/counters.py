@@ -0,0 +1,48 @@
+# Материализованные счётчики каталога для домашней страницы.
+# Сигналы (catalog/signals.py) изменяют значения на +1/-1 атомарным UPDATE ... SET value = value + n,
+# а домашняя страница читает все счётчики одним запросом.
+from django.db import transaction
+from django.db.models import F
+
+from .models import Author, Book, BookInstance, CatalogCounter
+
+BOOKS = 'books'
+INSTANCES = 'instances'
+INSTANCES_AVAILABLE = 'instances_available'
+AUTHORS = 'authors'
+NAMES = (BOOKS, INSTANCES, INSTANCES_AVAILABLE, AUTHORS)
+
+# Статус доступного экземпляра
+AVAILABLE = 'д'
+
+
+def increment(name, delta=1):
+    if delta:
+        CatalogCounter.objects.filter(name=name).update(value=F('value') + delta)
+
+
+# Изменение счётчика доступных экземпляров при смене статуса count экземпляров с old_status на new_status
+def status_changed(old_status, new_status, count=1):
+    increment(INSTANCES_AVAILABLE, count * ((new_status == AVAILABLE) - (old_status == AVAILABLE)))
+
+
+# Пересчёт всех счётчиков по таблицам
+def rebuild():
+    values = {
+        BOOKS: Book.objects.count(),
+        INSTANCES: BookInstance.objects.count(),
+        INSTANCES_AVAILABLE: BookInstance.objects.filter(status=AVAILABLE).count(),
+        AUTHORS: Author.objects.count(),
+    }
+    with transaction.atomic():
+        for name, value in values.items():
+            CatalogCounter.objects.update_or_create(name=name, defaults={'value': value})
+    return values
+
+
+# Значения всех счётчиков одним запросом. Если каких-то счётчиков нет, они пересчитываются.
+def get_counts():
+    values = dict(CatalogCounter.objects.filter(name__in=NAMES).values_list('name', 'value'))
+    if len(values) < len(NAMES):
+        values = rebuild()
+    return values
@@ -0,0 +1,81 @@
+# Потоковая выгрузка каталога в CSV и JSONL.
+# Строки читаются из БД порциями через QuerySet.values_list().iterator() (в PostgreSQL - серверный курсор)
+# и сразу отдаются клиенту или пишутся в файл, поэтому расход памяти не зависит от размера таблиц.
+# Столбцы выгрузки экземпляров совпадают со столбцами CSV для import_catalog (см. catalog/importer.py).
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Author, Book, BookInstance
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8'}
+# Сколько строк читается из БД за раз
+CHUNK_SIZE = 2000
+
+COPY_COLUMNS = [
+    ('title', 'book__title'),
+    ('author_last_name', 'book__author__last_name'),
+    ('author_first_name', 'book__author__first_name'),
+    ('isbn', 'book__isbn'),
+    ('language', 'book__language__name'),
+    ('copy_id', 'id'),
+    ('imprint', 'imprint'),
+    ('status', 'status'),
+    ('due_back', 'due_back'),
+    ('borrower', 'borrower__username'),
+    ('borrower_last_name', 'borrower__last_name'),
+    ('borrower_first_name', 'borrower__first_name'),
+]
+
+# Выгрузка: набор запросов (функция - чтобы запрос строился при каждом обращении) и столбцы (заголовок, поле)
+EXPORTS = {
+    'books': (lambda: Book.objects.order_by('pk'), [
+        ('id', 'id'), ('title', 'title'), ('author_last_name', 'author__last_name'),
+        ('author_first_name', 'author__first_name'), ('isbn', 'isbn'), ('language', 'language__name'),
+        ('summary', 'summary'),
+    ]),
+    'authors': (lambda: Author.objects.order_by('pk'), [
+        ('id', 'id'), ('last_name', 'last_name'), ('first_name', 'first_name'),
+        ('date_of_birth', 'date_of_birth'), ('date_of_death', 'date_of_death'),
+    ]),
+    # Все экземпляры; экземпляры одной книги идут подряд (сортировка по book_id - без JOIN по названию книги)
+    'copies': (lambda: BookInstance.objects.order_by('book_id', 'pk'), COPY_COLUMNS),
+    # Взятые экземпляры, начиная с самых давних (частичный индекс bookinst_loaned_due_idx)
+    'loans': (lambda: BookInstance.objects.filter(status='в').order_by('due_back', 'pk'), COPY_COLUMNS),
+}
+
+
+# Заголовок и строки выгрузки name
+def export_rows(name, chunk_size=CHUNK_SIZE):
+    queryset, columns = EXPORTS[name]
+    header = [column for column, _ in columns]
+    rows = queryset().values_list(*[lookup for _, lookup in columns]).iterator(chunk_size=chunk_size)
+    return header, rows
+
+
+# Объект с методом write для csv.writer: возвращает строку вместо записи в файл
+class Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), ensure_ascii=False, cls=DjangoJSONEncoder) + '\n'
+
+
+# Строки выгрузки name в формате file_format ('csv' или 'jsonl')
+def export_lines(name, file_format, chunk_size=CHUNK_SIZE):
+    header, rows = export_rows(name, chunk_size)
+    if file_format == 'csv':
+        return csv_lines(header, rows)
+    return jsonl_lines(header, rows)
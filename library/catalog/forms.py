@@ -2,9 +2,25 @@ from django import forms
 from django.core.exceptions import ValidationError
 # gettext_lazy возвращает объект, который со временем можно превратить в строку и перевести.
 from django.forms import ModelForm
+from django.forms.models import ModelChoiceIterator
+from django.urls import reverse
 from django.utils.translation import gettext_lazy as _  # Пока не работает, переводить не хочет. Разобраться позже.
 import datetime     # Для проверки диапазона дат продления.
-from .models import BookInstance
+from django.contrib.auth.models import User
+from . import lookups
+from .models import Book, BookInstance
+
+
+# Проверка новой даты возврата: не в прошлом и не более чем на 4 недели вперёд.
+# Используется формой продления одного экземпляра и массовым продлением (catalog/circulation.py).
+def validate_due_back(data):
+    # Проверка того, что дата не выходит за "нижнюю" границу (не в прошлом).
+    if data < datetime.date.today():
+        raise ValidationError(_('Неверная дата - Продление в прошое'))
+
+    # Проверка того, что дата не выходит за "верхнюю" границу (+4 недели).
+    if data > datetime.date.today() + datetime.timedelta(weeks=4):
+        raise ValidationError(_('Неверная дата - Указано продление более, чем на 4 недели вперёд'))
 
 
 class RenewBookForm(forms.Form):
@@ -32,17 +48,102 @@ class RenewBookForm(forms.Form):
 
 
 
-class RenewBookModelForm(ModelForm):
+# Форма изменения записи с оптимистической блокировкой (models.VersionedModel): скрытое поле хранит версию
+# записи на момент открытия формы. Если запись изменили позже, форма не проходит проверку
+# и не перезаписывает чужое изменение.
+# Поле называется не version: поле модели version не редактируется, и ModelForm не допускает его в fields.
+class VersionedModelForm(ModelForm):
+    loaded_version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.instance._state.adding:
+            self.initial.setdefault('loaded_version', self.instance.version)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        version = cleaned_data.get('loaded_version')
+        if not self.instance._state.adding and version is not None and version != self.instance.version:
+            raise ValidationError(_('Запись изменена другим пользователем после открытия формы. '
+                                    'Обновите страницу, чтобы увидеть изменения.'), code='conflict')
+        return cleaned_data
+
+
+# Выбор из большой таблицы с автодополнением: в HTML выводятся только выбранные варианты, остальные
+# сценарий js/autocomplete.js загружает по мере ввода из JSON по адресу url_name (catalog/api.py).
+class AutocompleteMixin:
+    class Media:
+        js = ('js/autocomplete.js',)
+
+    def __init__(self, url_name, attrs=None):
+        super().__init__(attrs)
+        self.url_name = url_name
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs['data-autocomplete-url'] = reverse(self.url_name)
+        return attrs
+
+    # Пустой вариант и выбранные варианты: из QuerySet поля - одним запросом по первичному ключу,
+    # из готового списка (справочники в памяти) - без запросов
+    def selected_choices(self, selected):
+        if isinstance(self.choices, ModelChoiceIterator):
+            field = self.choices.field
+            if field.empty_label is not None:
+                yield '', field.empty_label
+            if selected:
+                try:
+                    objects = list(field.queryset.filter(pk__in=selected))
+                except (ValueError, ValidationError):
+                    # Неверное значение из отправленной формы - ошибку покажет проверка поля
+                    objects = []
+                for obj in objects:
+                    yield self.choices.choice(obj)
+        else:
+            for value, label in self.choices:
+                if value == '' or str(value) in selected:
+                    yield value, label
+
+    def optgroups(self, name, value, attrs=None):
+        selected = {str(item) for item in value if item not in (None, '')}
+        options = [self.create_option(name, choice, label, str(choice) in selected, index)
+                   for index, (choice, label) in enumerate(self.selected_choices(selected))]
+        return [(None, options, 0)]
+
+
+class AutocompleteSelect(AutocompleteMixin, forms.Select):
+    pass
+
+
+class AutocompleteSelectMultiple(AutocompleteMixin, forms.SelectMultiple):
+    pass
+
+
+# Форма создания и изменения книги. Автор, жанры и язык выбираются автодополнением: страница формы
+# не зависит от размера таблиц. Выбранные жанры и язык подписываются по справочникам в памяти
+# (catalog/lookups.py) без запросов к БД; выбранные значения при отправке формы проверяются по БД.
+class BookForm(VersionedModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['genre'].choices = lookups.genre_choices()
+        self.fields['language'].choices = [('', self.fields['language'].empty_label)] + lookups.language_choices()
+
+    class Meta:
+        model = Book
+        fields = ['title', 'author', 'summary', 'isbn', 'genre', 'language']
+        widgets = {
+            'author': AutocompleteSelect('api-autocomplete-authors'),
+            'genre': AutocompleteSelectMultiple('api-autocomplete-genres'),
+            'language': AutocompleteSelect('api-autocomplete-languages'),
+        }
+
+
+class RenewBookModelForm(VersionedModelForm):
     def clean_due_back(self):
        data = self.cleaned_data['due_back']
 
-       #Проверка того, что дата не в прошлом
-       if data < datetime.date.today():
-           raise ValidationError(_('Неверная дата - Продление в прошое'))
-
-       # Проверка того, что дата не выходит за "верхнюю" границу (+4 недели).
-       if data > datetime.date.today() + datetime.timedelta(weeks=4):
-           raise ValidationError(_('Неверная дата - Указано продление более, чем на 4 недели вперёд'))
+       # Проверка того, что дата не в прошлом и не более чем на 4 недели вперёд
+       validate_due_back(data)
 
        # Возвращаем "очищенные", проверенные, а затем приведённые к стандартным типам данные.
        return data
@@ -51,4 +152,75 @@ class RenewBookModelForm(ModelForm):
         model = BookInstance
         fields = ['due_back', ]
         labels = {'due_back': _('Новая дата возврата '), }
-        help_texts = {'due_back': _('Введите дату между сегодняшним днём и 4 неделями позже (по умолчанию 3).'), }
\ No newline at end of file
+        help_texts = {'due_back': _('Введите дату между сегодняшним днём и 4 неделями позже (по умолчанию 3).'), }
+
+
+# Список идентификаторов экземпляров: строка (через пробел, запятую или с новой строки) или список строк.
+# Сами идентификаторы проверяются поштучно при применении изменений - ошибка в одном не отменяет остальные.
+class CopyIdListField(forms.Field):
+    widget = forms.Textarea
+
+    def __init__(self, max_items=1000, **kwargs):
+        self.max_items = max_items
+        super().__init__(**kwargs)
+
+    def to_python(self, value):
+        if not value:
+            return []
+        if isinstance(value, str):
+            value = value.replace(',', ' ').split()
+        if not isinstance(value, (list, tuple)):
+            raise ValidationError(_('Ожидается список идентификаторов'))
+        # Повторы убираются, порядок сохраняется
+        return list(dict.fromkeys(str(item).strip() for item in value if str(item).strip()))
+
+    def validate(self, value):
+        super().validate(value)
+        if len(value) > self.max_items:
+            raise ValidationError(_('Не более %(max)d экземпляров за раз'), params={'max': self.max_items})
+
+
+# Форма массового продления и возврата экземпляров книг
+class BulkLoanForm(forms.Form):
+    copies = CopyIdListField(label=_('Экземпляры'), help_text=_('ID экземпляров через пробел или с новой строки'))
+    due_back = forms.DateField(label=_('Новая дата возврата'), required=False,
+                               help_text=_('Введите дату между сегодняшним днём и 4 неделями позже.'))
+    status = forms.ChoiceField(label=_('Новый статус'), required=False,
+                               choices=[('', '---------')] + list(BookInstance.LOAN_STATUS))
+
+    def clean_due_back(self):
+        data = self.cleaned_data['due_back']
+        if data is not None:
+            validate_due_back(data)
+        return data
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('due_back') and not cleaned_data.get('status') and not self.errors:
+            raise ValidationError(_('Укажите новую дату возврата или новый статус'))
+        # Возвращённый экземпляр доступен, дата возврата у него не указывается
+        if cleaned_data.get('due_back') and cleaned_data.get('status') == 'д':
+            raise ValidationError(_('При возврате книги дата возврата не указывается'))
+        return cleaned_data
+
+
+# Формы операций столов выдачи (catalog/circulation.py): выдача, заявка и возврат экземпляра
+class CheckoutForm(forms.Form):
+    book = forms.IntegerField(label=_('Книга'))
+    user = forms.ModelChoiceField(User.objects.all(), label=_('Читатель'))
+    due_back = forms.DateField(label=_('Дата возврата'), required=False)
+
+    def clean_due_back(self):
+        data = self.cleaned_data['due_back']
+        if data is not None:
+            validate_due_back(data)
+        return data
+
+
+class HoldForm(forms.Form):
+    book = forms.IntegerField(label=_('Книга'))
+    user = forms.ModelChoiceField(User.objects.all(), label=_('Читатель'))
+
+
+class ReturnForm(forms.Form):
+    copy = forms.UUIDField(label=_('Экземпляр'))
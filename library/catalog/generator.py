@@ -0,0 +1,164 @@
+# Генератор синтетического каталога для нагрузочного тестирования.
+# Все записи создаются через bulk_create пачками, в памяти хранятся только идентификаторы,
+# поэтому можно генерировать миллионы экземпляров книг.
+# При одинаковом seed генерируются одинаковые данные.
+import datetime
+import itertools
+import random
+import uuid
+from array import array
+from bisect import bisect_left
+
+from django.contrib.auth.models import User
+
+from .models import Author, Book, BookInstance, Genre, Language
+from .signals import catalog_bulk_loaded
+
+FIRST_NAMES = ['Александр', 'Анна', 'Борис', 'Вера', 'Владимир', 'Галина', 'Дмитрий', 'Екатерина', 'Иван',
+               'Ирина', 'Константин', 'Лев', 'Мария', 'Михаил', 'Наталья', 'Николай', 'Ольга', 'Пётр',
+               'Светлана', 'Сергей', 'Татьяна', 'Фёдор', 'Юлия', 'Яков']
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов',
+              'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров',
+              'Павлов', 'Козлов', 'Степанов', 'Николаев', 'Орлов', 'Андреев', 'Макаров', 'Никитин']
+TITLE_WORDS = ['тайна', 'дорога', 'город', 'ночь', 'море', 'звезда', 'сад', 'дом', 'время', 'война', 'мир',
+               'лес', 'река', 'история', 'песня', 'память', 'огонь', 'путь', 'небо', 'зима', 'остров',
+               'голос', 'тень', 'письмо', 'ветер', 'сердце', 'свет', 'камень', 'берег', 'сон']
+GENRE_NAMES = ['Фантастика', 'Фэнтези', 'Детектив', 'Роман', 'Поэзия', 'Юмор', 'История', 'Биография',
+               'Приключения', 'Драма', 'Ужасы', 'Научпоп', 'Детская литература', 'Классика', 'Философия']
+LANGUAGE_NAMES = ['Русский', 'Английский', 'Немецкий', 'Французский', 'Испанский', 'Итальянский',
+                  'Китайский', 'Японский']
+IMPRINTS = ['АСТ', 'Эксмо', 'Азбука', 'Питер', 'Махаон', 'Речь', 'Альпина', 'Росмэн', 'Наука', 'Просвещение']
+
+# Доля экземпляров в каждом статусе: доступно, взято, резерв, обслуживание
+STATUS_WEIGHTS = (('д', 0.50), ('в', 0.35), ('з', 0.05), ('т', 0.10))
+
+
+# Накопленные веса распределения Ципфа: немногие элементы встречаются часто, большинство - редко.
+def zipf_cum_weights(count, exponent=1.0):
+    total = 0.0
+    cum_weights = array('d')
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** exponent
+        cum_weights.append(total)
+    return cum_weights
+
+
+class CatalogGenerator:
+    def __init__(self, seed=0, batch_size=5000, today=None, log=None):
+        self.rnd = random.Random(seed)
+        self.batch_size = batch_size
+        self.today = today or datetime.date.today()
+        self.log = log or (lambda message: None)
+
+    # Создание записей пачками: rows - генератор объектов модели. Возвращает массив созданных pk.
+    def bulk_insert(self, model, rows, collect_pks=True):
+        pks = array('q')
+        created = 0
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                break
+            model.objects.bulk_create(batch, batch_size=self.batch_size)
+            if collect_pks:
+                pks.extend(obj.pk for obj in batch)
+            created += len(batch)
+            self.log('{0}: {1}'.format(model._meta.verbose_name_plural, created))
+        return pks
+
+    # Выбор элемента по накопленным весам без создания промежуточных списков
+    def weighted_choice(self, items, cum_weights):
+        return items[bisect_left(cum_weights, self.rnd.random() * cum_weights[-1])]
+
+    def generate(self, authors=1000, books=5000, copies=20000, genres=15, languages=5, borrowers=200):
+        rnd = self.rnd
+
+        genre_names = [GENRE_NAMES[i % len(GENRE_NAMES)] + ('' if i < len(GENRE_NAMES) else ' {0}'.format(i))
+                       for i in range(genres)]
+        genre_ids = self.bulk_insert(Genre, (Genre(name=name) for name in genre_names))
+        language_ids = self.bulk_insert(Language, (
+            Language(name=LANGUAGE_NAMES[i % len(LANGUAGE_NAMES)] + (
+                '' if i < len(LANGUAGE_NAMES) else ' {0}'.format(i)))
+            for i in range(languages)))
+
+        borrower_ids = array('q')
+        if borrowers:
+            # Пароль не задаётся: пользователи нужны только как заёмщики
+            borrower_ids = self.bulk_insert(User, (
+                User(username='reader{0:07d}'.format(i), password='!', first_name=rnd.choice(FIRST_NAMES),
+                     last_name=rnd.choice(LAST_NAMES))
+                for i in range(borrowers)))
+
+        author_ids = self.bulk_insert(Author, (self.make_author() for _ in range(authors)))
+
+        # Большинство книг на одном-двух языках, у популярных авторов много книг
+        language_weights = zipf_cum_weights(len(language_ids), 1.5)
+        author_weights = zipf_cum_weights(len(author_ids), 0.8)
+        book_ids = self.bulk_insert(Book, (
+            Book(title=self.make_title(), author_id=self.weighted_choice(author_ids, author_weights),
+                 summary=self.make_summary(), isbn='978{0:010d}'.format(rnd.randrange(10 ** 10)),
+                 language_id=self.weighted_choice(language_ids, language_weights))
+            for _ in range(books)))
+
+        # Связи книга - жанр заполняются напрямую в промежуточной таблице
+        through = Book.genre.through
+        genre_weights = zipf_cum_weights(len(genre_ids), 1.0)
+
+        def book_genres():
+            for book_id in book_ids:
+                chosen = {self.weighted_choice(genre_ids, genre_weights) for _ in range(rnd.randint(1, 3))}
+                for genre_id in chosen:
+                    yield through(book_id=book_id, genre_id=genre_id)
+
+        self.bulk_insert(through, book_genres(), collect_pks=False)
+
+        # Популярные книги имеют больше экземпляров, активные читатели берут больше книг
+        popularity = zipf_cum_weights(len(book_ids), 0.7)
+        activity = zipf_cum_weights(len(borrower_ids), 0.9)
+        status_weights = list(itertools.accumulate(weight for _, weight in STATUS_WEIGHTS))
+        statuses = [status for status, _ in STATUS_WEIGHTS]
+
+        def instances():
+            for _ in range(copies):
+                status = statuses[bisect_left(status_weights, rnd.random() * status_weights[-1])]
+                instance = BookInstance(
+                    id=uuid.UUID(int=rnd.getrandbits(128), version=4),
+                    book_id=self.weighted_choice(book_ids, popularity),
+                    imprint='{0}, {1}'.format(rnd.choice(IMPRINTS), rnd.randint(1950, self.today.year)),
+                    status=status,
+                )
+                if status == 'в':
+                    # Около 15% взятых книг просрочены
+                    instance.due_back = self.today + datetime.timedelta(days=rnd.randint(-30, 28) if rnd.random() < 0.15
+                                                                        else rnd.randint(0, 28))
+                elif status == 'з':
+                    instance.due_back = self.today + datetime.timedelta(days=rnd.randint(1, 7))
+                elif status == 'т':
+                    instance.due_back = self.today + datetime.timedelta(days=rnd.randint(1, 60))
+                if status in ('в', 'з') and borrower_ids:
+                    instance.borrower_id = self.weighted_choice(borrower_ids, activity)
+                yield instance
+
+        self.bulk_insert(BookInstance, instances(), collect_pks=False)
+
+        # bulk_create не вызывает сигналы save(): производные данные (поисковый индекс и т. п.) обновляются отдельно
+        catalog_bulk_loaded.send(sender=self.__class__, book_ids=book_ids)
+
+        return {'genres': len(genre_ids), 'languages': len(language_ids), 'borrowers': len(borrower_ids),
+                'authors': len(author_ids), 'books': len(book_ids), 'copies': copies}
+
+    def make_author(self):
+        rnd = self.rnd
+        born = datetime.date(rnd.randint(1800, 1990), rnd.randint(1, 12), rnd.randint(1, 28))
+        died = None
+        if born.year < 1940 or rnd.random() < 0.1:
+            died = min(born + datetime.timedelta(days=rnd.randint(30, 90) * 365), self.today)
+        return Author(first_name=rnd.choice(FIRST_NAMES), last_name=rnd.choice(LAST_NAMES) + (
+            '' if rnd.random() < 0.3 else '-{0}'.format(rnd.randint(1, 9999))),
+            date_of_birth=born, date_of_death=died)
+
+    def make_title(self):
+        words = self.rnd.sample(TITLE_WORDS, self.rnd.randint(1, 4))
+        return ' '.join(words).capitalize()
+
+    def make_summary(self):
+        return ' '.join(self.rnd.choices(TITLE_WORDS, k=self.rnd.randint(20, 80))).capitalize() + '.'
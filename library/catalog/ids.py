@@ -0,0 +1,49 @@
+# Идентификаторы экземпляров книг.
+# UUID версии 4 случайны: новые строки попадают в случайные страницы индекса первичного ключа,
+# и при массовой загрузке индекс читается и расщепляется по всей длине. UUID версии 7 (RFC 9562)
+# начинаются с времени в миллисекундах, поэтому новые ключи добавляются в конец индекса.
+# Формат UUID тот же (36 символов), старые ключи v4 остаются действительными, адреса <uuid:pk> не меняются.
+# Для новых экземпляров v7 включается настройкой CATALOG_UUID7 = True.
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+_lock = threading.Lock()
+_last_timestamp = 0
+_last_counter = 0
+
+
+# UUID версии 7: 48 бит - время Unix в миллисекундах, 12 бит rand_a - счётчик внутри миллисекунды
+# (начинается со случайного значения), 62 бита - случайные. Ключи, созданные процессом, строго возрастают,
+# в том числе при нескольких ключах за одну миллисекунду и при переводе часов назад.
+def uuid7():
+    global _last_timestamp, _last_counter
+    with _lock:
+        timestamp = time.time_ns() // 1000000
+        if timestamp > _last_timestamp:
+            counter = int.from_bytes(os.urandom(2), 'big') & 0x7ff
+        else:
+            # Та же миллисекунда (или часы переведены назад): продолжаем счётчик прежнего времени,
+            # при переполнении счётчика время увеличивается на миллисекунду
+            timestamp = _last_timestamp
+            counter = _last_counter + 1
+            if counter > 0xfff:
+                timestamp += 1
+                counter = 0
+        _last_timestamp, _last_counter = timestamp, counter
+    random_bits = int.from_bytes(os.urandom(8), 'big') & ((1 << 62) - 1)
+    value = (timestamp << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | random_bits
+    return uuid.UUID(int=value)
+
+
+# Время создания ключа v7 в миллисекундах Unix или None для ключей других версий
+def uuid7_timestamp_ms(value):
+    return value.int >> 80 if value.version == 7 else None
+
+
+# Значение по умолчанию первичного ключа BookInstance
+def new_copy_id():
+    return uuid7() if getattr(settings, 'CATALOG_UUID7', False) else uuid.uuid4()
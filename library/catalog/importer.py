@@ -0,0 +1,404 @@
+# Потоковый импорт каталога из файлов JSON, JSONL и CSV.
+# Файл читается по частям, в памяти - только текущая пачка записей и справочники
+# (авторы, жанры, языки по естественному ключу), поэтому можно загружать миллионы экземпляров книг.
+#
+# Поддерживаемые записи:
+# - книга каталога (JSON/JSONL):
+#   {"title": ..., "author": {"last_name": ..., "first_name": ...} или "Фамилия, Имя", "summary": ..., "isbn": ...,
+#    "language": "Русский", "genre": ["Роман", ...],
+#    "copies": [{"id": <uuid>, "imprint": ..., "status": "д", "due_back": "ГГГГ-ММ-ДД"}, ...]}
+# - строка CSV - один экземпляр книги; столбцы: title, author_last_name, author_first_name, summary, isbn,
+#   language, genre (названия через ';'), copy_id, imprint, status, due_back.
+#   Подряд идущие строки одной книги (название, ISBN, автор) создают одну книгу.
+# - выгрузка manage.py dumpdata catalog (например, DB/db.json): {"model": "catalog.book", "pk": ..., "fields": ...}.
+#   Авторы, жанры и языки сопоставляются с существующими по естественному ключу, id книг и экземпляров
+#   сохраняются (как при loaddata), заёмщики не переносятся.
+#
+# Каждая пачка записывается в своей транзакции вместе с контрольной точкой - номером последней записанной
+# записи (таблица ImportCheckpoint): сбой не может оставить записанную пачку без контрольной точки или наоборот.
+# После сбоя повторный запуск продолжает импорт с контрольной точки.
+# Сигнал catalog_bulk_loaded отправляется после фиксации каждой пачки с id её книг: книги, записанные
+# до сбоя, попадают в поисковый индекс и сводку доступности, даже если повторного запуска не будет.
+# Счётчики каталога пересчитываются по таблицам один раз - после того, как импорт (или его продолжение) завершён.
+import codecs
+import csv
+import datetime
+import json
+import os
+import uuid
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from .models import Author, Book, BookInstance, Genre, ImportCheckpoint, Language
+from .signals import catalog_bulk_loaded
+
+# Метки порядка байтов: UTF-32 проверяется раньше UTF-16, у них общее начало
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+FORMATS = {'.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv'}
+# Модели выгрузки dumpdata, которые сопоставляются по естественному ключу
+REFERENCE_MODELS = ('catalog.author', 'catalog.genre', 'catalog.language')
+STATUSES = {status for status, _ in BookInstance.LOAN_STATUS}
+
+
+class CatalogImportError(Exception):
+    pass
+
+
+# Кодировка файла: по метке порядка байтов, по нулевым байтам (UTF-16 без метки),
+# иначе UTF-8, если начало файла им декодируется, или cp1251
+def detect_encoding(path, sample_size=1 << 16):
+    with open(path, 'rb') as file:
+        sample = file.read(sample_size)
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    if sample and b'\x00' in sample:
+        return 'utf-16-le' if sample[1::2].count(0) > sample[::2].count(0) else 'utf-16-be'
+    try:
+        # Декодер без final=True допускает обрезанный многобайтный символ в конце образца
+        codecs.getincrementaldecoder('utf-8')().decode(sample)
+    except UnicodeDecodeError:
+        return 'cp1251'
+    return 'utf-8'
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise CatalogImportError('Не удалось определить формат файла {0}, укажите его явно'.format(path))
+    return FORMATS[extension]
+
+
+# Элементы массива JSON верхнего уровня по одному, без чтения всего файла в память
+def iter_json_array(file, chunk_size=1 << 16):
+    decoder = json.JSONDecoder()
+    buffer, position, eof, started = '', 0, False, False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise CatalogImportError('Неожиданный конец файла JSON')
+            chunk = file.read(chunk_size)
+            buffer, position, eof = chunk, 0, not chunk
+            continue
+        if not started:
+            if buffer[position] != '[':
+                raise CatalogImportError('Ожидается массив JSON')
+            started, position = True, position + 1
+            continue
+        if buffer[position] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as error:
+            # Элемент не поместился в буфер - дочитываем файл
+            chunk = '' if eof else file.read(chunk_size)
+            if not chunk:
+                raise CatalogImportError('Ошибка JSON: {0}'.format(error))
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        if end == len(buffer) and not eof:
+            # Число в конце буфера может продолжаться в следующей части файла
+            chunk = file.read(chunk_size)
+            buffer, position, eof = buffer[position:] + chunk, 0, not chunk
+            continue
+        yield value
+        position = end
+
+
+def iter_jsonl(file):
+    for number, line in enumerate(file, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                raise CatalogImportError('Строка {0}: {1}'.format(number, error))
+
+
+# Строка CSV - книга с одним экземпляром (или без экземпляров, если не указаны ни id, ни импринт)
+def iter_csv(file):
+    for row in csv.DictReader(file):
+        row = {key.strip(): (value or '').strip() for key, value in row.items() if key}
+        copies = []
+        if row.get('copy_id') or row.get('imprint'):
+            copies.append({'id': row.get('copy_id'), 'imprint': row.get('imprint', ''),
+                           'status': row.get('status'), 'due_back': row.get('due_back')})
+        author = None
+        if row.get('author_last_name') or row.get('author_first_name'):
+            author = {'last_name': row.get('author_last_name', ''), 'first_name': row.get('author_first_name', '')}
+        yield {'title': row.get('title', ''), 'author': author, 'summary': row.get('summary', ''),
+               'isbn': row.get('isbn', ''), 'language': row.get('language'),
+               'genre': [name.strip() for name in row.get('genre', '').split(';') if name.strip()],
+               'copies': copies}
+
+
+# Исправление строк, прочитанных не в той кодировке: recode = (ошибочная, правильная).
+# Например, выгрузка DB/db.json сделана в консоли Windows: текст в cp1251 прочитан как cp866 - recode=('cp866', 'cp1251').
+def recode_value(value, recode):
+    if isinstance(value, str):
+        try:
+            return value.encode(recode[0]).decode(recode[1])
+        except UnicodeError:
+            raise CatalogImportError('Не удалось перекодировать строку {0!r}'.format(value))
+    if isinstance(value, list):
+        return [recode_value(item, recode) for item in value]
+    if isinstance(value, dict):
+        return {key: recode_value(item, recode) for key, item in value.items()}
+    return value
+
+
+def read_records(path, file_format=None, recode=None):
+    file_format = file_format or detect_format(path)
+    readers = {'json': iter_json_array, 'jsonl': iter_jsonl, 'csv': iter_csv}
+    with open(path, encoding=detect_encoding(path), newline='') as file:
+        for record in readers[file_format](file):
+            yield recode_value(record, recode) if recode else record
+
+
+# Естественный ключ автора: (фамилия, имя)
+def author_key(value):
+    if not value:
+        return None
+    if isinstance(value, str):
+        last_name, _, first_name = value.partition(',')
+        return last_name.strip(), first_name.strip()
+    if isinstance(value, dict):
+        return value.get('last_name', '').strip(), value.get('first_name', '').strip()
+    return tuple(value)
+
+
+def parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise CatalogImportError('Неверная дата: {0!r}'.format(value))
+
+
+class CatalogImporter:
+    def __init__(self, batch_size=5000, log=None, recode=None):
+        self.batch_size = batch_size
+        self.recode = recode
+        self.log = log or (lambda message: None)
+        # Справочники: естественный ключ -> pk
+        self.authors, self.genres, self.languages = {}, {}, {}
+        # pk в выгрузке dumpdata -> естественный ключ справочника
+        self.dump_keys = {model: {} for model in REFERENCE_MODELS}
+        # Последняя созданная книга (ключ, объект): к ней относятся следующие строки CSV той же книги
+        self.current_book = None
+        self.resumed = False
+        self.counts = dict.fromkeys(('authors', 'genres', 'languages', 'books', 'copies', 'skipped'), 0)
+
+    def load_references(self):
+        self.authors = {(last, first): pk for pk, last, first in
+                        Author.objects.values_list('pk', 'last_name', 'first_name')}
+        self.genres = {name: pk for pk, name in Genre.objects.values_list('pk', 'name')}
+        self.languages = {name: pk for pk, name in Language.objects.values_list('pk', 'name')}
+
+    # Создание недостающих записей справочника одним bulk_create. cache - {естественный ключ: pk}.
+    def create_missing(self, model, cache, keys, make, counter):
+        missing = [key for key in dict.fromkeys(keys) if key is not None and key not in cache]
+        if missing:
+            objects = [make(key) for key in missing]
+            model.objects.bulk_create(objects, batch_size=self.batch_size)
+            cache.update((key, obj.pk) for key, obj in zip(missing, objects))
+            self.counts[counter] += len(missing)
+
+    def create_references(self, authors=(), genres=(), languages=()):
+        self.create_missing(Author, self.authors, authors,
+                            lambda key: Author(last_name=key[0], first_name=key[1]), 'authors')
+        self.create_missing(Genre, self.genres, genres, lambda name: Genre(name=name), 'genres')
+        self.create_missing(Language, self.languages, languages, lambda name: Language(name=name), 'languages')
+
+    # Импорт файла. checkpoint - имя контрольной точки (None - без возобновления).
+    def run(self, path, file_format=None, checkpoint=None):
+        self.load_references()
+        start = self.read_checkpoint(path, checkpoint)
+        self.resumed = start > 0
+        first = next(iter(read_records(path, file_format, self.recode)), None)
+        dump = isinstance(first, dict) and 'model' in first
+
+        if dump:
+            # Справочники выгрузки могут идти после книг, поэтому читаются отдельным проходом
+            self.load_dump_references(read_records(path, file_format, self.recode))
+
+        batch = []
+        position = 0
+        for position, record in enumerate(read_records(path, file_format, self.recode), 1):
+            if position <= start:
+                continue
+            if not isinstance(record, dict):
+                raise CatalogImportError('Запись {0}: ожидается объект'.format(position))
+            if dump and record.get('model') not in ('catalog.book', 'catalog.bookinstance'):
+                if record.get('model') not in REFERENCE_MODELS:
+                    self.counts['skipped'] += 1
+                continue
+            batch.append((position, record))
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch, dump, path, checkpoint)
+                batch = []
+        if batch:
+            self.write_batch(batch, dump, path, checkpoint)
+
+        if dump and connection.vendor == 'postgresql':
+            # id книг взяты из выгрузки - последовательность продолжается после наибольшего id
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Book]):
+                    cursor.execute(sql)
+        # Книги уже обработаны по пачкам, остались счётчики каталога
+        transaction.on_commit(lambda: catalog_bulk_loaded.send(sender=self.__class__, book_ids=()))
+        if checkpoint:
+            ImportCheckpoint.objects.filter(name=checkpoint).delete()
+        self.counts['records'] = position
+        return self.counts
+
+    def write_batch(self, batch, dump, path, checkpoint):
+        with transaction.atomic():
+            for position, record in batch:
+                try:
+                    self.check_record(record, dump)
+                except CatalogImportError as error:
+                    raise CatalogImportError('Запись {0}: {1}'.format(position, error))
+            if dump:
+                book_ids = self.write_dump_batch([record for _, record in batch])
+            else:
+                book_ids = self.write_catalog_batch([record for _, record in batch])
+            self.write_checkpoint(path, checkpoint, batch[-1][0])
+            # bulk_create не вызывает сигналы save(): поисковый индекс и счётчики обновляются отдельно
+            transaction.on_commit(lambda: catalog_bulk_loaded.send(sender=self.__class__, book_ids=book_ids,
+                                                                   partial=True))
+        self.log('Записей: {0}, книг: {1}, экземпляров: {2}'.format(
+            batch[-1][0], self.counts['books'], self.counts['copies']))
+
+    def check_record(self, record, dump):
+        fields = record.get('fields', {}) if dump else record
+        if not dump or record['model'] == 'catalog.book':
+            if not fields.get('title'):
+                raise CatalogImportError('не указано название книги')
+        copies = [fields] if dump and record['model'] == 'catalog.bookinstance' else record.get('copies') or []
+        for copy in copies:
+            if copy.get('status') and copy['status'] not in STATUSES:
+                raise CatalogImportError('неверный статус экземпляра {0!r}'.format(copy['status']))
+            parse_date(copy.get('due_back'))
+            copy_id = record.get('pk') if dump else copy.get('id')
+            if copy_id:
+                try:
+                    uuid.UUID(str(copy_id))
+                except ValueError:
+                    raise CatalogImportError('неверный id экземпляра {0!r}'.format(copy_id))
+
+    def make_copy(self, data, book=None, book_id=None, copy_id=None):
+        copy = BookInstance(book=book, imprint=data.get('imprint') or '',
+                            status=data.get('status') or BookInstance._meta.get_field('status').default,
+                            due_back=parse_date(data.get('due_back')))
+        if book is None:
+            copy.book_id = book_id
+        if copy_id:
+            copy.id = uuid.UUID(str(copy_id))
+        return copy
+
+    # Запись пачки; возвращает id книг, которые пачка создала или дополнила экземплярами
+    def write_catalog_batch(self, records):
+        self.create_references(
+            authors=[author_key(record.get('author')) for record in records],
+            genres=[name for record in records for name in record.get('genre') or []],
+            languages=[record.get('language') for record in records])
+
+        books, book_genres, copies, touched = [], [], [], []
+        for record in records:
+            author = author_key(record.get('author'))
+            key = (record['title'], record.get('isbn') or '', author)
+            if self.current_book is None or self.current_book[0] != key:
+                book = self.resumed_book(key) if self.resumed else None
+                self.resumed = False
+                if book is None:
+                    book = Book(title=record['title'], author_id=self.authors.get(author),
+                                summary=record.get('summary') or '', isbn=record.get('isbn') or '',
+                                language_id=self.languages.get(record.get('language')))
+                    books.append(book)
+                    book_genres.extend((book, self.genres[name]) for name in dict.fromkeys(record.get('genre') or []))
+                self.current_book = (key, book)
+            book = self.current_book[1]
+            touched.append(book)
+            copies.extend(self.make_copy(copy, book=book, copy_id=copy.get('id')) for copy in record.get('copies') or [])
+
+        Book.objects.bulk_create(books, batch_size=self.batch_size)
+        Book.genre.through.objects.bulk_create(
+            [Book.genre.through(book_id=book.pk, genre_id=genre_id) for book, genre_id in book_genres],
+            batch_size=self.batch_size)
+        BookInstance.objects.bulk_create(copies, batch_size=self.batch_size, ignore_conflicts=True)
+        self.counts['books'] += len(books)
+        self.counts['copies'] += len(copies)
+        # Книга, продолженная после возобновления или из прошлой пачки, тоже получила новые экземпляры
+        return sorted({book.pk for book in touched})
+
+    # После возобновления первая запись может продолжать книгу, записанную до сбоя
+    def resumed_book(self, key):
+        title, isbn, author = key
+        return Book.objects.filter(title=title, isbn=isbn, author_id=self.authors.get(author)).order_by('-pk').first()
+
+    # Первый проход по выгрузке dumpdata: авторы, жанры и языки
+    def load_dump_references(self, records):
+        keys = {model: {} for model in REFERENCE_MODELS}
+        for record in records:
+            model = isinstance(record, dict) and record.get('model')
+            if model in REFERENCE_MODELS:
+                fields = record.get('fields', {})
+                if model == 'catalog.author':
+                    keys[model][record['pk']] = author_key(fields)
+                else:
+                    keys[model][record['pk']] = fields.get('name', '')
+        with transaction.atomic():
+            self.create_references(authors=keys['catalog.author'].values(), genres=keys['catalog.genre'].values(),
+                                   languages=keys['catalog.language'].values())
+        self.dump_keys = keys
+
+    def write_dump_batch(self, records):
+        authors, genres, languages = (self.dump_keys[model] for model in REFERENCE_MODELS)
+        books, book_genres, copies = [], [], []
+        for record in records:
+            fields = record.get('fields', {})
+            if record['model'] == 'catalog.book':
+                books.append(Book(
+                    pk=record['pk'], title=fields['title'], summary=fields.get('summary') or '',
+                    isbn=fields.get('isbn') or '', author_id=self.authors.get(authors.get(fields.get('author'))),
+                    language_id=self.languages.get(languages.get(fields.get('language')))))
+                book_genres.extend(Book.genre.through(book_id=record['pk'], genre_id=self.genres[genres[genre]])
+                                   for genre in fields.get('genre') or [] if genre in genres)
+            else:
+                copies.append(self.make_copy(fields, book_id=fields.get('book'), copy_id=record.get('pk')))
+
+        # Записи, которые уже есть в БД (повторный импорт), пропускаются
+        Book.objects.bulk_create(books, batch_size=self.batch_size, ignore_conflicts=True)
+        Book.genre.through.objects.bulk_create(book_genres, batch_size=self.batch_size, ignore_conflicts=True)
+        BookInstance.objects.bulk_create(copies, batch_size=self.batch_size, ignore_conflicts=True)
+        self.counts['books'] += len(books)
+        self.counts['copies'] += len(copies)
+        # Экземпляры выгрузки могут относиться к книгам прошлых пачек
+        return sorted({book.pk for book in books} | {copy.book_id for copy in copies if copy.book_id is not None})
+
+    # Номер последней записанной записи из контрольной точки, если она относится к этому же файлу
+    def read_checkpoint(self, path, checkpoint):
+        state = ImportCheckpoint.objects.filter(name=checkpoint).first() if checkpoint else None
+        if state is None:
+            return 0
+        if state.source != os.path.abspath(path) or state.size != os.path.getsize(path):
+            raise CatalogImportError('Контрольная точка {0} относится к другому файлу'.format(checkpoint))
+        self.log('Продолжение импорта после записи {0}'.format(state.records))
+        return state.records
+
+    # Сохраняется в транзакции пачки (write_batch)
+    def write_checkpoint(self, path, checkpoint, position):
+        if not checkpoint:
+            return
+        ImportCheckpoint.objects.update_or_create(name=checkpoint, defaults={
+            'source': os.path.abspath(path), 'size': os.path.getsize(path), 'records': position})
@@ -0,0 +1,71 @@
+# Справочники жанров и языков в памяти процесса.
+# Таблицы Genre и Language маленькие и почти не меняются, но нужны почти каждой странице: формы книги
+# выводят списки выбора, страница книги, админка и JSON API - названия жанров и языка. Справочник
+# загружается одним запросом и хранится в памяти процесса. Перед использованием сверяются его версии
+# в кэше Django (caching.GENRES / caching.LANGUAGES и общая caching.CATALOG; на сервере из нескольких
+# процессов кэш общий): сигналы сохранения и удаления (catalog/signals.py) увеличивают версию,
+# и каждый процесс перечитывает справочник при следующем обращении.
+from . import caching
+from .models import Book, Genre, Language
+
+GENRES = caching.GENRES
+LANGUAGES = caching.LANGUAGES
+MODELS = {GENRES: Genre, LANGUAGES: Language}
+
+# {справочник: (версии, {id: название} в порядке названий)}. Справочник заменяется целиком,
+# поэтому потоки читают его без блокировки.
+_tables = {}
+
+
+# Справочник name. Если в нём нет какого-либо из pks (запись создана в другом процессе, а версия
+# ещё не увеличена), он перечитывается.
+def get_table(name, pks=()):
+    versions = caching.get_versions([caching.CATALOG, name])
+    cached = _tables.get(name)
+    if cached is not None and cached[0] == versions and all(pk in cached[1] for pk in pks):
+        return cached[1]
+    table = dict(MODELS[name].objects.order_by('name', 'pk').values_list('pk', 'name'))
+    _tables[name] = (versions, table)
+    return table
+
+
+# Справочник изменён: текущий процесс забывает его сразу, остальные - по версии. Сигналы увеличивают
+# версию и после фиксации транзакции (caching.bump): другой процесс мог перечитать справочник до фиксации.
+def reset(name):
+    _tables.pop(name, None)
+
+
+def clear():
+    _tables.clear()
+
+
+def genre_choices():
+    return list(get_table(GENRES).items())
+
+
+def language_choices():
+    return list(get_table(LANGUAGES).items())
+
+
+# Названия жанров pks по алфавиту
+def genre_names(pks):
+    pks = set(pks)
+    table = get_table(GENRES, pks)
+    return sorted(table[pk] for pk in pks if pk in table)
+
+
+def language_name(pk):
+    if pk is None:
+        return None
+    return get_table(LANGUAGES, [pk]).get(pk)
+
+
+# Жанры книг book_ids одним запросом к промежуточной таблице (без соединения с таблицей жанров):
+# {id книги: [названия жанров по алфавиту]}
+def book_genres(book_ids):
+    genre_ids = {book_id: [] for book_id in book_ids}
+    rows = Book.genre.through.objects.filter(book_id__in=book_ids).values_list('book_id', 'genre_id')
+    for book_id, genre_id in rows:
+        genre_ids[book_id].append(genre_id)
+    table = get_table(GENRES, {pk for pks in genre_ids.values() for pk in pks})
+    return {book_id: sorted(table[pk] for pk in pks if pk in table) for book_id, pks in genre_ids.items()}
@@ -0,0 +1,158 @@
+# Сравнение развёртываний WSGI и ASGI под одновременной нагрузкой:
+# python manage.py benchmark_asgi [--requests 2000] [--concurrency 16] [--pages index,book,book-detail]
+# Запросы передаются приложениям library/wsgi.py и library/asgi.py напрямую, без HTTP-сервера:
+# WSGI - из пула потоков (как многопоточный сервер), ASGI - задачами одного цикла событий (как uvicorn/daphne).
+# Варианты: WSGI с синхронными представлениями, ASGI с синхронными представлениями (переход в поток
+# на каждый запрос) и ASGI с асинхронными представлениями /catalog/async/... (см. catalog/async_views.py).
+import asyncio
+import io
+import itertools
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from catalog.benchmark import benchmark_users, percentile
+from catalog.models import Author, Book
+
+# Страницы: (синхронный маршрут, асинхронный маршрут, нужен ли id книги или автора)
+PAGES = [
+    ('index', 'async-index', None),
+    ('book', 'async-book', None),
+    ('book-detail', 'async-book-detail', 'book'),
+    ('authors', 'async-authors', None),
+    ('author-detail', 'async-author-detail', 'author'),
+    ('my-borrowed', 'async-my-borrowed', None),
+    ('all-borrowed', 'async-all-borrowed', None),
+    ('all-books', 'async-all-books', None),
+]
+
+REPORT_HEADER = '{0:<16} {1:>9} {2:>9} {3:>9} {4:>9} {5:>7}'.format(
+    'deployment', 'req/s', 'p50 ms', 'p99 ms', 'max ms', 'errors')
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает запросы в секунду и задержку p99 страниц каталога при развёртывании через WSGI и ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Количество запросов на вариант')
+        parser.add_argument('--concurrency', type=int, default=16, help='Количество одновременных запросов')
+        parser.add_argument('--pages', help='Страницы через запятую (по умолчанию - все): {0}'.format(
+            ','.join(name for name, _, _ in PAGES)))
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('Параметры --requests и --concurrency должны быть положительными')
+        book = Book.objects.order_by('pk').first()
+        author = Author.objects.order_by('pk').first()
+        if book is None or author is None:
+            raise CommandError('База данных пуста. Заполните её командой generate_catalog.')
+
+        # Запросы выполняются от имени библиотекаря: доступны и списки взятых книг
+        client = Client()
+        client.force_login(benchmark_users()['librarian'])
+        cookie = '{0}={1}'.format(settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value)
+
+        pages = PAGES
+        if options['pages']:
+            names = options['pages'].split(',')
+            unknown = set(names) - {name for name, _, _ in PAGES}
+            if unknown:
+                raise CommandError('Неизвестные страницы: {0}'.format(', '.join(sorted(unknown))))
+            pages = [page for page in PAGES if page[0] in names]
+
+        objects = {None: [], 'book': [book.pk], 'author': [author.pk]}
+        sync_paths = [reverse(name, args=objects[kind]) for name, _, kind in pages]
+        async_paths = [reverse(name, args=objects[kind]) for _, name, kind in pages]
+        variants = [
+            ('wsgi', self.run_wsgi, sync_paths),
+            ('asgi sync', self.run_asgi, sync_paths),
+            ('asgi async', self.run_asgi, async_paths),
+        ]
+
+        self.stdout.write(REPORT_HEADER)
+        with override_settings(ALLOWED_HOSTS=['*'], DEBUG=False):
+            for name, run, paths in variants:
+                # Прогрев: первые запросы загружают шаблоны и открывают соединения
+                run(paths, len(paths), 1, cookie)
+                timings, errors, elapsed = run(paths, options['requests'], options['concurrency'], cookie)
+                timings.sort()
+                self.stdout.write('{0:<16} {1:>9.1f} {2:>9.2f} {3:>9.2f} {4:>9.2f} {5:>7}'.format(
+                    name, len(timings) / elapsed, percentile(timings, 50) * 1000, percentile(timings, 99) * 1000,
+                    timings[-1] * 1000, errors))
+
+    def run_wsgi(self, paths, requests, concurrency, cookie):
+        application = get_wsgi_application()
+
+        def call(path):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'localhost', 'HTTP_COOKIE': cookie, 'REMOTE_ADDR': '127.0.0.1',
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+                'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            status = []
+            start = time.perf_counter()
+            result = application(environ, lambda value, headers: status.append(value))
+            try:
+                b''.join(result)
+            finally:
+                result.close()
+            return time.perf_counter() - start, status[0].startswith('200')
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(call, itertools.islice(itertools.cycle(paths), requests)))
+        elapsed = time.perf_counter() - start
+        return [timing for timing, _ in results], sum(not ok for _, ok in results), elapsed
+
+    def run_asgi(self, paths, requests, concurrency, cookie):
+        application = get_asgi_application()
+
+        async def call(path):
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+                'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+                'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+            }
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+            status = []
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                # Клиент не отключается, пока ответ не отправлен
+                await asyncio.Future()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            start = time.perf_counter()
+            await application(scope, receive, send)
+            return time.perf_counter() - start, status[0] == 200
+
+        async def worker(queue, results):
+            for path in queue:
+                results.append(await call(path))
+
+        async def main():
+            queue = itertools.islice(itertools.cycle(paths), requests)
+            results = []
+            await asyncio.gather(*(worker(queue, results) for _ in range(concurrency)))
+            return results
+
+        start = time.perf_counter()
+        results = asyncio.run(main())
+        elapsed = time.perf_counter() - start
+        return [timing for timing, _ in results], sum(not ok for _, ok in results), elapsed
@@ -0,0 +1,117 @@
+# Нагрузочная проверка выдачи и возврата (catalog/circulation.py) при одновременной работе столов выдачи:
+# python manage.py benchmark_circulation [--threads 1,2,4,8] [--duration 5] [--copies 16] [--rtt-ms 0]
+# Для каждого числа потоков все потоки в цикле выдают и возвращают экземпляры одной тестовой книги.
+# Отчёт: операций (выдача + возврат) в секунду, задержка выдачи p50/p99, отказы (нет свободных экземпляров)
+# и конфликты - выдача экземпляра, который в этот момент числится выданным в другом потоке (должно быть 0).
+# --rtt-ms - задержка перед каждым запросом к БД, как при сервере БД на другой машине: пока поток ждёт
+# ответа, другие потоки работают, если не ждут снятия блокировки той же строки. На одной машине с одним
+# процессором без задержки все потоки делят процессор, и рост пропускной способности с числом потоков не виден.
+# Тестовая книга и её экземпляры удаляются после прогона.
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from catalog import availability, circulation
+from catalog.benchmark import benchmark_users, percentile
+from catalog.models import Book, BookInstance
+
+TITLE = 'Нагрузочный тест выдачи'
+
+REPORT_HEADER = '{0:>7} {1:>10} {2:>10} {3:>10} {4:>8} {5:>9}'.format(
+    'threads', 'ops/s', 'p50 ms', 'p99 ms', 'refused', 'conflicts')
+
+
+class Command(BaseCommand):
+    help = 'Измеряет пропускную способность выдачи и возврата экземпляров при разном числе потоков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', default='1,2,4,8', help='Количество потоков через запятую')
+        parser.add_argument('--duration', type=float, default=5, help='Длительность прогона для каждого числа потоков, секунд')
+        parser.add_argument('--copies', type=int, default=16, help='Количество экземпляров тестовой книги')
+        parser.add_argument('--rtt-ms', type=float, default=0, help='Задержка перед каждым запросом к БД, мс')
+
+    def handle(self, *args, **options):
+        try:
+            thread_counts = [int(value) for value in options['threads'].split(',')]
+        except ValueError:
+            raise CommandError('Параметр --threads - список чисел через запятую')
+        if min(thread_counts) < 1 or options['duration'] <= 0 or options['copies'] < 1:
+            raise CommandError('Параметры --threads, --duration и --copies должны быть положительными')
+        if options['rtt_ms'] < 0:
+            raise CommandError('Параметр --rtt-ms не может быть отрицательным')
+        self.rtt = options['rtt_ms'] / 1000
+
+        self.user = benchmark_users()['reader']
+        book = Book.objects.create(title=TITLE, summary='-', isbn='0')
+        BookInstance.objects.bulk_create([BookInstance(book=book, imprint='-', status=circulation.AVAILABLE)
+                                          for _ in range(options['copies'])])
+        # bulk_create не вызывает сигналы - сводка доступности тестовой книги пересчитывается
+        availability.rebuild([book.pk])
+        self.results = []
+        try:
+            self.stdout.write(REPORT_HEADER)
+            for threads in thread_counts:
+                result = self.run(book.pk, threads, options['duration'])
+                self.results.append(result)
+                self.stdout.write('{threads:>7} {ops_per_second:>10.1f} {p50_ms:>10.2f} {p99_ms:>10.2f} '
+                                  '{refused:>8} {conflicts:>9}'.format(**result))
+        finally:
+            BookInstance.objects.filter(book=book).delete()
+            book.delete()
+
+    def run(self, book_id, threads, duration):
+        held = set()
+        lock = threading.Lock()
+        timings = []
+        counts = {'operations': 0, 'refused': 0, 'conflicts': 0}
+        deadline = time.perf_counter() + duration
+
+        def delay(execute, sql, params, many, context):
+            time.sleep(self.rtt)
+            return execute(sql, params, many, context)
+
+        def worker():
+            try:
+                if self.rtt:
+                    connection.execute_wrappers.append(delay)
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        copy = circulation.checkout(book_id, self.user)
+                    except circulation.CirculationError:
+                        with lock:
+                            counts['refused'] += 1
+                        continue
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        timings.append(elapsed)
+                        counts['conflicts'] += copy.pk in held
+                        held.add(copy.pk)
+                    # Экземпляр перестаёт числиться выданным до возврата: пока транзакция возврата
+                    # не завершена, другой поток получить его не может
+                    with lock:
+                        held.discard(copy.pk)
+                    circulation.return_copy(copy.pk)
+                    with lock:
+                        counts['operations'] += 2
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        timings.sort()
+        return {
+            'threads': threads,
+            'ops_per_second': counts['operations'] / elapsed,
+            'p50_ms': (percentile(timings, 50) or 0) * 1000,
+            'p99_ms': (percentile(timings, 99) or 0) * 1000,
+            'refused': counts['refused'],
+            'conflicts': counts['conflicts'],
+        }
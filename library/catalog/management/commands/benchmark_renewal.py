@@ -0,0 +1,153 @@
+# Сравнение способов записи продления экземпляра (изменение due_back):
+# python manage.py benchmark_renewal [--renewals 500] [--copies 50]
+# Варианты:
+#   save            - загрузка и save() всех столбцов (как представление продления до оптимистической блокировки);
+#   select_for_update - то же с блокировкой строки при чтении (пессимистическая блокировка);
+#   update_fields   - загрузка и save(update_fields=['due_back']) с проверкой версии;
+#   f_update        - один UPDATE ... SET due_back, version = version + 1 WHERE id AND version (без загрузки объекта).
+# Для каждого варианта: продлений в секунду, размер SQL-запросов UPDATE экземпляра (байт на продление),
+# объём записи в журнал WAL (байт на продление, только PostgreSQL) и время блокировки строки экземпляра
+# (от первого блокирующего запроса до фиксации транзакции, p50/p99).
+# Продлеваются экземпляры тестовой книги, которая удаляется после прогона.
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+
+from catalog import availability
+from catalog.benchmark import benchmark_users, percentile
+from catalog.models import Book, BookInstance, ConcurrentUpdateError
+from catalog.signals import book_instances_updated
+
+TITLE = 'Нагрузочный тест продления'
+TABLE = BookInstance._meta.db_table
+
+# Все столбцы экземпляра, кроме первичного ключа: так save() записывал строку целиком
+ALL_FIELDS = [field.name for field in BookInstance._meta.concrete_fields if not field.primary_key]
+
+REPORT_HEADER = '{0:<18} {1:>10} {2:>13} {3:>11} {4:>12} {5:>12}'.format(
+    'variant', 'renewals/s', 'update bytes', 'WAL bytes', 'lock p50 ms', 'lock p99 ms')
+
+
+def renew_save(pk, due_back):
+    copy = BookInstance.objects.get(pk=pk)
+    copy.due_back = due_back
+    copy.save(update_fields=ALL_FIELDS)
+
+
+def renew_select_for_update(pk, due_back):
+    copy = BookInstance.objects.select_for_update().get(pk=pk)
+    copy.due_back = due_back
+    copy.save(update_fields=ALL_FIELDS)
+
+
+def renew_update_fields(pk, due_back):
+    copy = BookInstance.objects.get(pk=pk)
+    copy.due_back = due_back
+    copy.save(update_fields=['due_back'])
+
+
+# Версия читается так же, как её передала бы форма; изменения экземпляра сообщаются сигналом,
+# как при массовом продлении (catalog/circulation.py)
+def renew_f_update(pk, due_back):
+    version, book_id = BookInstance.objects.filter(pk=pk).values_list('version', 'book_id').get()
+    if not BookInstance.objects.filter(pk=pk, version=version).update(due_back=due_back, version=F('version') + 1):
+        raise ConcurrentUpdateError('Экземпляр изменён другим пользователем')
+    book_instances_updated.send(sender=BookInstance, pks=[pk], fields=['due_back'], book_ids={book_id},
+                                status_changes={})
+
+
+VARIANTS = [
+    ('save', renew_save),
+    ('select_for_update', renew_select_for_update),
+    ('update_fields', renew_update_fields),
+    ('f_update', renew_f_update),
+]
+
+
+# Обёртка connection.execute_wrapper: размер запросов UPDATE экземпляра и начало блокировки строки
+class RenewalMetrics:
+    def __init__(self):
+        self.update_bytes = 0
+        self.locked_at = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.locked_at is None and (sql.startswith('UPDATE "{0}"'.format(TABLE))
+                                       or (sql.endswith('FOR UPDATE') and TABLE in sql)):
+            self.locked_at = time.perf_counter()
+        if sql.startswith('UPDATE "{0}"'.format(TABLE)):
+            self.update_bytes += len(sql.encode()) + sum(len(str(param).encode()) for param in params or ())
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает объём записи и время блокировки строки при разных способах продления экземпляра'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renewals', type=int, default=500, help='Количество продлений на вариант')
+        parser.add_argument('--copies', type=int, default=50, help='Количество экземпляров тестовой книги')
+
+    def handle(self, *args, **options):
+        if options['renewals'] < 1 or options['copies'] < 1:
+            raise CommandError('Параметры --renewals и --copies должны быть положительными')
+        reader = benchmark_users()['reader']
+        today = datetime.date.today()
+        book = Book.objects.create(title=TITLE, summary='-', isbn='0')
+        copies = BookInstance.objects.bulk_create([
+            BookInstance(book=book, imprint='-', status='в', borrower=reader, due_back=today)
+            for _ in range(options['copies'])])
+        # bulk_create не вызывает сигналы - сводка доступности тестовой книги пересчитывается
+        availability.rebuild([book.pk])
+        pks = [copy.pk for copy in copies]
+        self.results = []
+        try:
+            self.stdout.write(REPORT_HEADER)
+            for name, renew in VARIANTS:
+                result = self.run(name, renew, pks, options['renewals'], today)
+                self.results.append(result)
+                self.stdout.write('{name:<18} {renewals_per_second:>10.1f} {update_bytes:>13.0f} {wal_bytes:>11} '
+                                  '{lock_p50_ms:>12.3f} {lock_p99_ms:>12.3f}'.format(**result))
+        finally:
+            BookInstance.objects.filter(book=book).delete()
+            book.delete()
+
+    def run(self, name, renew, pks, renewals, today):
+        # Прогрев: по одному продлению каждого экземпляра
+        for pk in pks:
+            with transaction.atomic():
+                renew(pk, today + datetime.timedelta(days=28))
+        lock_times = []
+        update_bytes = 0
+        wal_start = self.wal_position()
+        start = time.perf_counter()
+        for number in range(renewals):
+            # Дата меняется при каждом продлении, чтобы UPDATE всегда изменял строку
+            due_back = today + datetime.timedelta(days=7 + number % 14)
+            metrics = RenewalMetrics()
+            with connection.execute_wrapper(metrics):
+                with transaction.atomic():
+                    renew(pks[number % len(pks)], due_back)
+            lock_times.append(time.perf_counter() - metrics.locked_at)
+            update_bytes += metrics.update_bytes
+        elapsed = time.perf_counter() - start
+        wal_end = self.wal_position()
+        lock_times.sort()
+        return {
+            'name': name,
+            'renewals_per_second': renewals / elapsed,
+            'update_bytes': update_bytes / renewals,
+            'wal_bytes': round((wal_end - wal_start) / renewals) if wal_start is not None else '-',
+            'lock_p50_ms': percentile(lock_times, 50) * 1000,
+            'lock_p99_ms': percentile(lock_times, 99) * 1000,
+        }
+
+    # Текущая позиция журнала WAL в байтах (None, если БД не PostgreSQL)
+    @staticmethod
+    def wal_position():
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_current_wal_insert_lsn() - '0/0'")
+            return int(cursor.fetchone()[0])
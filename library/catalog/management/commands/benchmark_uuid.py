@@ -0,0 +1,102 @@
+# Сравнение первичных ключей экземпляров UUID v4 и UUID v7 (catalog/ids.py):
+# python manage.py benchmark_uuid [--rows 20000] [--batch 1000] [--lookups 2000]
+# Для каждой версии экземпляры тестовой книги вставляются пачками bulk_create с заранее созданными ключами.
+# Отчёт: строк в секунду при вставке, время поиска экземпляра по ключу (p50/p99, как в адресах
+# /catalog/book/<uuid:pk>/renew/) и размер индекса первичного ключа (МБ, только PostgreSQL).
+# Размер индекса измеряется на временной таблице с теми же ключами: индекс таблицы экземпляров
+# после удаления строк не уменьшается, и его прирост зависел бы от порядка прогонов.
+# Тестовая книга и её экземпляры удаляются после прогона каждой версии. Экземпляры вставляются и удаляются
+# без сигналов отдельных объектов, как при загрузке каталога: счётчики и сводки пересчитываются
+# сигналом catalog_bulk_loaded.
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from catalog.benchmark import percentile
+from catalog.ids import uuid7
+from catalog.models import Book, BookInstance
+from catalog.signals import catalog_bulk_loaded
+
+TITLE = 'Нагрузочный тест ключей экземпляров'
+
+VARIANTS = [
+    ('uuid4', uuid.uuid4),
+    ('uuid7', uuid7),
+]
+
+REPORT_HEADER = '{0:<7} {1:>10} {2:>12} {3:>15} {4:>15}'.format(
+    'keys', 'inserts/s', 'pk index MB', 'lookup p50 ms', 'lookup p99 ms')
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость массовой вставки и поиска экземпляров с ключами UUID v4 и UUID v7'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000, help='Количество вставляемых экземпляров на версию')
+        parser.add_argument('--batch', type=int, default=1000, help='Размер пачки bulk_create')
+        parser.add_argument('--lookups', type=int, default=2000, help='Количество поисков по ключу на версию')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['batch'] < 1 or options['lookups'] < 1:
+            raise CommandError('Параметры --rows, --batch и --lookups должны быть положительными')
+        self.results = []
+        self.stdout.write(REPORT_HEADER)
+        for name, make_id in VARIANTS:
+            result = self.run(name, make_id, options['rows'], options['batch'], options['lookups'])
+            self.results.append(result)
+            self.stdout.write('{name:<7} {inserts_per_second:>10.0f} {index_mb:>12} {lookup_p50_ms:>15.3f} '
+                              '{lookup_p99_ms:>15.3f}'.format(**result))
+
+    def run(self, name, make_id, rows, batch, lookups):
+        book = Book.objects.create(title=TITLE, summary='-', isbn='0')
+        try:
+            pks = []
+            start = time.perf_counter()
+            for offset in range(0, rows, batch):
+                copies = [BookInstance(id=make_id(), book=book, imprint='-', status='д')
+                          for _ in range(min(batch, rows - offset))]
+                with transaction.atomic():
+                    BookInstance.objects.bulk_create(copies)
+                pks.extend(copy.pk for copy in copies)
+            elapsed = time.perf_counter() - start
+            catalog_bulk_loaded.send(sender=self.__class__, book_ids=[book.pk])
+
+            # Ключи ищутся в случайном порядке, как при переходе по адресам экземпляров
+            rng = random.Random(0)
+            timings = []
+            for pk in rng.choices(pks, k=lookups):
+                lookup_start = time.perf_counter()
+                BookInstance.objects.get(pk=pk)
+                timings.append(time.perf_counter() - lookup_start)
+            timings.sort()
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM {0} WHERE book_id = %s'.format(BookInstance._meta.db_table), [book.pk])
+            catalog_bulk_loaded.send(sender=self.__class__, book_ids=[book.pk])
+            book.delete()
+        return {
+            'name': name,
+            'inserts_per_second': rows / elapsed,
+            'index_mb': self.index_size(pks, batch),
+            'lookup_p50_ms': percentile(timings, 50) * 1000,
+            'lookup_p99_ms': percentile(timings, 99) * 1000,
+        }
+
+    # Размер индекса первичного ключа после вставки ключей pks пачками в том же порядке, МБ ('-', если БД не PostgreSQL)
+    @staticmethod
+    def index_size(pks, batch):
+        if connection.vendor != 'postgresql':
+            return '-'
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TEMPORARY TABLE benchmark_uuid_keys (id uuid PRIMARY KEY)')
+            try:
+                for offset in range(0, len(pks), batch):
+                    keys = pks[offset:offset + batch]
+                    cursor.execute('INSERT INTO benchmark_uuid_keys (id) VALUES ' + ', '.join(['(%s)'] * len(keys)), keys)
+                cursor.execute("SELECT pg_relation_size('benchmark_uuid_keys_pkey')")
+                return round(cursor.fetchone()[0] / 2 ** 20, 2)
+            finally:
+                cursor.execute('DROP TABLE benchmark_uuid_keys')
@@ -0,0 +1,48 @@
+# Команда замера всех представлений каталога на текущей базе данных:
+# python manage.py benchmark_views [--repeat 5] [--writes] [--seed]
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+
+from catalog.benchmark import REPORT_HEADER, benchmark_users, measure_request, route_plan, seed_catalog
+from catalog.models import Author, Book, BookInstance
+
+
+class Command(BaseCommand):
+    help = 'Замеряет количество SQL-запросов, время SQL и время отрисовки для каждого маршрута каталога'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Количество повторов каждого запроса')
+        parser.add_argument('--writes', action='store_true',
+                            help='Выполнять также запросы, изменяющие данные (POST продления книги)')
+        parser.add_argument('--seed', action='store_true', help='Предварительно заполнить базу синтетическими данными')
+
+    def handle(self, *args, **options):
+        users = benchmark_users()
+        if options['seed']:
+            seed_catalog(borrowers=[users['reader']])
+
+        book = Book.objects.order_by('pk').first()
+        author = Author.objects.order_by('pk').first()
+        copy = BookInstance.objects.order_by('pk').first()
+        if book is None or author is None or copy is None:
+            raise CommandError('База данных пуста. Запустите команду с параметром --seed.')
+
+        clients = {None: Client(SERVER_NAME='localhost')}
+        for role, user in users.items():
+            clients[role] = Client(SERVER_NAME='localhost')
+            clients[role].force_login(user)
+
+        self.stdout.write(REPORT_HEADER)
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for name, method, url, data, role, writes in route_plan(book, author, copy):
+                if writes and not options['writes']:
+                    continue
+                runs = [measure_request(clients[role], name, method, url, data) for _ in range(options['repeat'])]
+                # В отчёт идёт прогон с медианным общим временем
+                runs.sort(key=lambda metrics: metrics.total_time)
+                self.stdout.write(str(runs[len(runs) // 2]))
+                if len({metrics.queries for metrics in runs}) > 1:
+                    self.stdout.write(self.style.WARNING(
+                        '  количество запросов меняется между повторами: {0}'.format(
+                            sorted({metrics.queries for metrics in runs}))))
@@ -0,0 +1,66 @@
+# Сравнение пропускной способности домашней страницы при подсчёте посещений
+# в сессии (прежний вариант, запись django_session на каждый запрос) и в подписанной cookie:
+# python manage.py benchmark_visits [--requests 1000] [--visitors 50]
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import include, path
+
+from catalog import views
+
+
+# Прежняя реализация: счётчик посещений в сессии, поверх текущей домашней страницы
+def index_session_visits(request):
+    num_visits = request.session.get('num_visits', 0)
+    request.session['num_visits'] = num_visits + 1
+    return views.index(request)
+
+
+# Этот модуль используется как ROOT_URLCONF на время замера
+urlpatterns = [
+    path('session-visits/', index_session_visits, name='index-session-visits'),
+    path('', include(settings.ROOT_URLCONF)),
+]
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает подсчёт посещений домашней страницы в сессии и в подписанной cookie'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Количество запросов на вариант')
+        parser.add_argument('--visitors', type=int, default=50, help='Количество разных посетителей (клиентов)')
+
+    def run(self, url, requests, visitors):
+        clients = [Client(SERVER_NAME='localhost') for _ in range(visitors)]
+        writes = 0
+        start = time.perf_counter()
+        for number in range(requests):
+            with CaptureQueriesContext(connection) as queries:
+                response = clients[number % visitors].get(url)
+            assert response.status_code == 200, response.status_code
+            writes += sum(query['sql'].lstrip().upper().startswith(WRITE_PREFIXES)
+                          for query in queries.captured_queries)
+        elapsed = time.perf_counter() - start
+        # Сессии, созданные прежним вариантом, удаляются
+        keys = [client.cookies[settings.SESSION_COOKIE_NAME].value for client in clients
+                if settings.SESSION_COOKIE_NAME in client.cookies]
+        Session.objects.filter(session_key__in=keys).delete()
+        return requests / elapsed, writes
+
+    def handle(self, *args, **options):
+        variants = [
+            ('session', '/session-visits/'),
+            ('signed cookie', '/catalog/'),
+        ]
+        self.stdout.write('{0:<15} {1:>12} {2:>15}'.format('variant', 'req/s', 'db writes'))
+        with override_settings(ROOT_URLCONF=__name__, ALLOWED_HOSTS=['*']):
+            for name, url in variants:
+                throughput, writes = self.run(url, options['requests'], options['visitors'])
+                self.stdout.write('{0:<15} {1:>12.1f} {2:>15}'.format(name, throughput, writes))
@@ -0,0 +1,31 @@
+# Потоковая выгрузка каталога в CSV или JSONL:
+# python manage.py export_catalog copies [--format jsonl] [--output copies.csv]
+# Выгрузки: books, authors, copies (все экземпляры), loans (взятые экземпляры) - см. catalog/export.py.
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.export import CHUNK_SIZE, EXPORTS, FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Выгружает книги, авторов или экземпляры книг в CSV или JSONL, читая строки из БД порциями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(EXPORTS), help='Что выгружать')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', help='Файл выгрузки (по умолчанию - стандартный вывод)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Сколько строк читается из БД за раз')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('Параметр --chunk-size должен быть положительным')
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else self.stdout
+        lines = 0
+        try:
+            for line in export_lines(options['name'], options['format'], options['chunk_size']):
+                output.write(line)
+                lines += 1
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS('Записано строк: {0}'.format(lines)))
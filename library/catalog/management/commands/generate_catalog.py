@@ -0,0 +1,38 @@
+# Команда генерации синтетического каталога для нагрузочного тестирования:
+# python manage.py generate_catalog --authors 100000 --books 300000 --copies 3000000 --seed 42
+# Запускать на пустой базе данных: при одинаковом seed данные получаются одинаковыми.
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.generator import CatalogGenerator
+
+
+class Command(BaseCommand):
+    help = 'Генерирует синтетический каталог (авторы, книги, жанры, языки, экземпляры, читатели) через bulk_create'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', type=int, default=1000)
+        parser.add_argument('--books', type=int, default=5000)
+        parser.add_argument('--copies', type=int, default=20000, help='Количество экземпляров книг (BookInstance)')
+        parser.add_argument('--genres', type=int, default=15)
+        parser.add_argument('--languages', type=int, default=5)
+        parser.add_argument('--borrowers', type=int, default=200, help='Количество читателей-заёмщиков')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        for name in ('authors', 'books', 'genres', 'languages'):
+            if options[name] < 1:
+                raise CommandError('Параметр --{0} должен быть положительным'.format(name))
+        if options['batch_size'] < 1:
+            raise CommandError('Параметр --batch-size должен быть положительным')
+
+        log = (lambda message: self.stdout.write(message)) if options['verbosity'] > 1 else None
+        generator = CatalogGenerator(seed=options['seed'], batch_size=options['batch_size'], log=log)
+        start = time.perf_counter()
+        created = generator.generate(authors=options['authors'], books=options['books'], copies=options['copies'],
+                                     genres=options['genres'], languages=options['languages'],
+                                     borrowers=options['borrowers'])
+        self.stdout.write(self.style.SUCCESS('Создано за {0:.1f} с: {1}'.format(
+            time.perf_counter() - start, ', '.join('{0}={1}'.format(*item) for item in created.items()))))
@@ -0,0 +1,53 @@
+# Потоковый импорт каталога из JSON, JSONL или CSV (формат записей - см. catalog/importer.py):
+# python manage.py import_catalog catalog.jsonl [--format jsonl] [--batch-size 5000]
+# python manage.py import_catalog DB/db.json --recode cp866:cp1251
+# После сбоя повторный запуск той же команды продолжает импорт с контрольной точки
+# (строка таблицы ImportCheckpoint, по умолчанию с именем - полным путём к файлу; удаляется после успешного импорта).
+import codecs
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.importer import CatalogImporter, CatalogImportError, FORMATS
+from catalog.models import ImportCheckpoint
+
+
+class Command(BaseCommand):
+    help = 'Импортирует книги, жанры, авторов и экземпляры книг из файла JSON, JSONL или CSV пачками через bulk_create'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Импортируемый файл')
+        parser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                            help='Формат файла (по умолчанию - по расширению)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Сколько записей записывается за транзакцию')
+        parser.add_argument('--checkpoint', help='Имя контрольной точки (по умолчанию - полный путь к файлу)')
+        parser.add_argument('--recode', metavar='ОШИБОЧНАЯ:ПРАВИЛЬНАЯ',
+                            help='Исправить текст, прочитанный не в той кодировке, например cp866:cp1251 для DB/db.json')
+        parser.add_argument('--restart', action='store_true', help='Начать импорт заново, не учитывая контрольную точку')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('Параметр --batch-size должен быть положительным')
+        recode = None
+        if options['recode']:
+            recode = tuple(options['recode'].split(':'))
+            try:
+                if len(recode) != 2:
+                    raise LookupError(options['recode'])
+                for encoding in recode:
+                    codecs.lookup(encoding)
+            except LookupError:
+                raise CommandError('Неверный параметр --recode: {0}'.format(options['recode']))
+        checkpoint = options['checkpoint'] or os.path.abspath(options['path'])
+        log = (lambda message: self.stdout.write(message)) if options['verbosity'] > 1 else None
+        importer = CatalogImporter(batch_size=options['batch_size'], log=log, recode=recode)
+        start = time.perf_counter()
+        try:
+            if options['restart']:
+                ImportCheckpoint.objects.filter(name=checkpoint).delete()
+            counts = importer.run(options['path'], options['format'], checkpoint)
+        except (CatalogImportError, OSError) as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS('Импортировано за {0:.1f} с: {1}'.format(
+            time.perf_counter() - start, ', '.join('{0}={1}'.format(*item) for item in counts.items()))))
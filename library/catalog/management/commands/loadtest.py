@@ -0,0 +1,230 @@
+# Нагрузочный тест работающего сайта смешанным трафиком читателей и библиотекарей:
+# python manage.py runserver --noreload   (или gunicorn/uvicorn с теми же настройками БД)
+# python manage.py loadtest --url http://127.0.0.1:8000 [--duration 30] [--concurrency 10] [--seed]
+#                           [--output report.json] [--label release-1.4]
+# Каждый поток - отдельный посетитель с тремя сессиями (аноним, читатель, библиотекарь); маршрут
+# каждого следующего запроса выбирается случайно по весам MIX. Отчёт - запросы в секунду и задержки
+# p50/p95/p99 по маршрутам; --output сохраняет его в JSON для сравнения выпусков.
+# Команда работает с той же БД, что и сервер: готовит пользователей, их сессии и список книг.
+import datetime
+import http.client
+import json
+import platform
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from catalog.benchmark import benchmark_users, percentile, seed_catalog
+from catalog.models import Author, Book, BookInstance, Genre, Language
+
+# Маршрут: (имя, роль, вес). Роль None - анонимный посетитель.
+MIX = [
+    ('index', None, 15),
+    ('book', None, 20),
+    ('book-detail', None, 25),
+    ('authors', None, 10),
+    ('my-borrowed', 'reader', 10),
+    ('all-borrowed', 'librarian', 6),
+    ('renew-book-librarian', 'librarian', 6),
+    ('book-create', 'librarian', 3),
+    ('book-update', 'librarian', 5),
+]
+
+# Книги, созданные тестом (удаляются после прогона)
+TITLE_PREFIX = 'Нагрузочный тест '
+
+
+# HTTP-сессия одного посетителя: cookie сохраняются между запросами, перенаправления не выполняются
+class Session:
+    def __init__(self, host, port, cookies=None):
+        self.host = host
+        self.port = port
+        self.cookies = dict(cookies or {})
+
+    def request(self, method, path, data=None):
+        headers = {'Cookie': '; '.join('{0}={1}'.format(name, value) for name, value in self.cookies.items())}
+        body = None
+        if data is not None:
+            body = urlencode(data, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            headers['X-CSRFToken'] = self.cookies.get(settings.CSRF_COOKIE_NAME, '')
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        finally:
+            connection.close()
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response.status, response.headers
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест сайта смешанным трафиком: запросы в секунду и задержки p50/p95/p99 по маршрутам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Адрес работающего сервера')
+        parser.add_argument('--duration', type=float, default=30, help='Длительность теста, секунд')
+        parser.add_argument('--concurrency', type=int, default=10, help='Количество одновременных посетителей')
+        parser.add_argument('--seed', action='store_true', help='Предварительно заполнить базу синтетическими данными')
+        parser.add_argument('--random-seed', type=int, default=0, help='Начальное значение выбора маршрутов')
+        parser.add_argument('--output', help='Файл отчёта в формате JSON')
+        parser.add_argument('--label', default='', help='Метка прогона в отчёте (версия, ветка)')
+        parser.add_argument('--keep-data', action='store_true', help='Не удалять книги, созданные тестом')
+
+    def handle(self, *args, **options):
+        if options['duration'] <= 0 or options['concurrency'] < 1:
+            raise CommandError('Параметры --duration и --concurrency должны быть положительными')
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('Нужен адрес вида http://host:port')
+
+        users = benchmark_users()
+        if options['seed']:
+            seed_catalog(borrowers=[users['reader']])
+        self.data = self.load_data(users)
+        # Сессии читателя и библиотекаря создаются заранее, без формы входа
+        self.session_cookies = {None: {}}
+        for role, user in users.items():
+            client = Client()
+            client.force_login(user)
+            self.session_cookies[role] = {settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value}
+
+        self.host, self.port = url.hostname, url.port or 80
+        self.results = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+        deadline = time.perf_counter() + options['duration']
+        threads = [threading.Thread(target=self.visitor, args=(deadline, random.Random(options['random_seed'] + number)))
+                   for number in range(options['concurrency'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        if not options['keep_data']:
+            Book.objects.filter(title__startswith=TITLE_PREFIX).delete()
+
+        report = self.report(options, elapsed)
+        self.write_report(report)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS('Отчёт сохранён в {0}'.format(options['output'])))
+
+    # Данные для запросов: книги, взятые экземпляры, справочники для формы книги
+    def load_data(self, users):
+        books = list(Book.objects.order_by('?').values_list('pk', flat=True)[:500])
+        loans = list(BookInstance.objects.filter(status='в').order_by('?').values_list('pk', flat=True)[:500])
+        author = Author.objects.order_by('pk').values_list('pk', flat=True).first()
+        genre = Genre.objects.order_by('pk').values_list('pk', flat=True).first()
+        language = Language.objects.order_by('pk').values_list('pk', flat=True).first()
+        if not books or not loans or None in (author, genre, language):
+            raise CommandError('В базе нет книг или взятых экземпляров. Запустите команду с параметром --seed.')
+        if not BookInstance.objects.filter(borrower=users['reader'], status='в').exists():
+            self.stderr.write('У читателя benchmark_reader нет взятых книг: список my-borrowed будет пустым')
+        return {'books': books, 'loans': loans, 'author': author, 'genre': genre, 'language': language}
+
+    def visitor(self, deadline, rng):
+        sessions = {role: Session(self.host, self.port, cookies) for role, cookies in self.session_cookies.items()}
+        # Токен CSRF для форм библиотекаря
+        sessions['librarian'].request('GET', reverse('login'))
+        names = [name for name, _, _ in MIX]
+        weights = [weight for _, _, weight in MIX]
+        roles = {name: role for name, role, _ in MIX}
+        created = []
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            method, path, data, expected = self.plan(name, rng, created)
+            start = time.perf_counter()
+            try:
+                status, headers = sessions[roles[name]].request(method, path, data)
+            except (OSError, http.client.HTTPException):
+                status, headers = None, {}
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.results[name].append(duration)
+                if status != expected:
+                    self.errors[name] += 1
+            if name == 'book-create' and status == 302:
+                match = re.search(r'/book/(\d+)', headers.get('Location', ''))
+                if match:
+                    created.append(int(match.group(1)))
+
+    # Запрос для маршрута name: (метод, адрес, данные формы, ожидаемый код ответа)
+    def plan(self, name, rng, created):
+        data = self.data
+        if name == 'book-detail':
+            return 'GET', reverse(name, args=[rng.choice(data['books'])]), None, 200
+        if name == 'renew-book-librarian':
+            due_back = datetime.date.today() + datetime.timedelta(weeks=rng.randint(1, 4))
+            return 'POST', reverse(name, args=[rng.choice(data['loans'])]), {'due_back': due_back.isoformat()}, 302
+        if name in ('book-create', 'book-update'):
+            form = {
+                'title': TITLE_PREFIX + str(rng.randint(1, 10 ** 9)),
+                'author': data['author'], 'summary': 'Книга создана нагрузочным тестом',
+                'isbn': str(rng.randint(10 ** 12, 10 ** 13 - 1)), 'genre': [data['genre']], 'language': data['language'],
+            }
+            # Изменяются только книги, созданные этим посетителем
+            if name == 'book-update' and created:
+                return 'POST', reverse(name, args=[rng.choice(created)]), form, 302
+            return 'POST', reverse('book-create'), form, 302
+        return 'GET', reverse(name), None, 200
+
+    def report(self, options, elapsed):
+        routes = {}
+        for name, _, _ in MIX:
+            routes[name] = self.summarize(self.results[name], self.errors[name], elapsed)
+        everything = [duration for durations in self.results.values() for duration in durations]
+        return {
+            'label': options['label'],
+            'started': datetime.datetime.now().isoformat(timespec='seconds'),
+            'url': options['url'],
+            'concurrency': options['concurrency'],
+            'duration_s': round(elapsed, 3),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+            'total': self.summarize(everything, sum(self.errors.values()), elapsed),
+            'routes': routes,
+        }
+
+    @staticmethod
+    def summarize(durations, errors, elapsed):
+        durations = sorted(durations)
+
+        def milliseconds(value):
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            'requests': len(durations),
+            'errors': errors,
+            'rps': round(len(durations) / elapsed, 2),
+            'p50_ms': milliseconds(percentile(durations, 50)),
+            'p95_ms': milliseconds(percentile(durations, 95)),
+            'p99_ms': milliseconds(percentile(durations, 99)),
+            'max_ms': milliseconds(durations[-1] if durations else None),
+        }
+
+    def write_report(self, report):
+        line = '{0:<22} {1:>8} {2:>7} {3:>8} {4:>9} {5:>9} {6:>9}'
+        self.stdout.write(line.format('route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+        rows = list(report['routes'].items()) + [('total', report['total'])]
+        for name, stats in rows:
+            self.stdout.write(line.format(name, stats['requests'], stats['errors'], stats['rps'],
+                                          *[stats[key] if stats[key] is not None else '-'
+                                            for key in ('p50_ms', 'p95_ms', 'p99_ms')]))
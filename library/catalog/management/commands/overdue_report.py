@@ -0,0 +1,83 @@
+# Отчёт о просроченных выдачах, сгруппированный по читателям:
+# python manage.py overdue_report [--format csv|jsonl] [--output overdue.csv] [--date 2024-01-31]
+# Строки читаются из БД порциями (QuerySet.iterator), в памяти - только выдачи одного читателя,
+# поэтому отчёт строится и по миллионам экземпляров книг.
+import csv
+import datetime
+import itertools
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.models import BookInstance
+
+FIELDS = ['borrower_id', 'borrower__username', 'borrower__email', 'id', 'book__title', 'imprint', 'due_back',
+          'overdue_by']
+CSV_HEADER = ['borrower_id', 'username', 'email', 'copy_id', 'title', 'imprint', 'due_back', 'days_overdue']
+
+
+# Просроченные выдачи, отсортированные по читателю (сначала самые давние)
+def overdue_rows(today, chunk_size):
+    queryset = (BookInstance.objects.overdue(today).annotate_overdue(today)
+                .order_by('borrower', 'due_back', 'pk').values_list(*FIELDS))
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+class Command(BaseCommand):
+    help = 'Выгружает просроченные выдачи, сгруппированные по читателям, в CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+        parser.add_argument('--output', help='Файл отчёта (по умолчанию - стандартный вывод)')
+        parser.add_argument('--date', help='Дата отчёта в формате ГГГГ-ММ-ДД (по умолчанию - сегодня)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Сколько строк читается из БД за раз')
+
+    def handle(self, *args, **options):
+        today = datetime.date.today()
+        if options['date']:
+            try:
+                today = datetime.date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError('Неверная дата: {0}'.format(options['date']))
+        if options['chunk_size'] < 1:
+            raise CommandError('Параметр --chunk-size должен быть положительным')
+
+        rows = overdue_rows(today, options['chunk_size'])
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else self.stdout
+        try:
+            write = self.write_csv if options['format'] == 'csv' else self.write_jsonl
+            borrowers, loans = write(output, rows)
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS('Читателей: {0}, просроченных выдач: {1}'.format(borrowers, loans)))
+
+    # Одна строка на выдачу, строки одного читателя идут подряд
+    def write_csv(self, output, rows):
+        writer = csv.writer(output)
+        writer.writerow(CSV_HEADER)
+        borrowers, loans, previous = 0, 0, object()
+        for borrower_id, username, email, copy_id, title, imprint, due_back, overdue_by in rows:
+            if borrower_id != previous:
+                borrowers, previous = borrowers + 1, borrower_id
+            writer.writerow([borrower_id or '', username or '', email or '', copy_id, title or '', imprint,
+                             due_back.isoformat(), overdue_by.days])
+            loans += 1
+        return borrowers, loans
+
+    # Одна строка JSON на читателя со списком его просроченных выдач
+    def write_jsonl(self, output, rows):
+        borrowers, loans = 0, 0
+        for borrower_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            _, username, email = group[0][:3]
+            record = {
+                'borrower_id': borrower_id, 'username': username, 'email': email,
+                'loans': [{'copy_id': str(copy_id), 'title': title, 'imprint': imprint,
+                           'due_back': due_back.isoformat(), 'days_overdue': overdue_by.days}
+                          for _, _, _, copy_id, title, imprint, due_back, overdue_by in group],
+            }
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+            borrowers, loans = borrowers + 1, loans + len(group)
+        return borrowers, loans
@@ -0,0 +1,17 @@
+# Пересчёт счётчиков домашней страницы и сводки доступности книг по таблицам:
+# python manage.py rebuild_counters
+# Нужен после изменения данных в обход сигналов (прямые SQL-запросы, QuerySet.update()).
+from django.core.management.base import BaseCommand
+
+from catalog import availability
+from catalog.counters import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики каталога (книги, экземпляры, доступные экземпляры, авторы) и доступность книг'
+
+    def handle(self, *args, **options):
+        values = rebuild()
+        self.stdout.write(self.style.SUCCESS(', '.join('{0}={1}'.format(*item) for item in values.items())))
+        self.stdout.write(self.style.SUCCESS('Сводка доступности пересчитана для книг: {0}'.format(
+            availability.rebuild())))
@@ -0,0 +1,20 @@
+# Полная переиндексация книг для полнотекстового поиска:
+# python manage.py rebuild_search_index
+# Нужна после загрузки данных в обход save() (loaddata, прямые SQL-запросы).
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.search import index_books
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс книг (tsvector в PostgreSQL, FTS5 в SQLite)'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            index_books()
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс перестроен за {0:.1f} с'.format(
+            time.perf_counter() - start)))
@@ -0,0 +1,227 @@
+# Замер каждого запроса: количество и время SQL-запросов, самые медленные запросы, время отрисовки шаблонов,
+# имя представления и общее время. Результат передаётся в заголовке Server-Timing (виден в инструментах
+# разработчика браузера) и записывается строкой JSON в журнал 'catalog.timing'. Медленный запрос
+# (порог - настройки CATALOG_SLOW_REQUEST_MS и CATALOG_SLOW_REQUEST_QUERIES) записывается предупреждением
+# с нормализованным текстом SQL и повторяющимися запросами (признак N+1).
+# Работает без DEBUG: SQL замеряется обёрткой connection.execute_wrapper, тексты запросов нормализуются
+# только для медленных запросов.
+# Middleware работает и в синхронной, и в асинхронной цепочке (ASGI): замер текущего запроса хранится
+# в contextvars, которые asgiref передаёт в потоки sync_to_async, где асинхронные представления
+# выполняют запросы к БД и отрисовку шаблонов.
+import asyncio
+import contextvars
+import json
+import logging
+import re
+import time
+from collections import Counter
+
+from asgiref.sync import async_to_sync, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+
+from . import profiling
+
+logger = logging.getLogger('catalog.timing')
+
+# Сколько самых медленных SQL-запросов попадает в журнал
+TOP_QUERIES = 5
+
+# Замер текущего запроса (для отрисовки шаблонов, которые вызываются не из middleware)
+current_metrics = contextvars.ContextVar('catalog_request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.view = None
+        self.queries = []
+        self.render_time = 0.0
+        self.render_depth = 0
+        self.start = time.perf_counter()
+        self.total_time = 0.0
+
+    @property
+    def sql_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def slowest(self, count=TOP_QUERIES):
+        return sorted(self.queries, key=lambda query: query[1], reverse=True)[:count]
+
+    # SQL-запросы, которые с точностью до значений выполнялись не меньше threshold раз: {текст: количество}
+    def duplicates(self, threshold):
+        counts = Counter(normalize_sql(sql) for sql, _ in self.queries)
+        return {sql: count for sql, count in counts.most_common() if count >= threshold}
+
+    # Обёртка для connection.execute_wrapper
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+
+# Текст SQL без значений: строки, числа и списки IN (...) заменяются на ?
+NORMALIZE_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def normalize_sql(sql):
+    for pattern, replacement in NORMALIZE_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+# SQL-запросы учитываются в замере текущего запроса, если он есть. Соединения с БД создаются отдельно
+# в каждом потоке (в том числе в потоках sync_to_async), поэтому обёртка ставится на каждое соединение
+# при его открытии (сигнал connection_created) и остаётся на нём.
+def timed_execute(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def install_timed_execute(sender=None, connection=None, **kwargs):
+    if timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(timed_execute)
+
+
+# Время отрисовки шаблонов верхнего уровня (вложенные render_to_string не суммируются повторно).
+# Template.render подменяется один раз при создании middleware.
+def timed_render(render):
+    def wrapper(template, context=None, request=None):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return render(template, context, request)
+        metrics.render_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(template, context, request)
+        finally:
+            metrics.render_depth -= 1
+            if metrics.render_depth == 0:
+                metrics.render_time += time.perf_counter() - start
+
+    wrapper.timed = True
+    return wrapper
+
+
+class RequestTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        if not getattr(Template.render, 'timed', False):
+            Template.render = timed_render(Template.render)
+        connection_created.connect(install_timed_execute, dispatch_uid='catalog.middleware.timed_execute')
+        for connection in connections.all():
+            install_timed_execute(connection=connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def acall(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        metrics.total_time = time.perf_counter() - metrics.start
+        if request.resolver_match is not None:
+            metrics.view = request.resolver_match.view_name
+        response['Server-Timing'] = self.server_timing(metrics)
+        self.log(request, response, metrics)
+        return response
+
+    @staticmethod
+    def server_timing(metrics):
+        return 'sql;desc="{0} queries";dur={1:.1f}, render;dur={2:.1f}, total;dur={3:.1f}'.format(
+            len(metrics.queries), metrics.sql_time * 1000, metrics.render_time * 1000, metrics.total_time * 1000)
+
+    def log(self, request, response, metrics):
+        slow_ms = getattr(settings, 'CATALOG_SLOW_REQUEST_MS', 500)
+        slow_queries = getattr(settings, 'CATALOG_SLOW_REQUEST_QUERIES', 50)
+        slow = metrics.total_time * 1000 >= slow_ms or len(metrics.queries) >= slow_queries
+        if not slow and not logger.isEnabledFor(logging.INFO):
+            return
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': metrics.view,
+            'status': response.status_code,
+            'queries': len(metrics.queries),
+            'sql_ms': round(metrics.sql_time * 1000, 3),
+            'render_ms': round(metrics.render_time * 1000, 3),
+            'total_ms': round(metrics.total_time * 1000, 3),
+        }
+        if not slow:
+            logger.info(json.dumps(record, ensure_ascii=False))
+            return
+        record['slowest'] = [{'sql': normalize_sql(sql), 'ms': round(duration * 1000, 3)}
+                             for sql, duration in metrics.slowest()]
+        record['duplicates'] = metrics.duplicates(getattr(settings, 'CATALOG_DUPLICATE_QUERY_THRESHOLD', 3))
+        logger.warning(json.dumps(record, ensure_ascii=False))
+
+
+# Профилирование запроса по требованию сотрудника (см. catalog/profiling.py).
+# Стоит после AuthenticationMiddleware: права проверяются по request.user.
+# Номер сохранённого профиля возвращается в заголовке X-Profile-Id.
+# В асинхронной цепочке запрос без профилирования передаётся дальше сразу. Профилировщик снимает
+# один поток, поэтому профилируемый запрос проходит остальную цепочку из отдельного потока (sync_to_async):
+# синхронные представления asgiref выполняет в этом же потоке, и они попадают в профиль.
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        mode = profiling.requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+        return self.profile(request, mode, self.get_response)
+
+    async def acall(self, request):
+        mode = profiling.requested_mode(request)
+        if mode is None:
+            return await self.get_response(request)
+        return await sync_to_async(self.profile)(request, mode, async_to_sync(self.get_response))
+
+    def profile(self, request, mode, get_response):
+        if not profiling.can_profile(request):
+            return get_response(request)
+        response, data, duration = profiling.run_profiled(mode, lambda: get_response(request))
+        profile = profiling.save_profile(request, response, mode, data, duration)
+        response['X-Profile-Id'] = str(profile.pk)
+        return response
@@ -0,0 +1,65 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:02
+
+import catalog.models
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Concat
+
+# PostgreSQL: хранимый tsvector с GIN-индексом. SQLite: теневая таблица FTS5.
+# Оба индекса сразу заполняются по существующим книгам.
+FTS_TABLE = 'catalog_book_fts'
+
+
+# Поисковый вектор существующих книг (как catalog.search.book_search_vector)
+def fill_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.search import SearchVector
+
+    Author = apps.get_model('catalog', 'Author')
+    Book = apps.get_model('catalog', 'Book')
+    author_name = Subquery(Author.objects.filter(pk=OuterRef('author_id'))
+                           .annotate(full_name=Concat('last_name', Value(' '), 'first_name'))
+                           .values('full_name')[:1])
+    Book.objects.update(search_vector=SearchVector('title', 'isbn', weight='A', config='russian')
+                        + SearchVector(author_name, weight='B', config='russian')
+                        + SearchVector('summary', weight='C', config='russian'))
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE {0} USING fts5(title, isbn, author, summary, "
+        "tokenize='unicode61 remove_diacritics 2')".format(FTS_TABLE))
+    schema_editor.execute(
+        "INSERT INTO {0} (rowid, title, isbn, author, summary) "
+        "SELECT b.id, b.title, b.isbn, COALESCE(a.last_name, '') || ' ' || COALESCE(a.first_name, ''), b.summary "
+        "FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id".format(FTS_TABLE))
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS {0}'.format(FTS_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0003_alter_bookinstance_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=catalog.models.SearchVectorField(editable=False, null=True),
+        ),
+        # Вектор заполняется до создания индекса: GIN строится один раз по готовым данным
+        migrations.RunPython(fill_search_vector, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=catalog.models.SearchVectorIndex(fields=['search_vector'], name='book_search_vector_gin_idx'),
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
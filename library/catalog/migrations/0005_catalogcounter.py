@@ -0,0 +1,35 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+# Начальные значения счётчиков по существующим данным
+def fill_counters(apps, schema_editor):
+    CatalogCounter = apps.get_model('catalog', 'CatalogCounter')
+    Author = apps.get_model('catalog', 'Author')
+    Book = apps.get_model('catalog', 'Book')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    CatalogCounter.objects.bulk_create([
+        CatalogCounter(name='books', value=Book.objects.count()),
+        CatalogCounter(name='instances', value=BookInstance.objects.count()),
+        CatalogCounter(name='instances_available', value=BookInstance.objects.filter(status='д').count()),
+        CatalogCounter(name='authors', value=Author.objects.count()),
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_book_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogCounter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Счётчик')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Значение')),
+            ],
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.0.6 on 2026-10-18 18:47
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+# Начальная сводка доступности по существующим экземплярам (одним UPDATE)
+def fill_availability(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+
+    def status_count(status):
+        return Coalesce(Subquery(BookInstance.objects.filter(book=OuterRef('pk'), status=status).order_by()
+                                 .values('book').annotate(count=Count('pk')).values('count'),
+                                 output_field=IntegerField()), Value(0))
+
+    Book.objects.update(
+        copies_maintenance=status_count('т'),
+        copies_on_loan=status_count('в'),
+        copies_available=status_count('д'),
+        copies_reserved=status_count('з'),
+        next_due_back=Subquery(BookInstance.objects.filter(book=OuterRef('pk'), status='в', due_back__isnull=False)
+                               .order_by('due_back').values('due_back')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='copies_available',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Доступно экземпляров'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_maintenance',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Экземпляров на обслуживании'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_on_loan',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Взято экземпляров'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_reserved',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Зарезервировано экземпляров'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='next_due_back',
+            field=models.DateField(editable=False, null=True, verbose_name='Ближайшая дата возврата'),
+        ),
+        migrations.RunPython(fill_availability, migrations.RunPython.noop),
+    ]
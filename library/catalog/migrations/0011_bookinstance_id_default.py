@@ -0,0 +1,19 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:01
+
+import catalog.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookinstance',
+            name='id',
+            field=models.UUIDField(default=catalog.ids.new_copy_id, help_text='Уникальный идентификатор этого экземпляра книги во всей библиотеке', primary_key=True, serialize=False, verbose_name='ID в библиотеке'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.0.6 on 2026-10-18 19:40
+
+from django.db import migrations
+
+# Индексы для автодополнения по началу имени без учёта регистра (catalog/api.py, starting_with).
+# По индексу идёт и поиск по началу имени, и сортировка ответа: из индекса читаются первые limit строк,
+# а не все найденные с последующей сортировкой.
+# PostgreSQL: istartswith выполняется как UPPER(столбец) LIKE UPPER('начало%') - индекс по UPPER(столбец)
+# с правилом сортировки "C". По такому индексу выполняются и LIKE 'НАЧАЛО%', и ORDER BY по тому же выражению
+# (индекс с обычным правилом сортировки LIKE не использует, а индекс с varchar_pattern_ops годится только для LIKE).
+# SQLite: LIKE по умолчанию не учитывает регистр (только для латиницы) и использует индекс с правилом
+# сравнения NOCASE; id (rowid) входит в индекс неявно.
+# За выражением идут остальные столбцы порядка вывода.
+PREFIX_INDEXES = [
+    ('author_last_name_prefix_idx', 'catalog_author', 'last_name', ['first_name']),
+    ('author_first_name_prefix_idx', 'catalog_author', 'first_name', ['last_name']),
+    ('genre_name_prefix_idx', 'catalog_genre', 'name', []),
+    ('language_name_prefix_idx', 'catalog_language', 'name', []),
+]
+
+
+def create_prefix_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for name, table, column, order in PREFIX_INDEXES:
+        if vendor == 'postgresql':
+            columns = ['(UPPER({0}) COLLATE "C")'.format(column)] + order + ['id']
+        elif vendor == 'sqlite':
+            columns = ['{0} COLLATE NOCASE'.format(column)] + order
+        else:
+            continue
+        schema_editor.execute('CREATE INDEX {0} ON {1} ({2})'.format(name, table, ', '.join(columns)))
+
+
+def drop_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        for name, _, _, _ in PREFIX_INDEXES:
+            schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_bookinstance_id_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_indexes, drop_prefix_indexes),
+    ]
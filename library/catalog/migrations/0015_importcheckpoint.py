@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0012_autocomplete_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('name', models.CharField(max_length=500, primary_key=True, serialize=False, verbose_name='Имя')),
+                ('source', models.CharField(max_length=500, verbose_name='Файл')),
+                ('size', models.BigIntegerField(verbose_name='Размер файла')),
+                ('records', models.BigIntegerField(verbose_name='Записано записей')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Изменена')),
+            ],
+        ),
+    ]
@@ -1,8 +1,84 @@
 from django.db import models
 from django.urls import reverse  # Используется для создания URL-адресов путем изменения шаблонов URL-адресов.
-import uuid  # Требуется для создания уникальных экземпляров книги
+from .ids import new_copy_id  # Требуется для создания уникальных экземпляров книги
 from django.contrib.auth.models import User # Требуется для назначения пользователя заемщиком книги
 from datetime import date
+# GIN-индекс не требует psycopg2 (в отличие от django.contrib.postgres.search)
+from django.contrib.postgres.indexes import GinIndex
+
+
+# Запись изменена другим пользователем после того, как её загрузили для изменения
+class ConcurrentUpdateError(Exception):
+    pass
+
+
+# Оптимистическая блокировка и запись только изменённых столбцов.
+# save() существующей записи выполняет UPDATE ... SET <изменённые столбцы>, version = version + 1
+# WHERE id = ... AND version = <загруженная версия>. Если запись успели изменить (версия другая),
+# вместо незаметной перезаписи чужого изменения возникает ConcurrentUpdateError.
+# Изменённые столбцы определяются сравнением со значениями, загруженными из БД (from_db); явный
+# update_fields записывает только указанные столбцы (и версию). Производные столбцы (сводка доступности,
+# поисковый вектор) обновляются через QuerySet.update() и версию не меняют - иначе, например, выдача
+# экземпляра считалась бы конфликтом с одновременным изменением описания книги.
+class VersionedModel(models.Model):
+    version = models.PositiveIntegerField('Версия', default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    # Запоминаем значения, загруженные из БД: по ним save() определяет изменённые столбцы,
+    # а сигналы - переходы статуса (см. catalog/signals.py). Отложенные (deferred) поля не запоминаются.
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: value for name, value in zip(field_names, values)
+                                   if value is not models.DEFERRED}
+        return instance
+
+    # names - имена или attname полей, None - все загруженные поля
+    def remember_values(self, names=None):
+        values = {field.attname: self.__dict__[field.attname] for field in self._meta.concrete_fields
+                  if field.attname in self.__dict__
+                  and (names is None or field.name in names or field.attname in names)}
+        self._loaded_values = dict(getattr(self, '_loaded_values', {}), **values)
+
+    # Изменённые столбцы: отличающиеся от загруженных и присвоенные отложенные поля
+    def changed_fields(self):
+        loaded = self._loaded_values
+        return [field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname in self.__dict__
+                and (field.attname not in loaded or loaded[field.attname] != self.__dict__[field.attname])]
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is None and not self._state.adding and hasattr(self, '_loaded_values'):
+            # Если ничего не изменилось, увеличивается только версия (сигналы сохранения выполняются как раньше)
+            kwargs['update_fields'] = self.changed_fields() or ['version']
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        self.remember_values(None if update_fields is None else {*update_fields, 'version'})
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        self.remember_values(fields)
+
+    def _save_table(self, raw=False, *args, **kwargs):
+        # loaddata (raw) перезаписывает строки значениями из файла, версия не проверяется
+        self._check_version = not raw
+        return super()._save_table(raw, *args, **kwargs)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if not self._check_version:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        field = self._meta.get_field('version')
+        version = self.version
+        values = [value for value in values if value[0] is not field] + [(field, None, version + 1)]
+        if super()._do_update(base_qs.filter(version=version), using, pk_val, values, update_fields, forced_update):
+            self.version = version + 1
+            return True
+        if base_qs.filter(pk=pk_val).exists():
+            raise ConcurrentUpdateError('Запись изменена другим пользователем (версия {0} устарела). '
+                                        'Обновите страницу и повторите изменение.'.format(version))
+        return False
 
 
 # Модель для таблицы книжного жанра
@@ -27,8 +103,39 @@ class Language(models.Model):
         return self.name
 
 
+# Набор запросов для книг
+class BookQuerySet(models.QuerySet):
+    # Количество экземпляров книги всего, доступных и взятых - подсчитывается тем же запросом (GROUP BY),
+    # без отдельного COUNT для каждой книги
+    def with_copy_counts(self):
+        return self.annotate(
+            num_copies=models.Count('bookinstance'),
+            num_available=models.Count('bookinstance', filter=models.Q(bookinstance__status='д')),
+            num_borrowed=models.Count('bookinstance', filter=models.Q(bookinstance__status='в')),
+        )
+
+
+# Поле tsvector для полнотекстового поиска в PostgreSQL (см. catalog/search.py). То же, что
+# django.contrib.postgres.search.SearchVectorField, но модели загружаются и без psycopg2 (SQLite).
+# В других СУБД столбец остаётся пустым.
+class SearchVectorField(models.Field):
+
+    def db_type(self, connection):
+        return 'tsvector' if connection.vendor == 'postgresql' else 'text'
+
+
+# GIN-индекс поискового вектора. USING gin есть только в PostgreSQL: в других СУБД вместо него
+# создаётся обычный индекс по пустому столбцу, чтобы миграции выполнялись одинаково.
+class SearchVectorIndex(GinIndex):
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().create_sql(model, schema_editor, using=using, **kwargs)
+        return models.Index.create_sql(self, model, schema_editor, using=using, **kwargs)
+
+
 # Модель для книги
-class Book(models.Model):
+class Book(VersionedModel):
     title = models.CharField('Название книги', max_length=200)
     # Внешний ключ для связи 1 ко многим. 1 автор -> Много книг.
     # null=True - позволяет хранить Null, если автор не выбран
@@ -41,18 +148,55 @@ class Book(models.Model):
     # Книги могут охватывать множество жанров.
     genre = models.ManyToManyField(Genre, help_text="Выберите жанр книги")
     language = models.ForeignKey('Language', on_delete=models.SET_NULL, null=True)
+    # Поисковый вектор книги (название, ISBN, автор, аннотация). Заполняется catalog/search.py,
+    # в SQLite не используется - там поиск идёт по таблице FTS5.
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Сводка доступности: количество экземпляров в каждом статусе и ближайшая дата возврата взятого экземпляра.
+    # Поддерживается сигналами при изменении экземпляров (см. catalog/availability.py).
+    copies_available = models.PositiveIntegerField('Доступно экземпляров', default=0, editable=False)
+    copies_on_loan = models.PositiveIntegerField('Взято экземпляров', default=0, editable=False)
+    copies_reserved = models.PositiveIntegerField('Зарезервировано экземпляров', default=0, editable=False)
+    copies_maintenance = models.PositiveIntegerField('Экземпляров на обслуживании', default=0, editable=False)
+    next_due_back = models.DateField('Ближайшая дата возврата', null=True, editable=False)
+
+    objects = BookQuerySet.as_manager()
 
     class Meta:
         ordering = ['title', 'author']
+        # Индекс для списка книг (BookListView): название, книги с одинаковым названием - в порядке добавления
+        indexes = [
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+            SearchVectorIndex(fields=['search_vector'], name='book_search_vector_gin_idx'),
+        ]
 
         # Метод для создания строки жанров книги.
     # Это необходимо для отображения жанра в админ-панели, так как книга - жанр имеет отношение
     # многие ко многим
     def display_genre(self):
-        return ', '.join([genre.name for genre in self.genre.all()[:3]])
+        return ', '.join(self.genre_names()[:3])
 
     display_genre.short_description = 'Жанр'
 
+    # Названия жанров книги по алфавиту из справочника в памяти (catalog/lookups.py). Если жанры загружены
+    # заранее (prefetch_related('genre'), см. BookAdmin), запросов к БД нет, иначе - один запрос
+    # к промежуточной таблице без соединения с таблицей жанров.
+    def genre_names(self):
+        from . import lookups
+        if 'genre' in getattr(self, '_prefetched_objects_cache', {}):
+            return lookups.genre_names(genre.pk for genre in self.genre.all())
+        return lookups.book_genres([self.pk])[self.pk]
+
+    # Название языка книги из справочника в памяти, без запроса к БД
+    @property
+    def language_name(self):
+        from . import lookups
+        return lookups.language_name(self.language_id)
+
+
+    # Всего экземпляров книги (по сводке доступности)
+    @property
+    def copies_total(self):
+        return self.copies_available + self.copies_on_loan + self.copies_reserved + self.copies_maintenance
 
     # Метод для возврата названия книги
     def __str__(self):
@@ -66,20 +210,46 @@ class Book(models.Model):
         return reverse('book-detail', args=[str(self.id)])
 
 
+# Набор запросов для экземпляров книг
+class BookInstanceQuerySet(models.QuerySet):
+    # Просроченные выдачи: книга взята и дата возврата прошла (today - дата отчёта, по умолчанию сегодня)
+    def overdue(self, today=None):
+        return self.filter(status='в', due_back__lt=today or date.today())
+
+    # Признак просрочки (overdue) и срок просрочки (overdue_by, timedelta; None, если не просрочено)
+    # вычисляются в БД - так по ним можно фильтровать и сортировать без загрузки строк
+    def annotate_overdue(self, today=None):
+        today = today or date.today()
+        condition = models.Q(status='в', due_back__lt=today)
+        return self.annotate(
+            overdue=models.Case(models.When(condition, then=models.Value(True)), default=models.Value(False),
+                                output_field=models.BooleanField()),
+            overdue_by=models.Case(
+                models.When(condition, then=models.ExpressionWrapper(
+                    models.Value(today, output_field=models.DateField()) - models.F('due_back'),
+                    output_field=models.DurationField())),
+                default=None, output_field=models.DurationField()),
+        )
+
+
 # Модель, представляющая конкретный экземпляр книги, который можно взять в библиотеке.
-class BookInstance(models.Model):
+class BookInstance(VersionedModel):
     # UUIDField используется для поля id, чтобы установить его как primary_key для этой модели.
     # Этот тип поля выделяет глобальное уникальное значение для каждого экземпляра книги
     # (по одному для каждой книги, которые есть в библиотеке)
-    id = models.UUIDField('ID в библиотеке', primary_key=True, default=uuid.uuid4,
+    # Новые ключи - UUID v4 или, при CATALOG_UUID7 = True, упорядоченные по времени UUID v7 (см. catalog/ids.py)
+    id = models.UUIDField('ID в библиотеке', primary_key=True, default=new_copy_id,
                           help_text="Уникальный идентификатор этого экземпляра книги во всей библиотеке")
     book = models.ForeignKey('Book', on_delete=models.SET_NULL, null=True)
     imprint = models.CharField('Импринт', max_length=200)
     # DateField используется для даты due_back появления книги в библиотеке,
     # когда ожидается, что книга появится после резервирования или обслуживания.
     due_back = models.DateField('Дата возврата', null=True, blank=True)
-    # Поле пользователя - заёмщика книги
-    borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # Поле пользователя - заёмщика книги.
+    # Отдельный индекс не нужен: заёмщик - первый столбец индекса bookinst_borrower_due_idx (см. Meta.indexes)
+    borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
+
+    objects = BookInstanceQuerySet.as_manager()
 
     # Метод возвращает True, если книга просрочена
     @property
@@ -108,6 +278,13 @@ class BookInstance(models.Model):
     # используется для упорядочивания записей, когда они возвращаются в запросе к БД.
     class Meta:
         ordering = ["due_back"]
+        # Индексы для списков взятых книг: книги пользователя (заёмщик, статус, по дате возврата)
+        # и все взятые книги - частичный индекс только по строкам со статусом 'в'.
+        # id в конце индекса - для постраничного вывода по ключу (due_back, id).
+        indexes = [
+            models.Index(fields=['borrower', 'status', 'due_back', 'id'], name='bookinst_borrower_due_idx'),
+            models.Index(fields=['due_back', 'id'], name='bookinst_loaned_due_idx', condition=models.Q(status='в')),
+        ]
         # Поле Permission - определяет разрешения.
         # Добавляем разрешение отметить, что книга была возвращена
         permissions = (("can_mark_returned", "Set book as returned"),)
@@ -117,6 +294,30 @@ class BookInstance(models.Model):
         return '{0} ({1})'.format(self.id, self.book.title)
 
 
+# Заявка читателя на книгу (очередь ожидания). Заявки книги выдаются по очереди (created, id):
+# возвращённый экземпляр резервируется (статус 'з') для первой заявки без экземпляра (см. catalog/circulation.py).
+# При выдаче зарезервированного экземпляра заявка удаляется.
+class Hold(models.Model):
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, verbose_name='Книга')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Читатель')
+    created = models.DateTimeField('Создана', auto_now_add=True)
+    # Зарезервированный для заявки экземпляр; None - заявка ждёт в очереди
+    copy = models.OneToOneField('BookInstance', on_delete=models.SET_NULL, null=True, blank=True,
+                                verbose_name='Экземпляр')
+
+    class Meta:
+        ordering = ['created', 'id']
+        verbose_name = 'заявка'
+        verbose_name_plural = 'заявки'
+        # Одна заявка читателя на книгу; очередь книги читается по частичному индексу ожидающих заявок
+        constraints = [models.UniqueConstraint(fields=['book', 'user'], name='hold_book_user_unique')]
+        indexes = [models.Index(fields=['book', 'created', 'id'], name='hold_queue_idx',
+                                condition=models.Q(copy__isnull=True))]
+
+    def __str__(self):
+        return '{0} - {1}'.format(self.book, self.user)
+
+
 class Author(models.Model):
     first_name = models.CharField('Имя', max_length=100)
     last_name = models.CharField('Фамилия', max_length=100)
@@ -127,6 +328,7 @@ class Author(models.Model):
         # Атрибут ordering используется для упорядочивания записей,
         # когда они возвращаются в запросе к БД.
         ordering = ['last_name', 'first_name']
+        indexes = [models.Index(fields=['last_name', 'first_name', 'id'], name='author_name_idx')]
 
     # Возвращает URL-адрес для доступа к информации об авторе
     def get_absolute_url(self):
@@ -135,3 +337,55 @@ class Author(models.Model):
     # Метод возвращает фамилию и имя автора
     def __str__(self):
         return '{0}, {1}'.format(self.last_name, self.first_name)
+
+
+# Счётчики каталога для домашней страницы (количество книг, экземпляров, доступных экземпляров, авторов).
+# Обновляются сигналами при сохранении и удалении записей (см. catalog/counters.py),
+# чтобы домашняя страница не выполняла COUNT(*) по большим таблицам.
+class CatalogCounter(models.Model):
+    name = models.CharField('Счётчик', max_length=50, primary_key=True)
+    value = models.BigIntegerField('Значение', default=0)
+
+    def __str__(self):
+        return '{0} = {1}'.format(self.name, self.value)
+
+
+# Контрольная точка импорта каталога (см. catalog/importer.py): сколько записей файла source уже записано.
+# Обновляется в транзакции каждой пачки записей, поэтому всегда соответствует данным в БД.
+class ImportCheckpoint(models.Model):
+    name = models.CharField('Имя', max_length=500, primary_key=True)
+    source = models.CharField('Файл', max_length=500)
+    size = models.BigIntegerField('Размер файла')
+    records = models.BigIntegerField('Записано записей')
+    updated = models.DateTimeField('Изменена', auto_now=True)
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.name, self.records)
+
+
+# Профиль одного запроса, снятый по требованию сотрудника (см. catalog/profiling.py).
+# data - файл профиля: для cProfile - дамп pstats (открывается pstats, snakeviz),
+# для семплирования - стеки в свёрнутом формате flamegraph.pl / speedscope.
+class RequestProfile(models.Model):
+    MODES = (
+        ('cprofile', 'cProfile (pstats)'),
+        ('sample', 'Семплирование (flamegraph)'),
+    )
+
+    created = models.DateTimeField('Создан', auto_now_add=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Пользователь')
+    method = models.CharField('Метод', max_length=10)
+    path = models.CharField('Адрес', max_length=500)
+    view_name = models.CharField('Представление', max_length=200, blank=True)
+    status_code = models.PositiveSmallIntegerField('Код ответа', null=True)
+    mode = models.CharField('Профилировщик', max_length=10, choices=MODES)
+    duration = models.FloatField('Время, мс')
+    data = models.BinaryField('Профиль')
+
+    class Meta:
+        ordering = ['-created']
+        verbose_name = 'профиль запроса'
+        verbose_name_plural = 'профили запросов'
+
+    def __str__(self):
+        return '{0} {1} ({2:.0f} мс)'.format(self.method, self.path, self.duration)
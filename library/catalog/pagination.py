@@ -0,0 +1,242 @@
+# Постраничный вывод по ключу (keyset / seek pagination).
+# Вместо OFFSET следующая страница выбирается условием "строки после последней строки текущей страницы"
+# по полям сортировки модели (Meta.ordering) и pk, поэтому глубокие страницы стоят столько же,
+# сколько первая. Подсчёт общего количества (COUNT(*)) можно отключить.
+# Для админ-панели - EstimatedCountPaginator: оценка количества строк без COUNT(*) по всей таблице.
+import base64
+import binascii
+import json
+from collections.abc import Sequence
+
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, Q
+from django.db.models.constants import LOOKUP_SEP
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+# Возвращает конечное поле пути (например, 'book__author__last_name') и может ли значение быть NULL
+def resolve_path(model, path):
+    field, nullable = None, False
+    for part in path.split(LOOKUP_SEP):
+        field = model._meta.pk if part == 'pk' else model._meta.get_field(part)
+        nullable = nullable or field.null
+        if field.is_relation:
+            model = field.related_model
+    return field, nullable
+
+
+# Раскрывает сортировку до простых полей: сортировка по внешнему ключу заменяется
+# сортировкой связанной модели (как это делает Django), в конец добавляется pk.
+# Возвращает список (путь, по убыванию, может ли быть NULL).
+def expand_ordering(model, ordering, prefix='', descending=False, depth=0):
+    keys = []
+    for item in ordering:
+        if not isinstance(item, str) or item == '?':
+            raise ValueError('Keyset-пагинация поддерживает только сортировку по полям: {0!r}'.format(item))
+        desc = item.startswith('-') != descending
+        path = prefix + item.lstrip('-')
+        field, nullable = resolve_path(model, path)
+        related_ordering = field.related_model._meta.ordering if field.is_relation else None
+        if related_ordering and depth < 3:
+            keys.extend(expand_ordering(model, related_ordering, path + LOOKUP_SEP, desc, depth + 1))
+        else:
+            keys.append((path, desc, nullable))
+    if not prefix and not any(path in ('pk', model._meta.pk.name) for path, _, _ in keys):
+        keys.append(('pk', False, False))
+    return keys
+
+
+# Значение поля по пути для объекта модели; для внешнего ключа - значение столбца (author_id).
+# Для строк QuerySet.values() значение берётся по ключу, путь должен быть среди выбранных полей.
+def path_value(obj, path):
+    if isinstance(obj, dict):
+        return obj[path]
+    parts = path.split(LOOKUP_SEP)
+    for part in parts[:-1]:
+        obj = getattr(obj, part)
+        if obj is None:
+            return None
+    last = parts[-1]
+    if last == 'pk':
+        return obj.pk
+    field = obj._meta.get_field(last)
+    return getattr(obj, field.attname)
+
+
+class KeysetPage(Sequence):
+    number = None
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __repr__(self):
+        return '<KeysetPage of {0} objects>'.format(len(self.object_list))
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page, ordering=None, count=False):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.count_enabled = count
+        ordering = ordering or queryset.query.order_by or queryset.model._meta.ordering
+        self.keys = expand_ordering(queryset.model, ordering)
+
+    # Общее количество записей. None, если подсчёт отключён.
+    @cached_property
+    def count(self):
+        if not self.count_enabled:
+            return None
+        return self.queryset.order_by().count()
+
+    # Сортировка с явным положением NULL: при обратном направлении порядок в точности зеркальный.
+    # Для полей без NULL положение не указывается, иначе SQLite (NULL там первый при возрастании)
+    # не читает строки в порядке индекса.
+    @staticmethod
+    def order_by(keys):
+        ordering = []
+        for path, desc, nullable in keys:
+            if not nullable:
+                ordering.append(F(path).desc() if desc else F(path).asc())
+            else:
+                ordering.append(F(path).desc(nulls_first=True) if desc else F(path).asc(nulls_last=True))
+        return ordering
+
+    # Условие "строка идёт после values" для лексикографического порядка по keys:
+    # (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...
+    # Для первого ключа без NULL добавляется k1 >= v1: по такому условию БД начинает чтение индекса
+    # с нужного места, а не фильтрует строки от начала индекса.
+    @staticmethod
+    def after(keys, values):
+        condition, equal = Q(), Q()
+        (path, desc, nullable), value = keys[0], values[0]
+        start = Q(**{path + ('__lte' if desc else '__gte'): value}) if value is not None and not nullable else Q()
+        for (path, desc, nullable), value in zip(keys, values):
+            if value is None:
+                # NULL последний при возрастании и первый при убывании
+                greater = Q(**{path + '__isnull': False}) if desc else None
+                same = Q(**{path + '__isnull': True})
+            else:
+                greater = Q(**{path + ('__lt' if desc else '__gt'): value})
+                if nullable and not desc:
+                    greater |= Q(**{path + '__isnull': True})
+                same = Q(**{path: value})
+            if greater is not None:
+                condition |= equal & greater
+            equal &= same
+        return start & condition
+
+    def encode_cursor(self, direction, obj):
+        values = [path_value(obj, path) for path, _, _ in self.keys]
+        data = json.dumps([direction, values], cls=DjangoJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, values = json.loads(data)
+        except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+            raise InvalidCursor(cursor)
+        if direction not in ('n', 'p') or not isinstance(values, list) or len(values) != len(self.keys):
+            raise InvalidCursor(cursor)
+        return direction, values
+
+    def page(self, cursor=None):
+        direction, values = 'n', None
+        if cursor:
+            direction, values = self.decode_cursor(cursor)
+
+        keys = self.keys
+        if direction == 'p':
+            # Назад - это вперёд по обратной сортировке
+            keys = [(path, not desc, nullable) for path, desc, nullable in keys]
+        queryset = self.queryset.order_by(*self.order_by(keys))
+        if values is not None:
+            queryset = queryset.filter(self.after(keys, values))
+
+        # Одна лишняя строка показывает, есть ли следующая страница, без COUNT(*)
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == 'p':
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = self.encode_cursor('n', rows[-1]) if has_next and rows else None
+        previous_cursor = self.encode_cursor('p', rows[0]) if has_previous and rows else None
+        return KeysetPage(rows, self, next_cursor, previous_cursor)
+
+
+# Примесь для ListView: страницы выбираются по параметру ?cursor=.
+# Старые ссылки вида ?page=N продолжают работать через обычный постраничный вывод Django.
+class KeysetPaginationMixin:
+    cursor_kwarg = 'cursor'
+    # Подсчитывать ли общее количество записей (COUNT(*) на каждой странице)
+    paginate_count = False
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.page_kwarg in self.request.GET and self.cursor_kwarg not in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size, count=self.paginate_count)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('Неверная ссылка на страницу')
+        return paginator, page, page.object_list, page.has_other_pages()
+
+
+# Постраничный вывод с оценкой количества записей: для нефильтрованного списка большой таблицы
+# в PostgreSQL количество берётся из статистики планировщика (pg_class.reltuples), а не COUNT(*).
+# Отфильтрованные списки, небольшие таблицы и прочие СУБД подсчитываются точно.
+class EstimatedCountPaginator(Paginator):
+    # Начиная с какого размера таблицы используется оценка
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        estimate = self.estimated_count()
+        if estimate is not None:
+            return estimate
+        return super().count
+
+    def estimated_count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query') or queryset.query.where or queryset.query.distinct:
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                           [connection.ops.quote_name(queryset.model._meta.db_table)])
+            row = cursor.fetchone()
+        # reltuples = -1: таблица ещё не анализировалась
+        if row is None or row[0] < self.estimate_threshold:
+            return None
+        return int(row[0])
@@ -0,0 +1,142 @@
+# Профилирование отдельных запросов по требованию сотрудника: параметр ?profile= или заголовок X-Profile.
+#   ?profile=cprofile (или ?profile=1) - cProfile, сохраняется дамп pstats;
+#   ?profile=sample - семплирование стека раз в CATALOG_PROFILE_INTERVAL_MS миллисекунд,
+#   сохраняются стеки в свёрнутом формате (flamegraph.pl, speedscope, inferno).
+# Профили сохраняются в модели RequestProfile и просматриваются в админ-панели.
+# Профилируется поток, в котором выполняется представление; при развёртывании через ASGI асинхронные
+# представления выполняются в цикле событий и в семплы не попадают.
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from .models import RequestProfile
+
+PARAMETER = 'profile'
+HEADER = 'HTTP_X_PROFILE'
+MODES = ('cprofile', 'sample')
+
+
+# Запрошенный режим профилирования или None
+def requested_mode(request):
+    value = request.GET.get(PARAMETER) or request.META.get(HEADER)
+    if not value:
+        return None
+    return value if value in MODES else 'cprofile'
+
+
+# Профилировать могут только сотрудники: пользователи админ-панели и библиотекари (право can_mark_returned)
+def can_profile(request):
+    user = request.user
+    return user.is_active and (user.is_staff or user.has_perm('catalog.can_mark_returned'))
+
+
+# Семплирующий профилировщик: отдельный поток раз в interval секунд снимает стек потока запроса
+class StackSampler:
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{0} ({1}:{2})'.format(code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                # В свёрнутом формате стек идёт от корня к листу
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    # Свёрнутые стеки: "корень;...;лист количество" по строке на стек
+    def folded(self):
+        return ''.join('{0} {1}\n'.format(stack, count) for stack, count in self.stacks.most_common())
+
+
+# Выполняет call() под профилировщиком; возвращает (результат, данные профиля, время в мс)
+def run_profiled(mode, call):
+    start = time.perf_counter()
+    if mode == 'sample':
+        sampler = StackSampler(getattr(settings, 'CATALOG_PROFILE_INTERVAL_MS', 1) / 1000)
+        sampler.start()
+        try:
+            result = call()
+        finally:
+            sampler.stop()
+        data = sampler.folded().encode()
+    else:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(call)
+        profiler.create_stats()
+        # Тот же формат, что у pstats.Stats.dump_stats()
+        data = marshal.dumps(profiler.stats)
+    return result, data, (time.perf_counter() - start) * 1000
+
+
+def save_profile(request, response, mode, data, duration):
+    profile = RequestProfile.objects.create(
+        user=request.user if request.user.is_authenticated else None,
+        method=request.method,
+        path=request.get_full_path()[:500],
+        view_name=request.resolver_match.view_name if request.resolver_match else '',
+        status_code=response.status_code,
+        mode=mode,
+        duration=duration,
+        data=data,
+    )
+    # Хранятся только последние CATALOG_PROFILE_KEEP профилей
+    keep = getattr(settings, 'CATALOG_PROFILE_KEEP', 100)
+    old = RequestProfile.objects.order_by('-created', '-pk').values_list('pk', flat=True)[keep:]
+    RequestProfile.objects.filter(pk__in=list(old)).delete()
+    return profile
+
+
+# Объект для pstats.Stats из сохранённого дампа
+class StoredStats:
+    def __init__(self, data):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self):
+        pass
+
+
+# Краткая сводка профиля для админ-панели: самые затратные функции или самые частые стеки
+def summary(profile, limit=30):
+    data = bytes(profile.data)
+    if profile.mode == 'sample':
+        lines = data.decode().splitlines()
+        total = sum(int(line.rsplit(' ', 1)[1]) for line in lines)
+        if not total:
+            return 'Семплов нет: запрос выполнился быстрее интервала семплирования'
+        leaves = Counter()
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            leaves[stack.rsplit(';', 1)[-1]] += int(count)
+        return 'Семплов: {0}\n'.format(total) + ''.join(
+            '{0:>6} {1:>6.1%}  {2}\n'.format(count, count / total, leaf) for leaf, count in leaves.most_common(limit))
+    output = io.StringIO()
+    stats = pstats.Stats(StoredStats(data), stream=output)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
+
+
+# Имя файла для скачивания
+def filename(profile):
+    return 'profile-{0}.{1}'.format(profile.pk, 'folded' if profile.mode == 'sample' else 'prof')
@@ -0,0 +1,137 @@
+# Полнотекстовый поиск книг по названию, аннотации, ISBN и имени автора.
+# PostgreSQL: хранимый столбец tsvector (Book.search_vector) с GIN-индексом.
+# SQLite: теневая таблица FTS5 catalog_book_fts (rowid = id книги).
+# Индекс обновляется сигналами при сохранении книги и автора (см. catalog/signals.py).
+# django.contrib.postgres.search требует psycopg2, поэтому импортируется только для PostgreSQL.
+import re
+from itertools import islice
+
+from django.db import connection
+from django.db.models import F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Concat
+
+from .models import Author, Book
+
+# Конфигурация текстового поиска PostgreSQL (стемминг русского языка)
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'catalog_book_fts'
+# Сколько книг переиндексируется одним запросом
+INDEX_CHUNK_SIZE = 5000
+
+
+# Порции по size id; ids читаются по мере обработки порций
+def chunks(ids, size=INDEX_CHUNK_SIZE):
+    ids = iter(ids)
+    while True:
+        chunk = list(islice(ids, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Выражение tsvector книги: название и ISBN важнее имени автора, имя автора важнее аннотации
+def book_search_vector():
+    from django.contrib.postgres.search import SearchVector
+
+    author_name = Subquery(
+        Author.objects.filter(pk=OuterRef('author_id'))
+        .annotate(full_name=Concat('last_name', Value(' '), 'first_name'))
+        .values('full_name')[:1]
+    )
+    return (SearchVector('title', 'isbn', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(author_name, weight='B', config=SEARCH_CONFIG)
+            + SearchVector('summary', weight='C', config=SEARCH_CONFIG))
+
+
+def _placeholders(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+# Пересоздание строк FTS5 для пачки книг (chunk=None - для всех книг)
+def _index_sqlite(cursor, chunk=None):
+    where = ''
+    if chunk is None:
+        cursor.execute('DELETE FROM {0}'.format(FTS_TABLE))
+    else:
+        cursor.execute('DELETE FROM {0} WHERE rowid IN ({1})'.format(FTS_TABLE, _placeholders(chunk)), chunk)
+        where = 'WHERE b.id IN ({0})'.format(_placeholders(chunk))
+    cursor.execute(
+        'INSERT INTO {0} (rowid, title, isbn, author, summary) '
+        "SELECT b.id, b.title, b.isbn, COALESCE(a.last_name, '') || ' ' || COALESCE(a.first_name, ''), b.summary "
+        'FROM {1} b LEFT JOIN {2} a ON a.id = b.author_id {3}'.format(
+            FTS_TABLE, Book._meta.db_table, Author._meta.db_table, where), chunk or ())
+
+
+# Переиндексация книг с указанными id (None - все книги)
+def index_books(book_ids=None):
+    if connection.vendor == 'postgresql':
+        if book_ids is None:
+            Book.objects.update(search_vector=book_search_vector())
+        else:
+            for chunk in chunks(book_ids):
+                Book.objects.filter(pk__in=chunk).update(search_vector=book_search_vector())
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            if book_ids is None:
+                _index_sqlite(cursor)
+            else:
+                for chunk in chunks(book_ids):
+                    _index_sqlite(cursor, chunk)
+
+
+def unindex_books(book_ids):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for chunk in chunks(book_ids):
+                cursor.execute('DELETE FROM {0} WHERE rowid IN ({1})'.format(FTS_TABLE, _placeholders(chunk)), chunk)
+
+
+# Запрос FTS5: каждое слово ищется как префикс, все слова обязательны
+def _fts5_query(query):
+    return ' '.join('"{0}"*'.format(word) for word in re.findall(r'\w+', query))
+
+
+# Поиск книг. Возвращает список книг (с подгруженным автором), отсортированный по релевантности;
+# у каждой книги есть атрибут rank - чем больше, тем релевантнее.
+def search_books(query, limit=20):
+    query = query.strip()
+    if not query:
+        return []
+    books = Book.objects.select_related('author')
+
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorExact
+
+        ts_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        # search_vector @@ запрос (поле модели - не SearchVectorField Django, поэтому lookup указан явно)
+        return list(books.filter(SearchVectorExact(F('search_vector'), ts_query))
+                    .annotate(rank=SearchRank(F('search_vector'), ts_query))
+                    .order_by('-rank', 'pk')[:limit])
+
+    if connection.vendor == 'sqlite':
+        match = _fts5_query(query)
+        if not match:
+            return []
+        with connection.cursor() as cursor:
+            # Веса столбцов bm25: title, isbn, author, summary
+            cursor.execute('SELECT rowid, bm25({0}, 10.0, 10.0, 5.0, 1.0) AS score FROM {0} '
+                           'WHERE {0} MATCH %s ORDER BY score LIMIT %s'.format(FTS_TABLE), [match, limit])
+            scores = {book_id: -score for book_id, score in cursor.fetchall()}
+        found = books.in_bulk(list(scores))
+        result = []
+        for book_id, rank in scores.items():
+            if book_id in found:
+                found[book_id].rank = rank
+                result.append(found[book_id])
+        return result
+
+    # Прочие СУБД: поиск без индекса
+    words = query.split()
+    condition = Q()
+    for word in words:
+        condition &= (Q(title__icontains=word) | Q(summary__icontains=word) | Q(isbn__icontains=word)
+                      | Q(author__last_name__icontains=word) | Q(author__first_name__icontains=word))
+    result = list(books.filter(condition)[:limit])
+    for book in result:
+        book.rank = 0
+    return result
@@ -0,0 +1,318 @@
+# Обработчики сигналов моделей каталога. Подключаются в CatalogConfig.ready().
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from . import availability, caching, counters, lookups, search, versions
+from .models import Author, Book, BookInstance, Genre, Language
+
+# Отправляется после массовой загрузки данных в обход save() (генератор, импорт).
+# Аргумент book_ids - id загруженных книг или None, если изменился весь каталог.
+# partial=True - загружена часть данных (пачка импорта): счётчики каталога пересчитываются по всем таблицам
+# не после каждой пачки, а один раз, когда отправитель закончит загрузку и отправит сигнал без partial.
+catalog_bulk_loaded = Signal()
+
+# Отправляется после изменения экземпляров книг через QuerySet.update() (массовое продление и возврат).
+# pks - id изменённых экземпляров, fields - изменённые поля, book_ids - id их книг,
+# status_changes - {(старый статус, новый статус): количество экземпляров}.
+book_instances_updated = Signal()
+
+# Отложенные записи текущего потока (см. deferred_writes) или None
+_deferred = threading.local()
+
+
+# Производные данные экземпляров - счётчики каталога, сводка доступности в строке книги, версия экземпляров
+# для API - хранятся в общих строках, которые изменяет каждая выдача и каждый возврат. Запись в такую строку
+# внутри транзакции выдачи блокирует её до фиксации, и одновременные выдачи выстраиваются в очередь за этой
+# блокировкой, хотя сами экземпляры выбираются с SKIP LOCKED (catalog/circulation.py).
+# Внутри блока deferred_writes() обработчики экземпляров не пишут эти строки, а запоминают записи;
+# после выхода из блока (транзакция выдачи уже зафиксирована) каждая выполняется отдельным коротким UPDATE,
+# который держит блокировку строки только на время своего выполнения. Если блок завершился исключением
+# (транзакция отменена), записи отбрасываются. Вне блока записи выполняются сразу.
+@contextmanager
+def deferred_writes():
+    if getattr(_deferred, 'calls', None) is not None:
+        yield
+        return
+    _deferred.calls = calls = []
+    try:
+        yield
+    finally:
+        _deferred.calls = None
+    for func, args in calls:
+        func(*args)
+
+
+# Запись производных данных: сразу или после блока deferred_writes()
+def write(func, *args):
+    calls = getattr(_deferred, 'calls', None)
+    if calls is None:
+        func(*args)
+    else:
+        calls.append((func, args))
+
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    search.unindex_books([instance.pk])
+
+
+# Имя автора входит в поисковый индекс его книг
+@receiver(post_save, sender=Author)
+def reindex_author_books(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_books(instance.book_set.values_list('pk', flat=True))
+
+
+# При удалении автора у его книг обнуляется author_id, поэтому id книг запоминаются заранее
+@receiver(pre_delete, sender=Author)
+def remember_author_books(sender, instance, **kwargs):
+    instance._book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def reindex_orphaned_books(sender, instance, **kwargs):
+    search.index_books(getattr(instance, '_book_ids', []))
+
+
+@receiver(catalog_bulk_loaded)
+def index_loaded_books(sender, book_ids=None, **kwargs):
+    search.index_books(book_ids)
+
+
+# Счётчики домашней страницы
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+def count_created(sender, instance, created, **kwargs):
+    if created:
+        counters.increment(counters.BOOKS if sender is Book else counters.AUTHORS)
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+def count_deleted(sender, instance, **kwargs):
+    counters.increment(counters.BOOKS if sender is Book else counters.AUTHORS, -1)
+
+
+# Статус и книга экземпляра до сохранения: из значений, загруженных из БД (BookInstance.from_db),
+# или одним запросом, если они не загружались
+def stored_values(instance):
+    loaded = getattr(instance, '_loaded_values', {})
+    if 'status' in loaded and 'book_id' in loaded:
+        return loaded['status'], loaded['book_id']
+    return BookInstance.objects.filter(pk=instance.pk).values_list('status', 'book_id').first() or (None, None)
+
+
+@receiver(pre_save, sender=BookInstance)
+def remember_stored_status(sender, instance, raw=False, update_fields=None, **kwargs):
+    if update_fields is not None and not {'status', 'book', 'book_id'} & set(update_fields):
+        instance._stored_status, instance._stored_book_id = instance.status, instance.book_id
+    elif instance._state.adding and not raw:
+        instance._stored_status, instance._stored_book_id = None, None
+    else:
+        # loaddata (raw) может перезаписывать существующие строки
+        instance._stored_status, instance._stored_book_id = stored_values(instance)
+
+
+@receiver(post_save, sender=BookInstance)
+def count_saved_instance(sender, instance, created, **kwargs):
+    if created:
+        write(counters.increment, counters.INSTANCES)
+        write(counters.status_changed, None, instance.status)
+    else:
+        write(counters.status_changed, instance._stored_status, instance.status)
+    # Следующее сохранение этого объекта сравнивается с только что записанным статусом
+    instance._loaded_values = dict(getattr(instance, '_loaded_values', {}), status=instance.status)
+
+
+@receiver(post_delete, sender=BookInstance)
+def count_deleted_instance(sender, instance, **kwargs):
+    write(counters.increment, counters.INSTANCES, -1)
+    write(counters.status_changed, getattr(instance, '_loaded_values', {}).get('status', instance.status), None)
+
+
+@receiver(book_instances_updated)
+def count_updated_instances(sender, status_changes=None, **kwargs):
+    for (old_status, new_status), count in (status_changes or {}).items():
+        counters.status_changed(old_status, new_status, count)
+
+
+@receiver(catalog_bulk_loaded)
+def rebuild_counters(sender, partial=False, **kwargs):
+    if not partial:
+        counters.rebuild()
+
+
+# Сводка доступности книг (catalog/availability.py). Экземпляр мог перейти к другой книге:
+# тогда он уходит из счётчика прежней книги и добавляется в счётчик новой.
+# Доступность показана в списке книг, поэтому её изменение сбрасывает и кэш списка.
+@receiver(post_save, sender=BookInstance)
+def update_saved_availability(sender, instance, created, **kwargs):
+    old_status, old_book_id = instance._stored_status, instance._stored_book_id
+    if old_book_id == instance.book_id:
+        write(availability.status_changed, instance.book_id, old_status, instance.status)
+    else:
+        write(availability.status_changed, old_book_id, old_status, None)
+        write(availability.status_changed, instance.book_id, None, instance.status)
+    # Дата возврата взятого экземпляра могла измениться и без смены статуса (продление)
+    on_loan = availability.ON_LOAN in (old_status, instance.status)
+    if on_loan:
+        write(availability.refresh_due_back, [old_book_id, instance.book_id])
+    if on_loan or (old_status, old_book_id) != (instance.status, instance.book_id):
+        write(caching.bump, caching.AVAILABILITY)
+
+
+@receiver(post_delete, sender=BookInstance)
+def update_deleted_availability(sender, instance, **kwargs):
+    loaded = getattr(instance, '_loaded_values', {})
+    status, book_id = loaded.get('status', instance.status), loaded.get('book_id', instance.book_id)
+    write(availability.status_changed, book_id, status, None)
+    if status == availability.ON_LOAN:
+        write(availability.refresh_due_back, [book_id])
+    write(caching.bump, caching.AVAILABILITY)
+
+
+# Массовые изменения статусов пересчитывают сводку изменённых книг, продление - только ближайшую дату возврата
+@receiver(book_instances_updated)
+def rebuild_updated_availability(sender, book_ids=(), fields=(), **kwargs):
+    fields = set(fields or ())
+    if 'status' in fields:
+        availability.rebuild(book_ids or ())
+    elif 'due_back' in fields:
+        availability.refresh_due_back(book_ids or ())
+    else:
+        return
+    caching.bump(caching.AVAILABILITY)
+
+
+@receiver(catalog_bulk_loaded)
+def rebuild_loaded_availability(sender, book_ids=None, **kwargs):
+    availability.rebuild(book_ids)
+
+
+# Версии данных для JSON API (catalog/versions.py). В ответах о книгах есть имя автора,
+# названия жанров и языка, поэтому их изменение меняет и версию книг.
+VERSIONS = {
+    Book: (versions.BOOK,),
+    Author: (versions.AUTHOR, versions.BOOK),
+    Genre: (versions.GENRE, versions.BOOK),
+    Language: (versions.LANGUAGE, versions.BOOK),
+    BookInstance: (versions.BOOK_INSTANCE,),
+}
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def bump_version(sender, **kwargs):
+    if sender in VERSIONS:
+        write(versions.bump, *VERSIONS[sender])
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def bump_book_genres_version(sender, action, **kwargs):
+    if action.startswith('post_'):
+        versions.bump(versions.BOOK)
+
+
+@receiver(book_instances_updated)
+def bump_updated_instances_version(sender, **kwargs):
+    versions.bump(versions.BOOK_INSTANCE)
+
+
+@receiver(catalog_bulk_loaded)
+def bump_loaded_versions(sender, **kwargs):
+    versions.bump_all()
+
+
+# Версии кэша страниц (catalog/caching.py). Страница книги зависит от книги, её экземпляров, жанров,
+# своего автора и языков; страница автора - от автора, его книг и их экземпляров.
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def bump_book_cache(sender, instance, **kwargs):
+    # Книга могла перейти к другому автору - сбрасываются страницы обоих
+    author_ids = {instance.author_id, getattr(instance, '_loaded_values', {}).get('author_id')} - {None}
+    caching.bump(caching.BOOKS, caching.book_version(instance.pk),
+                 *[caching.author_version(pk) for pk in author_ids])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def bump_author_cache(sender, instance, **kwargs):
+    caching.bump(caching.AUTHORS, caching.author_version(instance.pk))
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def bump_genre_cache(sender, **kwargs):
+    caching.bump(caching.GENRES)
+
+
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def bump_language_cache(sender, **kwargs):
+    caching.bump(caching.LANGUAGES)
+
+
+# Справочники жанров и языков в памяти процессов (catalog/lookups.py)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def reset_genre_lookup(sender, **kwargs):
+    lookups.reset(lookups.GENRES)
+
+
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def reset_language_lookup(sender, **kwargs):
+    lookups.reset(lookups.LANGUAGES)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def bump_book_genres_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        caching.bump(caching.book_version(instance.pk))
+    elif pk_set:
+        # genre.book_set.add(...) - изменились жанры книг из pk_set
+        caching.bump(*[caching.book_version(pk) for pk in pk_set])
+    else:
+        # genre.book_set.clear() - какие книги затронуты, неизвестно
+        caching.bump(caching.BOOKS, caching.CATALOG)
+
+
+# Экземпляры сбрасывают страницы своих книг и авторов этих книг (автор - одним запросом)
+def bump_books_cache(book_ids):
+    book_ids = {pk for pk in book_ids if pk is not None}
+    if not book_ids:
+        return
+    author_ids = Book.objects.filter(pk__in=book_ids, author__isnull=False).values_list('author_id', flat=True)
+    caching.bump(*[caching.book_version(pk) for pk in book_ids],
+                 *[caching.author_version(pk) for pk in set(author_ids)])
+
+
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+def bump_instance_cache(sender, instance, **kwargs):
+    # Экземпляр мог перейти к другой книге - сбрасываются обе
+    loaded = getattr(instance, '_loaded_values', {})
+    write(bump_books_cache, [instance.book_id, loaded.get('book_id')])
+    instance._loaded_values = dict(loaded, book_id=instance.book_id)
+
+
+@receiver(book_instances_updated)
+def bump_updated_instances_cache(sender, book_ids=(), **kwargs):
+    bump_books_cache(book_ids or ())
+
+
+@receiver(catalog_bulk_loaded)
+def bump_loaded_cache(sender, **kwargs):
+    caching.bump(caching.CATALOG)
@@ -0,0 +1,89 @@
+// Автодополнение для полей выбора с атрибутом data-autocomplete-url (catalog/forms.py, AutocompleteSelect).
+// В списке выбора есть только выбранные варианты. При вводе текста варианты загружаются из JSON
+// ({"results": [{"id": ..., "text": ...}]}, catalog/api.py) и по щелчку добавляются в список как выбранные.
+(function () {
+    'use strict';
+
+    // Пауза после нажатия клавиши перед запросом, мс
+    var DELAY_MS = 250;
+
+    function setup(select) {
+        var input = document.createElement('input');
+        input.type = 'search';
+        input.placeholder = 'Начните вводить';
+        input.autocomplete = 'off';
+        var list = document.createElement('ul');
+        list.className = 'autocomplete-results';
+        select.parentNode.insertBefore(input, select);
+        select.parentNode.insertBefore(list, select.nextSibling);
+
+        var timer = null;
+        var results = [];
+        var requestNumber = 0;
+
+        function choose(item) {
+            var option = null;
+            for (var i = 0; i < select.options.length; i++) {
+                if (select.options[i].value === String(item.id)) {
+                    option = select.options[i];
+                }
+            }
+            if (option === null) {
+                option = new Option(item.text, item.id);
+                select.add(option);
+            }
+            option.selected = true;
+            show([]);
+            input.value = '';
+            select.dispatchEvent(new Event('change', {bubbles: true}));
+        }
+
+        function show(items) {
+            results = items;
+            list.innerHTML = '';
+            items.forEach(function (item) {
+                var entry = document.createElement('li');
+                entry.textContent = item.text;
+                // mousedown, а не click: иначе поле ввода теряет фокус и список скрывается раньше
+                entry.addEventListener('mousedown', function (event) {
+                    event.preventDefault();
+                    choose(item);
+                });
+                list.appendChild(entry);
+            });
+        }
+
+        function load() {
+            // Ответы на устаревшие запросы (пользователь продолжил ввод) не показываются
+            var number = ++requestNumber;
+            var url = select.getAttribute('data-autocomplete-url') + '?q=' + encodeURIComponent(input.value.trim());
+            fetch(url, {headers: {'Accept': 'application/json'}, credentials: 'same-origin'})
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    if (number === requestNumber) {
+                        show(data.results);
+                    }
+                });
+        }
+
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(load, DELAY_MS);
+        });
+        input.addEventListener('focus', load);
+        input.addEventListener('blur', function () { show([]); });
+        // Enter выбирает первый вариант вместо отправки формы
+        input.addEventListener('keydown', function (event) {
+            if (event.key === 'Enter') {
+                event.preventDefault();
+                if (results.length) {
+                    choose(results[0]);
+                }
+            }
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        Array.prototype.forEach.call(document.querySelectorAll('select[data-autocomplete-url]'), setup);
+    });
+})();
@@ -0,0 +1,12 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from catalog import caching
+
+register = template.Library()
+
+
+# Боковая панель из кэша: {% cached_sidebar %} (см. catalog/caching.py)
+@register.simple_tag(takes_context=True)
+def cached_sidebar(context):
+    return mark_safe(caching.render_sidebar(context))
@@ -1,9 +1,45 @@
-from django.test import TestCase
+from io import StringIO
+import asyncio
+import csv
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
 
+import datetime
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import Permission, User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.template import engines
+from django.test import (AsyncClient, LiveServerTestCase, RequestFactory, TestCase, TransactionTestCase,
+                         skipUnlessDBFeature)
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import get_resolver, reverse
 
 # Create your tests here.
 
-from .models import Author
+from . import (admin as catalog_admin, api, availability, caching, circulation, counters, lookups, profiling, signals,
+               views)
+from .benchmark import benchmark_users, measure_request, route_plan, seed_catalog
+from .circulation import bulk_update_loans
+from .forms import BookForm
+from .generator import CatalogGenerator
+from .ids import uuid7, uuid7_timestamp_ms
+from .importer import CatalogImporter
+from .middleware import ProfilingMiddleware, RequestTimingMiddleware, normalize_sql
+from .models import (Author, Book, BookInstance, ConcurrentUpdateError, Genre, Hold, ImportCheckpoint, Language,
+                     RequestProfile)
+from .pagination import EstimatedCountPaginator, KeysetPaginator
+from .search import search_books
 
 
 class AuthorModelTest(TestCase):
@@ -52,3 +88,1845 @@ class AuthorModelTest(TestCase):
         author = Author.objects.get(id=1)
         # Тест не пройдёт, если url страницы автора не определен.
         self.assertEqual(author.get_absolute_url(), '/catalog/author/1')
+
+
+# Тесты производительности представлений каталога.
+# Каждый маршрут из catalog/urls.py выполняется на синтетическом каталоге,
+# для него замеряются количество запросов, время SQL и время отрисовки шаблона (кэш страниц отключён).
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ViewPerformanceTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = benchmark_users()
+        seed_catalog(authors=500, books=2000, copies=4000, borrowers=[cls.users['reader']])
+        cls.book = Book.objects.filter(bookinstance__isnull=False).order_by('pk').first()
+        cls.author = cls.book.author
+        cls.copy = BookInstance.objects.filter(status='в').order_by('pk').first()
+
+    def client_for(self, role):
+        if role is not None:
+            self.client.force_login(self.users[role])
+        else:
+            self.client.logout()
+        return self.client
+
+    def test_every_catalog_route_is_measured(self):
+        plan = route_plan(self.book, self.author, self.copy)
+        catalog_routes = {pattern.name for pattern in get_resolver('catalog.urls').url_patterns}
+        self.assertEqual(catalog_routes - {name for name, *_ in plan}, set())
+
+        for name, method, url, data, role, _ in plan:
+            metrics = measure_request(self.client_for(role), name, method, url, data)
+            # После успешного продления происходит перенаправление на список взятых книг
+            self.assertIn(metrics.status_code, (200, 302), metrics)
+            self.assertGreater(metrics.total_time, 0)
+
+    # Количество запросов списка не должно зависеть от размера страницы (нет N+1)
+    def test_list_query_count_does_not_grow_with_page_size(self):
+        list_views = [
+            ('book', views.BookListView, None),
+            ('authors', views.AuthorListView, None),
+            ('my-borrowed', views.LoanedBooksByUserListView, 'reader'),
+            ('all-borrowed', views.LoanedBooksAllListView, 'librarian'),
+            ('all-books', views.LoanedBooksAllListViewAll, 'librarian'),
+        ]
+        for name, view_class, role in list_views:
+            counts = []
+            for page_size in (5, 50):
+                client = self.client_for(role)
+                with mock.patch.object(view_class, 'paginate_by', page_size):
+                    metrics = measure_request(client, name, 'get', reverse(name))
+                self.assertEqual(metrics.status_code, 200)
+                counts.append(metrics.queries)
+            self.assertEqual(counts[0], counts[1], '{0}: {1}'.format(name, counts))
+
+
+class GenerateCatalogCommandTest(TestCase):
+
+    def generate(self, seed):
+        call_command('generate_catalog', authors=30, books=100, copies=400, genres=6, languages=3,
+                     borrowers=10, batch_size=64, seed=seed, stdout=StringIO())
+        return (
+            list(Book.objects.order_by('pk').values_list('title', 'isbn', 'author__last_name', 'language__name')),
+            list(BookInstance.objects.order_by('pk').values_list('pk', 'book__title', 'status', 'due_back',
+                                                                 'borrower__username')),
+            sorted(Book.genre.through.objects.values_list('book__isbn', 'genre__name')),
+        )
+
+    def clear(self):
+        for model in (BookInstance, Book, Author, Genre, Language):
+            model.objects.all().delete()
+        User.objects.filter(username__startswith='reader').delete()
+
+    def test_counts_and_relations(self):
+        self.generate(seed=1)
+        self.assertEqual(Author.objects.count(), 30)
+        self.assertEqual(Book.objects.count(), 100)
+        self.assertEqual(BookInstance.objects.count(), 400)
+        self.assertEqual(Book.objects.filter(genre__isnull=True).count(), 0)
+        # Взятые книги имеют заёмщика и дату возврата, доступные - нет
+        self.assertFalse(BookInstance.objects.filter(status='в', borrower__isnull=True).exists())
+        self.assertFalse(BookInstance.objects.filter(status='в', due_back__isnull=True).exists())
+        self.assertFalse(BookInstance.objects.filter(status='д', due_back__isnull=False).exists())
+        self.assertEqual(set(BookInstance.objects.values_list('status', flat=True).distinct()), set('твдз'))
+
+    def test_same_seed_generates_same_catalog(self):
+        first = self.generate(seed=7)
+        self.clear()
+        self.assertEqual(self.generate(seed=7), first)
+        self.clear()
+        self.assertNotEqual(self.generate(seed=8), first)
+
+
+# Замеряются запросы самих представлений - кэш страниц отключён
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Одинаковые названия, книги без автора и экземпляры без даты возврата - крайние случаи для курсора
+        authors = [Author.objects.create(first_name='Имя', last_name=last_name) for last_name in 'ВБАБ']
+        for number in range(23):
+            book = Book.objects.create(title='Книга {0}'.format(number % 7),
+                                       author=authors[number % 4] if number % 5 else None,
+                                       summary='-', isbn=str(number))
+            for copy in range(2):
+                BookInstance.objects.create(book=book, imprint='-', status='в' if copy else 'д',
+                                            due_back=datetime.date(2030, 1, number % 6 + 1) if number % 3 else None)
+
+    def walk(self, queryset, per_page):
+        paginator = KeysetPaginator(queryset, per_page)
+        pages, page = [], paginator.page()
+        pages.append(list(page))
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            pages.append(list(page))
+        backwards = [list(page)]
+        while page.has_previous():
+            page = paginator.page(page.previous_cursor)
+            backwards.insert(0, list(page))
+        return paginator, pages, backwards
+
+    def test_walk_matches_full_ordering(self):
+        querysets = [
+            Book.objects.select_related('author'),
+            Author.objects.all(),
+            BookInstance.objects.order_by('due_back'),
+            BookInstance.objects.select_related('book__author').order_by('book'),
+        ]
+        for queryset in querysets:
+            for per_page in (1, 4, 10, 100):
+                paginator, pages, backwards = self.walk(queryset, per_page)
+                expected = list(queryset.order_by(*paginator.order_by(paginator.keys)))
+                self.assertEqual([obj.pk for page in pages for obj in page], [obj.pk for obj in expected])
+                self.assertTrue(all(len(page) == per_page for page in pages[:-1]))
+                # Обратный проход по курсорам "назад" возвращает те же объекты в том же порядке
+                self.assertEqual([obj.pk for page in backwards for obj in page], [obj.pk for obj in expected])
+
+    def test_book_ordering_follows_author_meta_ordering(self):
+        keys = KeysetPaginator(Book.objects.all(), 10).keys
+        self.assertEqual([path for path, _, _ in keys], ['title', 'author__last_name', 'author__first_name', 'pk'])
+        # Список книг (BookListView) - в порядке индекса book_title_id_idx
+        keys = KeysetPaginator(views.BookListView(request=None).get_queryset(), 10).keys
+        self.assertEqual([path for path, _, _ in keys], ['title', 'pk'])
+        # Чтение индекса начинается с названия последней книги страницы
+        sql = str(Book.objects.filter(KeysetPaginator.after(keys, ['Обломов', 5])).query)
+        self.assertIn('"catalog_book"."title" >= Обломов', sql)
+
+    def test_views_follow_cursor_links_without_count(self):
+        self.client.force_login(User.objects.create_user('librarian'))
+        user = User.objects.get(username='librarian')
+        user.user_permissions.add(*Permission.objects.filter(codename='can_mark_returned'))
+        BookInstance.objects.filter(status='в').update(borrower=user)
+        for name, total in (('book', 23), ('authors', 4), ('my-borrowed', 23), ('all-borrowed', 23),
+                            ('all-books', 46)):
+            seen, url, query_counts = [], reverse(name), []
+            while url:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries), name)
+                query_counts.append(len(queries))
+                seen.extend(obj.pk for obj in response.context['object_list'])
+                page = response.context['page_obj']
+                url = page.has_next() and '{0}?cursor={1}'.format(reverse(name), page.next_cursor)
+            self.assertEqual(len(seen), total, name)
+            self.assertEqual(len(set(seen)), total, name)
+            self.assertEqual(len(set(query_counts)), 1, name)
+
+    def test_page_number_links_still_work(self):
+        response = self.client.get(reverse('book') + '?page=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page_obj'].number, 2)
+
+    def test_invalid_cursor_is_404(self):
+        self.assertEqual(self.client.get(reverse('book') + '?cursor=garbage').status_code, 404)
+
+
+class BookSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tolstoy = Author.objects.create(first_name='Лев', last_name='Толстой')
+        cls.war = Book.objects.create(title='Война и мир', author=cls.tolstoy, summary='Роман-эпопея',
+                                      isbn='9785170906307')
+        cls.anna = Book.objects.create(title='Анна Каренина', author=cls.tolstoy,
+                                       summary='Роман о любви, в котором нет войны', isbn='9785389062184')
+        cls.other = Book.objects.create(title='Мастер и Маргарита', summary='Роман, где упоминается Анна',
+                                        isbn='9785170878178')
+
+    def found(self, query):
+        return [book.pk for book in search_books(query)]
+
+    def test_search_by_title_author_and_isbn(self):
+        self.assertEqual(self.found('эпопея'), [self.war.pk])
+        self.assertEqual(set(self.found('Толстой')), {self.war.pk, self.anna.pk})
+        self.assertEqual(self.found('9785389062184'), [self.anna.pk])
+        self.assertEqual(self.found('Маргарита'), [self.other.pk])
+        self.assertEqual(self.found(''), [])
+
+    def test_title_match_ranks_above_summary_match(self):
+        self.assertEqual(self.found('Анна'), [self.anna.pk, self.other.pk])
+        results = search_books('Анна')
+        self.assertGreater(results[0].rank, results[1].rank)
+
+    def test_index_follows_saves_and_deletes(self):
+        self.other.title = 'Собачье сердце'
+        self.other.save()
+        self.assertEqual(self.found('Маргарита'), [])
+        self.assertEqual(self.found('сердце'), [self.other.pk])
+
+        self.tolstoy.last_name = 'Толстой-Старший'
+        self.tolstoy.save()
+        self.assertEqual(set(self.found('Старший')), {self.war.pk, self.anna.pk})
+
+        self.tolstoy.delete()
+        self.assertEqual(self.found('Старший'), [])
+        self.anna.delete()
+        self.assertEqual(self.found('Каренина'), [])
+
+    def test_search_page_and_api(self):
+        response = self.client.get(reverse('search'), {'q': 'эпопея'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['book_list']), [self.war])
+
+        data = self.client.get(reverse('api-search'), {'q': 'Толстой', 'limit': 1}).json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual(data['results'][0]['author'], 'Толстой, Лев')
+
+
+class CatalogCounterTest(TestCase):
+
+    def assertCountersMatchTables(self):
+        self.assertEqual(counters.get_counts(), {
+            counters.BOOKS: Book.objects.count(),
+            counters.INSTANCES: BookInstance.objects.count(),
+            counters.INSTANCES_AVAILABLE: BookInstance.objects.filter(status='д').count(),
+            counters.AUTHORS: Author.objects.count(),
+        })
+
+    def test_counters_follow_saves_status_changes_and_deletes(self):
+        author = Author.objects.create(first_name='Лев', last_name='Толстой')
+        book = Book.objects.create(title='Война и мир', author=author, summary='-', isbn='1')
+        copies = [BookInstance.objects.create(book=book, imprint='-', status=status) for status in 'дтдв']
+        self.assertCountersMatchTables()
+
+        copies[1].status = 'д'
+        copies[1].save()
+        copies[0].status = 'в'
+        copies[0].save()
+        # Экземпляр, загруженный заново, и сохранение с update_fields
+        copy = BookInstance.objects.get(pk=copies[3].pk)
+        copy.status = 'д'
+        copy.save(update_fields=['status'])
+        copy.due_back = datetime.date(2030, 1, 1)
+        copy.save(update_fields=['due_back'])
+        # Статус не загружался из БД (отложенное поле)
+        deferred = BookInstance.objects.only('imprint').get(pk=copies[2].pk)
+        deferred.status = 'з'
+        deferred.save()
+        self.assertCountersMatchTables()
+
+        BookInstance.objects.filter(pk=copies[1].pk).delete()
+        book.delete()
+        author.delete()
+        self.assertCountersMatchTables()
+
+    def test_bulk_load_rebuilds_counters(self):
+        seed_catalog(authors=20, books=50, copies=200)
+        self.assertCountersMatchTables()
+
+    def test_index_page_reads_counters_without_count_queries(self):
+        seed_catalog(authors=20, books=50, copies=200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_instances'], 200)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(sum('catalog_catalogcounter' in query['sql'] for query in queries.captured_queries), 1)
+
+    def test_rebuild_command(self):
+        Book.objects.bulk_create([Book(title=str(number), summary='-', isbn=str(number)) for number in range(3)])
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertCountersMatchTables()
+
+
+class VisitCounterTest(TestCase):
+
+    def test_visits_are_counted_without_database_writes(self):
+        for expected in range(3):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('index'))
+            self.assertEqual(response.context['num_visits'], expected)
+            self.assertFalse(any(query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+                                 for query in queries.captured_queries))
+        self.assertNotIn('sessionid', response.cookies)
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.get(reverse('index'))
+        self.client.cookies[views.VISITS_COOKIE] = '1000:forged'
+        self.assertEqual(self.client.get(reverse('index')).context['num_visits'], 0)
+
+    def test_counter_continues_from_session_value(self):
+        session = self.client.session
+        session['num_visits'] = 41
+        session.save()
+        self.assertEqual(self.client.get(reverse('index')).context['num_visits'], 41)
+        self.assertEqual(self.client.get(reverse('index')).context['num_visits'], 42)
+
+
+# Замеряются запросы самих представлений - кэш страниц отключён
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class DetailViewQueryTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.genre = Genre.objects.create(name='Роман')
+        cls.language = Language.objects.create(name='Русский')
+
+    # Автор с books книгами, у каждой copies экземпляров: по очереди доступные и взятые
+    def make_author(self, books, copies):
+        author = Author.objects.create(first_name='Лев', last_name='Толстой')
+        for number in range(books):
+            book = Book.objects.create(title='Книга {0}'.format(number), author=author, summary='-',
+                                       isbn=str(number), language=self.language)
+            book.genre.add(self.genre)
+            BookInstance.objects.bulk_create([BookInstance(book=book, imprint='-', status='дв'[index % 2])
+                                              for index in range(copies)])
+        return author
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_query_count_does_not_grow_with_books_and_copies(self):
+        small, large = self.make_author(1, 1), self.make_author(10, 10)
+        for url_name, small_pk, large_pk in (
+                ('author-detail', small.pk, large.pk),
+                ('book-detail', small.book_set.get().pk, large.book_set.first().pk)):
+            small_count, _ = self.count_queries(reverse(url_name, args=[small_pk]))
+            large_count, _ = self.count_queries(reverse(url_name, args=[large_pk]))
+            self.assertEqual(small_count, large_count, url_name)
+
+    def test_copy_counts(self):
+        author = self.make_author(2, 5)
+        _, response = self.count_queries(reverse('author-detail', args=[author.pk]))
+        self.assertEqual([(book.num_copies, book.num_available, book.num_borrowed)
+                          for book in response.context['author'].book_set.all()], [(5, 3, 2)] * 2)
+        _, response = self.count_queries(reverse('book-detail', args=[author.book_set.first().pk]))
+        book = response.context['book']
+        self.assertEqual((book.num_copies, book.num_available, book.num_borrowed), (5, 3, 2))
+        self.assertContains(response, 'Всего: 5, доступно: 3, взято: 2')
+
+
+class CatalogAdminTest(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_changelist_query_count_does_not_grow_with_rows(self):
+        seed_catalog(authors=5, books=10, copies=20)
+        urls = [reverse('admin:catalog_book_changelist'), reverse('admin:catalog_bookinstance_changelist'),
+                reverse('admin:catalog_author_changelist')]
+        small = [self.count_queries(url)[0] for url in urls]
+        CatalogGenerator(seed=1).generate(authors=50, books=90, copies=200, borrowers=0)
+        self.assertEqual([self.count_queries(url)[0] for url in urls], small)
+
+    def test_large_inlines_are_replaced_by_links(self):
+        author = Author.objects.create(first_name='Лев', last_name='Толстой')
+        book = Book.objects.create(title='Война и мир', author=author, summary='-', isbn='1')
+        BookInstance.objects.bulk_create([BookInstance(book=book, imprint='-')
+                                          for _ in range(catalog_admin.INLINE_LIMIT + 1)])
+        _, response = self.count_queries(reverse('admin:catalog_book_change', args=[book.pk]))
+        self.assertEqual(response.context['inline_admin_formsets'], [])
+        self.assertContains(response, '?book__id__exact={0}'.format(book.pk))
+        # Немного книг у автора - таблица книг остаётся в форме
+        _, response = self.count_queries(reverse('admin:catalog_author_change', args=[author.pk]))
+        self.assertEqual(len(response.context['inline_admin_formsets']), 1)
+
+    def test_estimated_count_falls_back_to_exact_count(self):
+        Genre.objects.bulk_create([Genre(name=str(number)) for number in range(3)])
+        self.assertEqual(EstimatedCountPaginator(Genre.objects.all(), 10).count, 3)
+        self.assertEqual(EstimatedCountPaginator(Genre.objects.filter(name='1'), 10).count, 1)
+
+
+class ListIndexTest(TestCase):
+    # Список - таблица, из которой выбирается страница, - индекс, который должен использоваться
+    plans = [
+        ('book', 'catalog_book', 'book_title_id_idx'),
+        ('authors', 'catalog_author', 'author_name_idx'),
+        ('my-borrowed', 'catalog_bookinstance', 'bookinst_borrower_due_idx'),
+        ('all-borrowed', 'catalog_bookinstance', 'bookinst_loaned_due_idx'),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = benchmark_users()
+        seed_catalog(authors=30, books=100, copies=400, borrowers=cls.users.values(), loans_per_user=20)
+        # Статистика планировщика по тестовым данным
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.client.force_login(self.users['librarian'])
+        # На небольших тестовых данных PostgreSQL предпочёл бы последовательное чтение таблицы
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def tearDown(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('RESET enable_seqscan')
+
+    # План выполнения запроса страницы списка
+    def explain_page_query(self, url_name, table):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        sql = [query['sql'] for query in queries.captured_queries
+               if 'LIMIT' in query['sql'] and 'FROM "{0}"'.format(table) in query['sql']][-1]
+        with connection.cursor() as cursor:
+            cursor.execute(('EXPLAIN ' if connection.vendor == 'postgresql' else 'EXPLAIN QUERY PLAN ') + sql)
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+    def test_list_views_use_indexes(self):
+        plans = {}
+        for url_name, table, index in self.plans:
+            plans[url_name] = plan = self.explain_page_query(url_name, table)
+            self.assertIn(index, plan, '{0}:\n{1}'.format(url_name, plan))
+        # Список книг читается в порядке индекса, без сортировки всей таблицы
+        self.assertNotIn('Sort' if connection.vendor == 'postgresql' else 'TEMP B-TREE', plans['book'])
+
+
+class OverdueLoanTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = datetime.date(2024, 3, 10)
+        cls.readers = [User.objects.create_user('reader{0}'.format(number)) for number in range(2)]
+        book = Book.objects.create(title='Анна Каренина', summary='-', isbn='1')
+        days = datetime.timedelta(days=1)
+        for borrower, status, due_back in [
+                (cls.readers[1], 'в', cls.today - 3 * days),
+                (cls.readers[0], 'в', cls.today - 10 * days),
+                (cls.readers[0], 'в', cls.today - days),
+                (cls.readers[0], 'в', cls.today),
+                (cls.readers[1], 'в', cls.today + days),
+                (cls.readers[1], 'т', cls.today - 5 * days),
+                (None, 'в', None)]:
+            BookInstance.objects.create(book=book, imprint='-', status=status, due_back=due_back,
+                                        borrower=borrower)
+
+    def test_overdue_is_computed_in_sql(self):
+        copies = BookInstance.objects.annotate_overdue(self.today)
+        self.assertEqual(sorted(copy.overdue_by.days for copy in copies if copy.overdue), [1, 3, 10])
+        self.assertEqual(set(BookInstance.objects.overdue(self.today)), {copy for copy in copies if copy.overdue})
+        self.assertEqual([copy.overdue_by for copy in copies.filter(overdue=False)], [None] * 4)
+        longest = copies.filter(overdue=True).order_by('-overdue_by').first()
+        self.assertEqual(longest.due_back, self.today - datetime.timedelta(days=10))
+
+    def test_report_is_grouped_by_borrower(self):
+        out = StringIO()
+        call_command('overdue_report', date=self.today.isoformat(), chunk_size=1, stdout=out)
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual([(row['username'], row['days_overdue']) for row in rows],
+                         [('reader0', '10'), ('reader0', '1'), ('reader1', '3')])
+
+        out = StringIO()
+        call_command('overdue_report', format='jsonl', date=self.today.isoformat(), stdout=out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(record['username'], [loan['days_overdue'] for loan in record['loans']])
+                          for record in records], [('reader0', [10, 1]), ('reader1', [3])])
+
+
+class BulkLoanTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = benchmark_users()
+        book = Book.objects.create(title='Анна Каренина', summary='-', isbn='1')
+        cls.loans = [BookInstance.objects.create(book=book, imprint='-', status='в', borrower=cls.users['reader'],
+                                                 due_back=datetime.date.today())
+                     for _ in range(30)]
+        cls.available = BookInstance.objects.create(book=book, imprint='-', status='д')
+        cls.renewal_date = datetime.date.today() + datetime.timedelta(weeks=2)
+
+    def setUp(self):
+        self.client.force_login(self.users['librarian'])
+
+    def post_api(self, data):
+        return self.client.post(reverse('api-bulk-loans'), json.dumps(data), content_type='application/json')
+
+    def test_renewal_is_one_update_with_per_item_failures(self):
+        missing = '00000000-0000-4000-8000-000000000000'
+        copies = [str(copy.pk) for copy in self.loans] + [str(self.available.pk), missing, 'not-a-uuid']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_api({'copies': copies, 'due_back': self.renewal_date.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], copies[:30])
+        self.assertEqual(set(response.json()['failed']), {str(self.available.pk), missing, 'not-a-uuid'})
+        table = BookInstance._meta.db_table
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') and table in query['sql'].split(' SET ')[0]
+                             for query in queries.captured_queries), 1)
+        self.assertEqual(BookInstance.objects.filter(due_back=self.renewal_date).count(), 30)
+
+    def test_return_clears_loan_and_updates_counters(self):
+        copies = '\n'.join(str(copy.pk) for copy in self.loans[:10])
+        response = self.client.post(reverse('bulk-loans'), {'copies': copies, 'status': 'д'})
+        self.assertEqual(len(response.context['updated']), 10)
+        returned = BookInstance.objects.filter(pk__in=[copy.pk for copy in self.loans[:10]])
+        self.assertEqual(set(returned.values_list('status', 'due_back', 'borrower')), {('д', None, None)})
+        self.assertEqual(counters.get_counts()[counters.INSTANCES_AVAILABLE],
+                         BookInstance.objects.filter(status='д').count())
+
+    def test_invalid_requests(self):
+        too_late = datetime.date.today() + datetime.timedelta(weeks=5)
+        response = self.post_api({'copies': [str(self.loans[0].pk)], 'due_back': too_late.isoformat()})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('due_back', response.json()['errors'])
+        self.assertEqual(self.post_api({'copies': [str(self.loans[0].pk)]}).status_code, 400)
+        self.assertEqual(self.client.post(reverse('api-bulk-loans'), 'x', content_type='application/json')
+                         .status_code, 400)
+        self.client.force_login(self.users['reader'])
+        self.assertEqual(self.post_api({'copies': [str(self.loans[0].pk)], 'status': 'д'}).status_code, 403)
+        self.assertEqual(BookInstance.objects.filter(status='в').count(), 30)
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class BookAvailabilityTest(TestCase):
+    SUMMARY_FIELDS = ('pk', 'copies_available', 'copies_on_loan', 'copies_reserved', 'copies_maintenance',
+                      'next_due_back')
+
+    # Сводка, поддерживаемая сигналами, совпадает с пересчитанной по таблице экземпляров
+    def assertSummaryMatchesTable(self):
+        maintained = list(Book.objects.order_by('pk').values_list(*self.SUMMARY_FIELDS))
+        availability.rebuild()
+        self.assertEqual(maintained, list(Book.objects.order_by('pk').values_list(*self.SUMMARY_FIELDS)))
+
+    def test_summary_follows_saves_moves_and_deletes(self):
+        first = Book.objects.create(title='Идиот', summary='-', isbn='1')
+        second = Book.objects.create(title='Бесы', summary='-', isbn='2')
+        today = datetime.date.today()
+        copies = [BookInstance.objects.create(book=first, imprint='-', status=status, due_back=today)
+                  for status in 'дтвз']
+        first.refresh_from_db()
+        self.assertEqual((first.copies_available, first.copies_on_loan, first.copies_reserved,
+                          first.copies_maintenance, first.copies_total), (1, 1, 1, 1, 4))
+        self.assertEqual(first.next_due_back, today)
+
+        # Выдача, продление с update_fields, переход к другой книге, отложенный статус
+        copies[0].status = 'в'
+        copies[0].due_back = today - datetime.timedelta(days=3)
+        copies[0].save()
+        copy = BookInstance.objects.get(pk=copies[2].pk)
+        copy.due_back = today + datetime.timedelta(days=7)
+        copy.save(update_fields=['due_back'])
+        copies[1].book = second
+        copies[1].save()
+        deferred = BookInstance.objects.only('imprint').get(pk=copies[3].pk)
+        deferred.status = 'в'
+        deferred.book = second
+        deferred.save()
+        self.assertSummaryMatchesTable()
+        first.refresh_from_db()
+        self.assertEqual(first.next_due_back, today - datetime.timedelta(days=3))
+
+        # Возврат книги с ближайшей датой: дата берётся у следующего взятого экземпляра
+        copies[0].status = 'д'
+        copies[0].due_back = None
+        copies[0].save()
+        first.refresh_from_db()
+        self.assertEqual(first.next_due_back, today + datetime.timedelta(days=7))
+        BookInstance.objects.get(pk=copies[2].pk).delete()
+        self.assertSummaryMatchesTable()
+        first.refresh_from_db()
+        self.assertEqual((first.copies_total, first.next_due_back), (1, None))
+
+    def test_bulk_return_and_bulk_load(self):
+        seed_catalog(authors=10, books=30, copies=300)
+        self.assertSummaryMatchesTable()
+        loans = list(BookInstance.objects.filter(status='в').values_list('pk', flat=True)[:20])
+        updated, failures = bulk_update_loans(loans, status='д')
+        self.assertEqual((len(updated), failures), (20, {}))
+        self.assertSummaryMatchesTable()
+        renewals = list(BookInstance.objects.filter(status='в').values_list('pk', flat=True)[:20])
+        bulk_update_loans(renewals, due_back=datetime.date.today() - datetime.timedelta(days=30))
+        self.assertSummaryMatchesTable()
+
+    # Массовая загрузка передаёт id всех книг: сводка пересчитывается порциями, а не одним IN (...)
+    def test_bulk_load_larger_than_one_chunk(self):
+        books = Book.objects.bulk_create([Book(title='Книга {0}'.format(number), summary='-', isbn=str(number))
+                                          for number in range(5)])
+        BookInstance.objects.bulk_create([BookInstance(book=book, imprint='-', status='д') for book in books])
+        book_ids = [book.pk for book in books]
+        with mock.patch.object(availability, 'INDEX_CHUNK_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            signals.catalog_bulk_loaded.send(sender=Book, book_ids=book_ids)
+        updates = [query for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "catalog_book"') and 'copies_available' in query['sql']]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(set(Book.objects.values_list('copies_available', flat=True)), {1})
+        # Пересчёт всего каталога (rebuild_counters) тоже идёт порциями по id книг
+        Book.objects.update(copies_available=0)
+        with mock.patch.object(availability, 'INDEX_CHUNK_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(availability.rebuild(), len(book_ids))
+        updates = [query for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "catalog_book"') and 'copies_available' in query['sql']]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(set(Book.objects.values_list('copies_available', flat=True)), {1})
+        # Больше, чем допускает число параметров одного запроса SQLite
+        self.assertEqual(availability.rebuild(range(1, 300001)), len(book_ids))
+
+    def test_book_list_shows_availability_without_copy_queries(self):
+        seed_catalog(authors=10, books=30, copies=300)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book'))
+        self.assertEqual(response.status_code, 200)
+        table = BookInstance._meta.db_table
+        self.assertFalse(any(table in query['sql'] for query in queries.captured_queries))
+        book = response.context['book_list'][0]
+        self.assertEqual(book.copies_total, BookInstance.objects.filter(book=book).count())
+        if book.copies_available:
+            self.assertContains(response, 'доступно {0} из {1}'.format(book.copies_available, book.copies_total))
+
+
+class CirculationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = benchmark_users()
+        cls.readers = [User.objects.create(username='reader{0}'.format(number)) for number in range(3)]
+        cls.book = Book.objects.create(title='Обломов', summary='-', isbn='1')
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='-', status='д')
+
+    def test_checkout_and_return(self):
+        copy = circulation.checkout(self.book.pk, self.readers[0])
+        self.assertEqual((copy.pk, copy.status, copy.borrower), (self.copy.pk, 'в', self.readers[0]))
+        self.assertEqual(copy.due_back, datetime.date.today() + circulation.LOAN_PERIOD)
+        with self.assertRaisesMessage(circulation.CirculationError, 'Нет доступных экземпляров'):
+            circulation.checkout(self.book.pk, self.readers[1])
+        self.assertIsNone(circulation.return_copy(copy.pk))
+        self.copy.refresh_from_db()
+        self.assertEqual((self.copy.status, self.copy.borrower, self.copy.due_back), ('д', None, None))
+        with self.assertRaisesMessage(circulation.CirculationError, 'Экземпляр не выдан'):
+            circulation.return_copy(copy.pk)
+        with self.assertRaisesMessage(circulation.CirculationError, 'Книга не найдена'):
+            circulation.checkout(0, self.readers[0])
+
+    # Возвращённый экземпляр резервируется для заявок по очереди; отмена заявки передаёт его следующей
+    def test_hold_queue_is_fifo(self):
+        circulation.checkout(self.book.pk, self.users['reader'])
+        holds = [circulation.place_hold(self.book.pk, reader) for reader in self.readers]
+        self.assertEqual([circulation.queue_position(hold) for hold in holds], [1, 2, 3])
+        self.assertEqual(circulation.place_hold(self.book.pk, self.readers[0]), holds[0])
+
+        promoted = circulation.return_copy(self.copy.pk)
+        self.assertEqual((promoted, promoted.copy_id), (holds[0], self.copy.pk))
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.status, 'з')
+        # Зарезервированный экземпляр не выдаётся другому читателю
+        with self.assertRaises(circulation.CirculationError):
+            circulation.checkout(self.book.pk, self.readers[2])
+
+        circulation.cancel_hold(holds[0].pk)
+        self.assertEqual(Hold.objects.get(pk=holds[1].pk).copy_id, self.copy.pk)
+        self.assertEqual(circulation.queue_position(Hold.objects.get(pk=holds[2].pk)), 1)
+        copy = circulation.checkout(self.book.pk, self.readers[1])
+        self.assertEqual((copy.pk, copy.status), (self.copy.pk, 'в'))
+        self.assertEqual(list(Hold.objects.values_list('user', flat=True)), [self.readers[2].pk])
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.copies_on_loan, self.book.copies_reserved), (1, 0))
+
+    # Общие строки (счётчики, сводка доступности, версия экземпляров) изменяются после фиксации транзакции
+    # выдачи, а при её отмене не изменяются
+    def test_shared_rows_are_written_after_commit(self):
+        depth = len(connection.savepoint_ids)
+        calls = []
+        with mock.patch.object(availability, 'status_changed',
+                               side_effect=lambda *args: calls.append(len(connection.savepoint_ids) - depth)):
+            with transaction.atomic():
+                circulation.checkout(self.book.pk, self.readers[0])
+            circulation.return_copy(self.copy.pk)
+        # Внутри внешней транзакции запись выполняется в ней, но уже после блока выдачи
+        self.assertEqual(calls, [1, 0])
+
+        available = counters.get_counts()[counters.INSTANCES_AVAILABLE]
+        with self.assertRaises(RuntimeError):
+            with signals.deferred_writes(), transaction.atomic():
+                circulation.checkout(self.book.pk, self.readers[0])
+                raise RuntimeError
+        self.assertEqual(counters.get_counts()[counters.INSTANCES_AVAILABLE], available)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.copies_available, self.book.copies_on_loan), (1, 0))
+
+    # Массовый возврат и возврат через форму админ-панели резервируют экземпляр для очереди заявок,
+    # и читатель без заявки не получает его в обход очереди
+    def test_returns_outside_return_copy_serve_holds(self):
+        circulation.checkout(self.book.pk, self.readers[0])
+        hold = circulation.place_hold(self.book.pk, self.readers[1])
+        self.assertEqual(bulk_update_loans([str(self.copy.pk)], status='д'), ([str(self.copy.pk)], {}))
+        hold.refresh_from_db()
+        self.copy.refresh_from_db()
+        self.assertEqual((hold.copy_id, self.copy.status), (self.copy.pk, 'з'))
+        with self.assertRaisesMessage(circulation.CirculationError, 'Нет доступных экземпляров'):
+            circulation.checkout(self.book.pk, self.readers[2])
+
+        # Очередь не пропускается, даже если доступный экземпляр появился без резервирования
+        circulation.cancel_hold(hold.pk)
+        hold = Hold.objects.create(book=self.book, user=self.readers[1])
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'д')
+        with self.assertRaisesMessage(circulation.CirculationError, 'Книгу ждут читатели из очереди заявок'):
+            circulation.checkout(self.book.pk, self.readers[2])
+
+        circulation.checkout(self.book.pk, self.readers[1])
+        hold = circulation.place_hold(self.book.pk, self.readers[2])
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        response = self.client.post(reverse('admin:catalog_bookinstance_change', args=[copy.pk]), {
+            'book': self.book.pk, 'imprint': copy.imprint, 'id': copy.pk, 'loaded_version': copy.version,
+            'status': 'д', 'due_back': '', 'borrower': ''})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Hold.objects.get(pk=hold.pk).copy_id, self.copy.pk)
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'з')
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.copies_available, self.book.copies_reserved), (0, 1))
+
+    # Заявка на книгу с доступным экземпляром сразу его резервирует
+    def test_hold_reserves_available_copy(self):
+        hold = circulation.place_hold(self.book.pk, self.readers[0])
+        self.assertEqual((hold.copy_id, circulation.queue_position(hold)), (self.copy.pk, 0))
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.copies_available, self.book.copies_reserved), (0, 1))
+
+    def test_api(self):
+        self.client.force_login(self.users['librarian'])
+
+        def post(action, data):
+            return self.client.post(reverse('api-circulation', args=[action]), json.dumps(data),
+                                    content_type='application/json')
+
+        response = post('checkout', {'book': self.book.pk, 'user': self.readers[0].pk})
+        self.assertEqual((response.status_code, response.json()['copy']), (200, str(self.copy.pk)))
+        self.assertEqual(post('checkout', {'book': self.book.pk, 'user': self.readers[1].pk}).status_code, 409)
+        response = post('hold', {'book': self.book.pk, 'user': self.readers[1].pk})
+        self.assertEqual(response.json()['position'], 1)
+        response = post('return', {'copy': str(self.copy.pk)})
+        self.assertEqual(response.json()['hold']['copy'], str(self.copy.pk))
+        self.assertEqual(post('return', {'copy': 'x'}).status_code, 400)
+        self.assertEqual(post('renew', {}).status_code, 404)
+        self.client.force_login(self.users['reader'])
+        self.assertEqual(post('hold', {'book': self.book.pk, 'user': self.readers[2].pk}).status_code, 403)
+
+
+# Одновременная выдача из нескольких потоков (у каждого потока своё соединение с БД).
+# В SQLite блокировок строк нет - тест выполняется только там, где есть SELECT ... FOR UPDATE SKIP LOCKED.
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+class CirculationContentionTest(TransactionTestCase):
+
+    def run_threads(self, count, target):
+        barrier = threading.Barrier(count)
+        results = [None] * count
+
+        def worker(number):
+            try:
+                barrier.wait()
+                results[number] = target(number)
+            except circulation.CirculationError as error:
+                results[number] = error
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=[number]) for number in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_checkouts_never_share_a_copy(self):
+        book = Book.objects.create(title='Мёртвые души', summary='-', isbn='1')
+        copies = [BookInstance.objects.create(book=book, imprint='-', status='д') for _ in range(5)]
+        readers = [User.objects.create(username='reader{0}'.format(number)) for number in range(12)]
+
+        results = self.run_threads(len(readers), lambda number: circulation.checkout(book.pk, readers[number]))
+        loans = [result.pk for result in results if isinstance(result, BookInstance)]
+        self.assertEqual(sorted(loans), sorted(copy.pk for copy in copies))
+        self.assertEqual(sum(isinstance(result, circulation.CirculationError) for result in results), 7)
+        self.assertEqual(BookInstance.objects.filter(status='в').values('borrower').distinct().count(), 5)
+        book.refresh_from_db()
+        self.assertEqual((book.copies_available, book.copies_on_loan), (0, 5))
+
+        # Одновременные возвраты резервируют экземпляры для разных заявок
+        holds = [circulation.place_hold(book.pk, reader) for reader in readers[5:9]]
+        self.run_threads(len(loans), lambda number: circulation.return_copy(loans[number]))
+        reserved = Hold.objects.filter(pk__in=[hold.pk for hold in holds]).values_list('copy', flat=True)
+        self.assertEqual(len(set(reserved)), 4)
+        self.assertEqual(BookInstance.objects.filter(status='з').count(), 4)
+        self.assertEqual(BookInstance.objects.filter(status='д').count(), 1)
+
+    # Возврат не видит заявку, которая создаётся одновременно, а заявка - возвращаемый экземпляр:
+    # после фиксации обеих транзакций экземпляр всё равно резервируется для заявки
+    def test_return_during_hold_reserves_copy(self):
+        book = Book.objects.create(title='Нос', summary='-', isbn='1')
+        copy = BookInstance.objects.create(book=book, imprint='-', status='в')
+        reader = User.objects.create(username='reader')
+        paused, resume = threading.Event(), threading.Event()
+        lock_next_hold = circulation.lock_next_hold
+
+        # Первый поиск заявки (в транзакции возврата) ждёт, пока заявка не будет создана
+        def wait_for_hold(book_id):
+            hold = lock_next_hold(book_id)
+            if not paused.is_set():
+                paused.set()
+                resume.wait(10)
+            return hold
+
+        with mock.patch.object(circulation, 'lock_next_hold', side_effect=wait_for_hold):
+            thread = threading.Thread(target=lambda: (circulation.return_copy(copy.pk), connection.close()))
+            thread.start()
+            self.assertTrue(paused.wait(10))
+            hold = circulation.place_hold(book.pk, reader)
+            self.assertIsNone(hold.copy_id)
+            resume.set()
+            thread.join()
+
+        hold.refresh_from_db()
+        copy.refresh_from_db()
+        self.assertEqual((hold.copy_id, copy.status), (copy.pk, 'з'))
+        book.refresh_from_db()
+        self.assertEqual((book.copies_available, book.copies_reserved), (0, 1))
+
+    def test_benchmark_command_reports_no_conflicts(self):
+        out = StringIO()
+        call_command('benchmark_circulation', threads='1,4', duration=0.5, copies=4, stdout=out)
+        rows = [line.split() for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual([row[0] for row in rows], ['1', '4'])
+        self.assertTrue(all(float(row[1]) > 0 and row[-1] == '0' for row in rows), out.getvalue())
+        self.assertFalse(Book.objects.exists())
+
+
+class OptimisticLockingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = benchmark_users()
+        cls.book = Book.objects.create(title='Ревизор', summary='-', isbn='1')
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='-', status='в', borrower=cls.users['reader'],
+                                               due_back=datetime.date.today())
+
+    def update_sql(self, queries, model=BookInstance):
+        table = model._meta.db_table
+        return [query['sql'] for query in queries.captured_queries
+                if query['sql'].startswith('UPDATE "{0}"'.format(table))]
+
+    def test_stale_save_raises_instead_of_lost_update(self):
+        first = BookInstance.objects.get(pk=self.copy.pk)
+        second = BookInstance.objects.get(pk=self.copy.pk)
+        first.due_back = datetime.date.today() + datetime.timedelta(weeks=1)
+        first.save()
+        self.assertEqual(first.version, 1)
+        second.status = 'д'
+        with self.assertRaises(ConcurrentUpdateError), transaction.atomic():
+            second.save()
+        self.assertEqual(BookInstance.objects.values_list('status', 'due_back', 'version').get(pk=self.copy.pk),
+                         ('в', first.due_back, 1))
+        # После перезагрузки изменение проходит
+        second.refresh_from_db()
+        second.status = 'д'
+        second.save()
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).version, 2)
+
+    def test_save_writes_only_changed_columns(self):
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        copy.imprint = 'Новый импринт'
+        with CaptureQueriesContext(connection) as queries:
+            copy.save()
+        sql, = self.update_sql(queries)
+        self.assertIn('"imprint"', sql)
+        self.assertIn('"version"', sql)
+        self.assertNotIn('"due_back"', sql.split(' WHERE ')[0])
+        self.assertNotIn('"status"', sql.split(' WHERE ')[0])
+        # Повторное сохранение без изменений увеличивает только версию
+        with CaptureQueriesContext(connection) as queries:
+            copy.save()
+        sql, = self.update_sql(queries)
+        self.assertEqual(sql.split(' SET ')[1].split(' WHERE ')[0].count('='), 1)
+        self.assertEqual(copy.version, 2)
+
+        # Изменение описания книги не записывает сводку доступности и поисковый вектор
+        book = Book.objects.get(pk=self.book.pk)
+        book.summary = 'Комедия'
+        with CaptureQueriesContext(connection) as queries:
+            book.save()
+        self.assertNotIn('copies_on_loan', self.update_sql(queries, Book)[0].split(' WHERE ')[0])
+
+    def test_bulk_update_bumps_version(self):
+        bulk_update_loans([self.copy.pk], due_back=datetime.date.today() + datetime.timedelta(weeks=1))
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).version, 1)
+        with self.assertRaises(ConcurrentUpdateError), transaction.atomic():
+            self.copy.save(update_fields=['imprint'])
+
+    def test_renew_view_rejects_stale_form(self):
+        self.client.force_login(self.users['librarian'])
+        url = reverse('renew-book-librarian', args=[self.copy.pk])
+        self.assertEqual(self.client.get(url).context['form']['loaded_version'].value(), 0)
+        due_back = datetime.date.today() + datetime.timedelta(weeks=2)
+        bulk_update_loans([self.copy.pk], due_back=datetime.date.today() + datetime.timedelta(weeks=1))
+
+        response = self.client.post(url, {'due_back': due_back.isoformat(), 'loaded_version': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'изменена другим пользователем')
+        self.assertNotEqual(BookInstance.objects.get(pk=self.copy.pk).due_back, due_back)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'due_back': due_back.isoformat(), 'loaded_version': 1})
+        self.assertEqual(response.status_code, 302)
+        sql, = self.update_sql(queries)
+        self.assertEqual(sql.split(' SET ')[1].split(' WHERE ')[0].count('='), 2)
+        self.assertEqual(BookInstance.objects.values_list('due_back', 'version').get(pk=self.copy.pk), (due_back, 2))
+
+    def test_book_update_view_rejects_stale_form(self):
+        self.client.force_login(self.users['librarian'])
+        url = reverse('book-update', args=[self.book.pk])
+        data = {'title': 'Ревизор', 'summary': 'Комедия', 'isbn': '1', 'loaded_version': 0,
+                'author': Author.objects.create(first_name='Николай', last_name='Гоголь').pk,
+                'language': Language.objects.create(name='Русский').pk,
+                'genre': [Genre.objects.create(name='Пьеса').pk]}
+        Book.objects.get(pk=self.book.pk).save()
+        response = self.client.post(url, data)
+        self.assertContains(response, 'изменена другим пользователем')
+        response = self.client.post(url, dict(data, loaded_version=1))
+        self.assertEqual(response.status_code, 302, response.context and response.context['form'].errors)
+        self.assertEqual(Book.objects.values_list('summary', 'version').get(pk=self.book.pk), ('Комедия', 2))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_renewal', renewals=20, copies=5, stdout=out)
+        rows = {line.split()[0]: line.split() for line in out.getvalue().splitlines()[1:]}
+        self.assertEqual(list(rows), ['save', 'select_for_update', 'update_fields', 'f_update'])
+        # Меньше байт в запросе UPDATE: записывается только дата возврата и версия
+        self.assertLess(float(rows['update_fields'][2]), float(rows['save'][2]))
+        self.assertFalse(Book.objects.filter(title__startswith='Нагрузочный тест').exists())
+
+
+
+class CopyIdTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = benchmark_users()
+        cls.book = Book.objects.create(title='Ревизор', summary='-', isbn='1')
+
+    def test_uuid7_layout_and_order(self):
+        before = time.time_ns() // 1000000
+        keys = [uuid7() for _ in range(5000)]
+        after = time.time_ns() // 1000000
+        self.assertTrue(all(key.version == 7 and key.variant == uuid.RFC_4122 for key in keys))
+        # Ключи строго возрастают и в виде строки (как их сортирует индекс), и в пределах одной миллисекунды
+        self.assertEqual([str(key) for key in keys], sorted({str(key) for key in keys}))
+        self.assertTrue(before <= uuid7_timestamp_ms(keys[0]) <= uuid7_timestamp_ms(keys[-1]) <= after + 1)
+        self.assertIsNone(uuid7_timestamp_ms(uuid.uuid4()))
+
+    def test_setting_selects_key_version(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='-', status='д')
+        self.assertEqual(copy.pk.version, 4)
+        with override_settings(CATALOG_UUID7=True):
+            first = BookInstance.objects.create(book=self.book, imprint='-', status='д')
+            second = BookInstance.objects.create(book=self.book, imprint='-', status='д')
+        self.assertEqual((first.pk.version, second.pk.version), (7, 7))
+        self.assertLess(str(first.pk), str(second.pk))
+        # Ключи v4 и v7 хранятся в одном столбце и находятся одинаково
+        self.assertEqual(set(BookInstance.objects.filter(pk__in=[str(copy.pk), str(first.pk)])), {copy, first})
+
+    @override_settings(CATALOG_UUID7=True)
+    def test_renew_url_accepts_uuid7(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='-', status='в', borrower=self.users['reader'],
+                                           due_back=datetime.date.today())
+        url = reverse('renew-book-librarian', args=[copy.pk])
+        self.assertIn(str(copy.pk), url)
+        self.client.force_login(self.users['librarian'])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        due_back = datetime.date.today() + datetime.timedelta(weeks=2)
+        response = self.client.post(url, {'due_back': due_back.isoformat(), 'loaded_version': 0})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(BookInstance.objects.get(pk=copy.pk).due_back, due_back)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_uuid', rows=200, batch=50, lookups=20, stdout=out)
+        rows = [line.split()[0] for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual(rows, ['uuid4', 'uuid7'])
+        self.assertFalse(Book.objects.filter(title__startswith='Нагрузочный тест').exists())
+        self.assertEqual(BookInstance.objects.count(), 0)
+
+class ImportCatalogTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, text, encoding='utf-8'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding=encoding, newline='') as file:
+            file.write(text)
+        return path
+
+    # Сигнал catalog_bulk_loaded отправляется после фиксации пачки
+    def import_file(self, path, **options):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_catalog', path, stdout=StringIO(), **options)
+
+    def test_dumpdata_file_in_utf16(self):
+        path = os.path.join(settings.BASE_DIR, 'DB', 'db.json')
+        checkpoint = os.path.join(self.directory, 'db.json.checkpoint')
+        self.import_file(path, batch_size=5, recode='cp866:cp1251', checkpoint=checkpoint)
+        self.assertEqual((Book.objects.count(), BookInstance.objects.count(), Author.objects.count()), (14, 16, 6))
+        self.assertEqual(Book.objects.get(pk=1).genre.count(), 2)
+        self.assertTrue(Author.objects.filter(last_name='Толкин').exists())
+        self.assertEqual(BookInstance.objects.filter(status='в').count(), 12)
+        # Повторный импорт ничего не дублирует
+        self.import_file(path, recode='cp866:cp1251', checkpoint=checkpoint)
+        self.assertEqual((Book.objects.count(), BookInstance.objects.count(), Author.objects.count()), (14, 16, 6))
+        self.assertEqual(counters.get_counts()[counters.INSTANCES], 16)
+
+    def test_csv_rows_of_one_book_and_existing_references(self):
+        author = Author.objects.create(last_name='Толстой', first_name='Лев')
+        path = self.write('catalog.csv', (
+            'title,author_last_name,author_first_name,isbn,summary,language,genre,copy_id,imprint,status,due_back\r\n'
+            'Война и мир,Толстой,Лев,1,Эпопея,Русский,Роман;Классика,,АСТ,д,\r\n'
+            'Война и мир,Толстой,Лев,1,Эпопея,Русский,Роман;Классика,,Эксмо,в,2030-01-01\r\n'
+            'Анна Каренина,Толстой,Лев,2,Роман,Русский,Роман,,,,\r\n'), encoding='cp1251')
+        self.import_file(path, batch_size=1)
+        book = Book.objects.get(title='Война и мир')
+        self.assertEqual(book.author, author)
+        self.assertEqual(sorted(book.bookinstance_set.values_list('imprint', 'status')), [('АСТ', 'д'), ('Эксмо', 'в')])
+        self.assertEqual(sorted(book.genre.values_list('name', flat=True)), ['Классика', 'Роман'])
+        self.assertEqual(Book.objects.get(title='Анна Каренина').bookinstance_set.count(), 0)
+        self.assertEqual(Author.objects.count(), 1)
+        self.assertEqual([book.title for book in search_books('эпопея')], ['Война и мир'])
+
+    def test_json_array_and_resume_after_failure(self):
+        records = [{'title': 'Книга {0}'.format(number), 'author': 'Пушкин, Александр', 'language': 'Русский',
+                    'copies': [{'imprint': '-', 'status': 'в', 'due_back': '2030-01-01'}]} for number in range(5)]
+        records[3]['copies'][0]['due_back'] = '2030-13-01'
+        path = self.write('catalog.json', json.dumps(records, ensure_ascii=False, indent=1))
+        with self.assertRaisesMessage(CommandError, 'Запись 4'):
+            self.import_file(path, batch_size=2)
+        self.assertEqual(Book.objects.count(), 2)
+        self.assertEqual(ImportCheckpoint.objects.get(name=path).records, 2)
+
+        # Исправленный файл того же размера - импорт продолжается с третьей записи
+        with open(path, encoding='utf-8') as file:
+            text = file.read().replace('2030-13-01', '2030-12-01')
+        self.write('catalog.json', text)
+        self.import_file(path, batch_size=2)
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)),
+                         ['Книга {0}'.format(number) for number in range(5)])
+        self.assertEqual(BookInstance.objects.count(), 5)
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    # Сбой сразу после фиксации пачки: контрольная точка записана в той же транзакции,
+    # повторный запуск не записывает пачку ещё раз
+    def test_failure_after_batch_commit_does_not_duplicate_rows(self):
+        records = [{'title': 'Книга {0}'.format(number), 'copies': [{'imprint': '-'}]} for number in range(5)]
+        path = self.write('catalog.jsonl', '\n'.join(json.dumps(record, ensure_ascii=False) for record in records))
+
+        def crash(message):
+            raise RuntimeError('сбой после фиксации')
+
+        with self.assertRaisesMessage(RuntimeError, 'сбой после фиксации'):
+            CatalogImporter(batch_size=2, log=crash).run(path, checkpoint=path)
+        self.assertEqual((Book.objects.count(), ImportCheckpoint.objects.get(name=path).records), (2, 2))
+
+        self.import_file(path, batch_size=2)
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)),
+                         ['Книга {0}'.format(number) for number in range(5)])
+        self.assertEqual(BookInstance.objects.count(), 5)
+
+    # Счётчики каталога пересчитываются по таблицам один раз за импорт, а не после каждой пачки
+    def test_counters_rebuilt_once_per_import(self):
+        records = [{'title': 'Книга {0}'.format(number), 'copies': [{'imprint': '-'}]} for number in range(5)]
+        path = self.write('catalog.jsonl', '\n'.join(json.dumps(record, ensure_ascii=False) for record in records))
+        with mock.patch.object(counters, 'rebuild', wraps=counters.rebuild) as rebuild:
+            self.import_file(path, batch_size=2)
+        self.assertEqual(rebuild.call_count, 1)
+        self.assertEqual(counters.get_counts()[counters.BOOKS], 5)
+
+    # Книги, записанные до сбоя, и книга, продолженная после возобновления, получают сводку доступности
+    # и попадают в поисковый индекс
+    def test_resume_updates_books_written_before_failure(self):
+        path = self.write('catalog.csv', (
+            'title,author_last_name,author_first_name,copy_id,imprint,status,due_back\r\n'
+            'Руслан и Людмила,Пушкин,Александр,,АСТ,в,2030-02-01\r\n'
+            'Евгений Онегин,Пушкин,Александр,,АСТ,в,2030-03-01\r\n'
+            'Евгений Онегин,Пушкин,Александр,,Эксмо,в,2030-13-01\r\n'))
+        with self.assertRaisesMessage(CommandError, 'Запись 3'):
+            self.import_file(path, batch_size=1)
+        self.assertEqual(Book.objects.get(title='Руслан и Людмила').copies_on_loan, 1)
+        self.assertEqual([book.title for book in search_books('Людмила')], ['Руслан и Людмила'])
+
+        # Файл читается без преобразования \r\n: размер исправленного файла не меняется
+        with open(path, encoding='utf-8', newline='') as file:
+            text = file.read().replace('2030-13-01', '2030-01-01')
+        self.write('catalog.csv', text)
+        self.import_file(path, batch_size=1)
+        book = Book.objects.get(title='Евгений Онегин')
+        self.assertEqual((book.copies_on_loan, book.next_due_back), (2, datetime.date(2030, 1, 1)))
+        self.assertEqual([book.title for book in search_books('Онегин')], ['Евгений Онегин'])
+
+
+class ExportCatalogTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = benchmark_users()
+        seed_catalog(authors=10, books=30, copies=120, borrowers=[cls.users['reader']], loans_per_user=10)
+
+    def test_export_streams_every_row(self):
+        self.client.force_login(self.users['librarian'])
+        response = self.client.get(reverse('export', args=['copies', 'csv']))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="copies.csv"')
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 120)
+        self.assertEqual({row['copy_id'] for row in rows}, {str(pk) for pk in BookInstance.objects.values_list('pk', flat=True)})
+
+        response = self.client.get(reverse('export', args=['loans', 'jsonl']))
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(records), BookInstance.objects.filter(status='в').count())
+        self.assertEqual(sum(record['borrower'] == 'benchmark_reader' for record in records), 10)
+        self.assertEqual([record['due_back'] for record in records], sorted(record['due_back'] for record in records))
+
+        self.assertEqual(self.client.get(reverse('export', args=['users', 'csv'])).status_code, 404)
+        self.client.force_login(self.users['reader'])
+        self.assertEqual(self.client.get(reverse('export', args=['copies', 'csv'])).status_code, 403)
+
+    # Выгрузка экземпляров загружается обратно командой import_catalog
+    def test_copies_export_can_be_imported(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'copies.csv')
+            call_command('export_catalog', 'copies', output=path, chunk_size=7, stdout=StringIO())
+            copies = BookInstance.objects.count()
+            BookInstance.objects.all().delete()
+            Book.objects.all().delete()
+            call_command('import_catalog', path, stdout=StringIO())
+        self.assertEqual(BookInstance.objects.count(), copies)
+        self.assertEqual(Book.objects.count(), Book.objects.filter(bookinstance__isnull=False).distinct().count())
+
+
+class CatalogApiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(authors=10, books=30, copies=120)
+
+    def get_json(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        return response.json()
+
+    # Все книги по страницам, без повторов; число запросов на страницу не зависит от размера страницы
+    def test_book_list_pages(self):
+        ids, url, params = [], reverse('api-books'), {'limit': 7}
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.get_json(url, **params)
+            self.assertLessEqual(len(queries), 3)
+            ids.extend(book['id'] for book in data['results'])
+            url, params = data['next'], {}
+        self.assertEqual(ids, sorted(Book.objects.values_list('pk', flat=True)))
+
+        book = Book.objects.exclude(author=None).first()
+        data = self.get_json(reverse('api-books'), limit=200)
+        record = next(item for item in data['results'] if item['id'] == book.pk)
+        self.assertEqual(record['author']['last_name'], book.author.last_name)
+        self.assertEqual(record['genres'], sorted(book.genre.values_list('name', flat=True)))
+
+    def test_book_detail_and_copies(self):
+        book = Book.objects.filter(bookinstance__isnull=False).first()
+        data = self.get_json(reverse('api-book-detail', args=[book.pk]))
+        self.assertEqual(data['copies']['total'], book.bookinstance_set.count())
+        self.assertEqual(data['copies']['available'], book.bookinstance_set.filter(status='д').count())
+
+        copies = self.get_json(data['copies_url'])['results']
+        self.assertEqual({copy['id'] for copy in copies},
+                         {str(pk) for pk in book.bookinstance_set.values_list('pk', flat=True)})
+        self.assertEqual(sum(copy['available'] for copy in copies), data['copies']['available'])
+        self.assertEqual(self.client.get(reverse('api-book-detail', args=[0])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('api-book-copies', args=[0])).status_code, 404)
+
+    def test_author_list_sorted_by_name(self):
+        authors = self.get_json(reverse('api-authors'), limit=200)['results']
+        self.assertEqual([author['id'] for author in authors],
+                         list(Author.objects.order_by('last_name', 'first_name', 'pk').values_list('pk', flat=True)))
+        author = Author.objects.filter(book__isnull=False).first()
+        data = self.get_json(reverse('api-author-detail', args=[author.pk]))
+        self.assertEqual(len(data['books']), author.book_set.count())
+        self.assertEqual(len(self.get_json(reverse('api-genres'))['results']), Genre.objects.count())
+        self.assertEqual(len(self.get_json(reverse('api-languages'))['results']), Language.objects.count())
+
+    # Повторный запрос с If-None-Match или If-Modified-Since получает 304 без тела
+    def test_conditional_get(self):
+        url = reverse('api-books')
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        cached = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        # Другие параметры запроса - другой ETag
+        self.assertNotEqual(self.client.get(url, {'limit': 5})['ETag'], response['ETag'])
+
+    # Изменение любой модели, от которой зависит ответ, меняет его ETag
+    def test_etag_changes_with_data(self):
+        book = Book.objects.filter(bookinstance__isnull=False).exclude(author=None).first()
+        detail_url = reverse('api-book-detail', args=[book.pk])
+        genres_url = reverse('api-genres')
+
+        def etags():
+            return self.client.get(detail_url)['ETag'], self.client.get(genres_url)['ETag']
+
+        detail, genres = etags()
+        copy = book.bookinstance_set.first()
+        copy.imprint = 'Новое издание'
+        copy.save()
+        new_detail, new_genres = etags()
+        self.assertNotEqual(new_detail, detail)
+        self.assertEqual(new_genres, genres)
+        self.assertEqual(self.client.get(detail_url, HTTP_IF_NONE_MATCH=detail).status_code, 200)
+
+        book.author.last_name = 'Новая фамилия'
+        book.author.save()
+        self.assertNotEqual(etags()[0], new_detail)
+
+        detail, _ = etags()
+        # Массовое изменение через QuerySet.update (сигнал book_instances_updated)
+        updated, _ = bulk_update_loans([copy.pk], status='т' if copy.status == 'д' else 'д')
+        self.assertEqual(updated, [copy.pk])
+        self.assertNotEqual(etags()[0], detail)
+
+        detail, genres = etags()
+        book.genre.add(Genre.objects.create(name='Новый жанр'))
+        new_detail, new_genres = etags()
+        self.assertNotEqual(new_detail, detail)
+        self.assertNotEqual(new_genres, genres)
+
+
+# Асинхронные страницы отдают то же, что синхронные; шаблоны отрисовываются в цикле событий
+# без обращений к БД (иначе - исключение SynchronousOnlyOperation)
+class CatalogAsyncViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = benchmark_users()
+        seed_catalog(authors=10, books=30, copies=120, borrowers=[cls.users['reader']], loans_per_user=10)
+        cls.book = Book.objects.filter(bookinstance__isnull=False).order_by('pk').first()
+
+    def setUp(self):
+        self.async_client = AsyncClient()
+        self.async_client.force_login(self.users['librarian'])
+        self.client.force_login(self.users['librarian'])
+
+    async def test_async_pages_match_sync_pages(self):
+        pages = [
+            ('index', 'async-index', []),
+            ('book', 'async-book', []),
+            ('book-detail', 'async-book-detail', [self.book.pk]),
+            ('authors', 'async-authors', []),
+            ('author-detail', 'async-author-detail', [self.book.author_id]),
+            ('all-borrowed', 'async-all-borrowed', []),
+            ('all-books', 'async-all-books', []),
+        ]
+        # Страница ?page=N - обычный постраничный вывод Django (срез QuerySet выполняется до отрисовки)
+        for params in ({}, {'page': 1}):
+            for sync_name, async_name, args in pages:
+                expected = await sync_to_async(self.client.get)(reverse(sync_name, args=args), params)
+                response = await self.async_client.get(reverse(async_name, args=args), params)
+                self.assertEqual(response.status_code, 200, async_name)
+                # Ссылки пагинации ведут на текущий адрес
+                self.assertEqual(response.content.replace(b'/async', b''), expected.content, async_name)
+
+        response = await self.async_client.get(reverse('async-book'), {'cursor': 'bad'})
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse('async-book-detail', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    # Асинхронные страницы книги и автора берутся из того же кэша страниц, что и синхронные
+    async def test_async_pages_use_page_cache(self):
+        await sync_to_async(cache.clear)()
+        for name, args in (('async-book-detail', [self.book.pk]), ('async-author-detail', [self.book.author_id])):
+            url = reverse(name, args=args)
+            first = await self.async_client.get(url)
+            self.assertEqual((await self.async_client.get(url)).content, first.content)
+        stats = await sync_to_async(caching.stats)()
+        for name in ('book-detail', 'author-detail'):
+            self.assertEqual(stats[name], {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+        # Изменение книги сбрасывает и асинхронную страницу
+        self.book.title = 'Новое название'
+        await sync_to_async(self.book.save)()
+        response = await self.async_client.get(reverse('async-book-detail', args=[self.book.pk]))
+        self.assertContains(response, 'Новое название')
+        stats = await sync_to_async(caching.stats)()
+        self.assertEqual(stats['book-detail']['misses'], 2)
+
+    async def test_async_loan_lists_check_access(self):
+        response = await AsyncClient().get(reverse('async-my-borrowed'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('login'), response['Location'])
+
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.users['reader'])
+        response = await client.get(reverse('async-my-borrowed'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['bookinstance_list']), 10)
+        self.assertEqual((await client.get(reverse('async-all-borrowed'))).status_code, 403)
+
+
+class CatalogPageCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(authors=10, books=30, copies=120)
+        books = Book.objects.filter(bookinstance__isnull=False).exclude(author=None).distinct().order_by('pk')
+        cls.book = books[0]
+        cls.other = books.exclude(author=cls.book.author)[0]
+
+    def setUp(self):
+        cache.clear()
+
+    # Запросы к таблицам каталога (без сессии и пользователя)
+    def catalog_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return sum('catalog_' in query['sql'] for query in queries.captured_queries)
+
+    def assertCached(self, url, cached=True):
+        self.assertEqual(self.catalog_queries(url) == 0, cached, url)
+
+    def test_page_is_cached_until_its_data_changes(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        first = self.client.get(url)
+        self.assertCached(url)
+        self.assertEqual(self.client.get(url).content, first.content)
+
+        book = Book.objects.get(pk=self.book.pk)
+        book.title = 'Новое название'
+        book.save()
+        self.assertContains(self.client.get(url), 'Новое название')
+        self.assertCached(url)
+
+        # Автор книги изменился - страница строится заново
+        self.book.author.first_name = 'Новое имя'
+        self.book.author.save()
+        self.assertContains(self.client.get(url), 'Новое имя')
+
+    # Изменение экземпляра сбрасывает только страницы его книги и её автора,
+    # а смена статуса - ещё и список книг, где показана доступность
+    def test_copy_change_invalidates_only_its_book(self):
+        urls = {
+            'book': reverse('book-detail', args=[self.book.pk]),
+            'author': reverse('author-detail', args=[self.book.author_id]),
+            'other book': reverse('book-detail', args=[self.other.pk]),
+            'other author': reverse('author-detail', args=[self.other.author_id]),
+            'list': reverse('book'),
+        }
+        for url in urls.values():
+            self.client.get(url)
+
+        copy = self.book.bookinstance_set.first()
+        copy.status = 'т' if copy.status == 'д' else 'д'
+        copy.save()
+        for name, url in urls.items():
+            self.assertCached(url, cached=name not in ('book', 'author', 'list'))
+        # Импринт в списке не показан
+        copy.imprint = 'Новый импринт'
+        copy.save()
+        self.assertCached(urls['book'], cached=False)
+        self.assertCached(urls['list'])
+
+        # Массовый возврат через QuerySet.update
+        copy = self.other.bookinstance_set.exclude(status='д').first() or self.other.bookinstance_set.first()
+        bulk_update_loans([copy.pk], status='д' if copy.status != 'д' else 'т')
+        self.assertCached(urls['book'])
+        self.assertCached(urls['other book'], cached=False)
+        self.assertCached(urls['other author'], cached=False)
+
+        # Жанры книги (новый жанр сбросил бы все страницы книг: в них выводятся названия жанров)
+        self.book.genre.add(Genre.objects.exclude(book=self.book).first())
+        self.assertCached(urls['book'], cached=False)
+        self.assertCached(urls['other book'])
+
+    # Страницы книги и автора зависят только от своего автора: изменение другого автора или его книг их не сбрасывает
+    def test_author_change_invalidates_only_its_pages(self):
+        urls = {
+            'book': reverse('book-detail', args=[self.book.pk]),
+            'author': reverse('author-detail', args=[self.book.author_id]),
+            'other book': reverse('book-detail', args=[self.other.pk]),
+            'other author': reverse('author-detail', args=[self.other.author_id]),
+        }
+        for url in urls.values():
+            self.client.get(url)
+
+        self.other.author.first_name = 'Новое имя'
+        self.other.author.save()
+        for name, url in urls.items():
+            self.assertCached(url, cached=name not in ('other book', 'other author'))
+        self.assertContains(self.client.get(urls['other book']), 'Новое имя')
+
+        other = Book.objects.get(pk=self.other.pk)
+        other.title = 'Новое название'
+        other.save()
+        for name, url in urls.items():
+            self.assertCached(url, cached=name not in ('other book', 'other author'))
+        self.assertContains(self.client.get(urls['other author']), 'Новое название')
+
+        # Книга перешла к другому автору: сбрасываются страницы обоих авторов (и книг, зависящих от их версий)
+        other.author = self.book.author
+        other.save()
+        for url in urls.values():
+            self.assertCached(url, cached=False)
+        self.assertContains(self.client.get(urls['author']), 'Новое название')
+        self.assertNotContains(self.client.get(urls['other author']), 'Новое название')
+
+        # Страница книги теперь зависит от её нового автора
+        self.book.author.first_name = 'Другое имя'
+        self.book.author.save()
+        self.assertContains(self.client.get(urls['other book']), 'Другое имя')
+
+    # Страница, построенная до фиксации транзакции (здесь - внутри неё), после фиксации не отдаётся
+    def test_page_built_before_commit_is_not_served(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                book = Book.objects.get(pk=self.book.pk)
+                book.title = 'Новое название'
+                book.save()
+                self.client.get(url)
+                self.assertCached(url)
+        self.assertCached(url, cached=False)
+        self.assertCached(url)
+
+    def test_users_get_separate_pages_and_stats(self):
+        users = benchmark_users()
+        url = reverse('book')
+        self.client.get(url)
+        self.client.force_login(users['librarian'])
+        response = self.client.get(url)
+        self.assertContains(response, 'benchmark_librarian')
+        self.assertContains(response, reverse('book-create'))
+        self.assertContains(self.client.get(reverse('index')), reverse('bulk-loans'))
+
+        stats = self.client.get(reverse('cache-stats')).json()
+        self.assertEqual(stats['book-list'], {'hits': 0, 'misses': 2, 'hit_ratio': 0.0})
+        self.client.get(url)
+        stats = self.client.get(reverse('cache-stats')).json()
+        self.assertEqual(stats['book-list']['hits'], 1)
+        self.assertEqual(stats['sidebar']['hits'], 0)
+        self.client.get(reverse('index'))
+        self.assertEqual(self.client.get(reverse('cache-stats')).json()['sidebar']['hits'], 1)
+
+        self.client.force_login(users['reader'])
+        self.assertEqual(self.client.get(reverse('cache-stats')).status_code, 403)
+
+    # Выдача и отзыв права сразу меняют ссылки для сотрудников в боковой панели и на кэшированной странице
+    def test_permission_change_is_not_served_from_cache(self):
+        user = User.objects.create_user('helper', password='password')
+        permission = Permission.objects.get(codename='can_mark_returned')
+        self.client.force_login(user)
+        for url in (reverse('index'), reverse('book')):
+            self.assertNotContains(self.client.get(url), reverse('bulk-loans'))
+        user.user_permissions.add(permission)
+        for url in (reverse('index'), reverse('book')):
+            self.assertContains(self.client.get(url), reverse('bulk-loans'))
+        user.user_permissions.remove(permission)
+        for url in (reverse('index'), reverse('book')):
+            self.assertNotContains(self.client.get(url), reverse('bulk-loans'))
+
+    @override_settings(CATALOG_CACHE_TIMEOUT=0)
+    def test_cache_can_be_disabled(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        self.client.get(url)
+        self.assertCached(url, cached=False)
+
+
+
+# Справочники жанров и языков в памяти: после первой загрузки таблицы жанров и языков не читаются
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class LookupCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = benchmark_users()
+        cls.genres = [Genre.objects.create(name=name) for name in ('Роман', 'Комедия', 'Поэма')]
+        cls.language = Language.objects.create(name='Русский')
+        cls.book = Book.objects.create(title='Ревизор', summary='-', isbn='1', language=cls.language,
+                                       author=Author.objects.create(first_name='Николай', last_name='Гоголь'))
+        cls.book.genre.set(cls.genres[:2])
+
+    def setUp(self):
+        cache.clear()
+        lookups.clear()
+
+    def lookup_queries(self, queries):
+        return [query['sql'] for query in queries.captured_queries
+                if '"catalog_genre"' in query['sql'] or '"catalog_language"' in query['sql']]
+
+    def test_form_choices_from_memory(self):
+        str(BookForm())
+        with CaptureQueriesContext(connection) as queries:
+            str(BookForm())
+        self.assertEqual(self.lookup_queries(queries), [])
+        # Для изменения книги читаются только её жанры (начальное значение поля)
+        with CaptureQueriesContext(connection) as queries:
+            html = str(BookForm(instance=self.book))
+        self.assertEqual(len(self.lookup_queries(queries)), 1)
+        self.assertInHTML('<option value="{0}" selected>Русский</option>'.format(self.language.pk), html)
+        self.assertInHTML('<option value="{0}" selected>Комедия</option>'.format(self.genres[1].pk), html)
+        # Невыбранные жанры выводит автодополнение (AutocompleteTest), но список выбора поля - из справочника
+        self.assertNotIn('Поэма', html)
+        self.assertIn((self.genres[2].pk, 'Поэма'), BookForm().fields['genre'].choices)
+        # Выбранные значения проверяются по БД
+        data = {'title': 'Ревизор', 'summary': '-', 'isbn': '1', 'genre': [self.genres[2].pk, 0],
+                'language': self.language.pk, 'loaded_version': self.book.version}
+        self.assertIn('genre', BookForm(data, instance=self.book).errors)
+
+    def test_changes_reset_lookup(self):
+        self.assertEqual(lookups.genre_choices()[0], (self.genres[1].pk, 'Комедия'))
+        genre = Genre.objects.create(name='Басня')
+        self.assertEqual(lookups.genre_choices()[0], (genre.pk, 'Басня'))
+        genre.delete()
+        self.assertNotIn(genre.pk, dict(lookups.genre_choices()))
+        # Изменение в другом процессе: справочник этого процесса устаревает по версии в общем кэше
+        self.assertEqual(lookups.language_name(self.language.pk), 'Русский')
+        Language.objects.filter(pk=self.language.pk).update(name='Русский язык')
+        self.assertEqual(lookups.language_name(self.language.pk), 'Русский')
+        caching.bump(caching.LANGUAGES)
+        self.assertEqual(lookups.language_name(self.language.pk), 'Русский язык')
+        # После фиксации транзакции версия увеличивается ещё раз
+        version = caching.get_versions([caching.GENRES])
+        with self.captureOnCommitCallbacks(execute=True):
+            Genre.objects.create(name='Былина')
+        self.assertGreater(caching.get_versions([caching.GENRES]), version)
+
+    def test_book_pages_and_api_without_lookup_queries(self):
+        self.client.get(reverse('book-detail', args=[self.book.pk]))
+        self.client.get(reverse('api-books'))
+        for url_name, args in (('book-detail', [self.book.pk]), ('api-book-detail', [self.book.pk]),
+                               ('api-books', []), ('api-genres', []), ('api-languages', [])):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(url_name, args=args))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.lookup_queries(queries), [], url_name)
+        self.assertContains(self.client.get(reverse('book-detail', args=[self.book.pk])), 'Комедия, Роман')
+        data = self.client.get(reverse('api-book-detail', args=[self.book.pk])).json()
+        self.assertEqual((data['language'], data['genres']), ('Русский', ['Комедия', 'Роман']))
+
+    def test_display_genre(self):
+        lookups.genre_choices()
+        book = Book.objects.prefetch_related('genre').get(pk=self.book.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(book.display_genre(), 'Комедия, Роман')
+        book = Book.objects.get(pk=self.book.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(book.display_genre(), 'Комедия, Роман')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.lookup_queries(queries), [])
+
+
+class AutocompleteTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = benchmark_users()
+        cls.users['librarian'].user_permissions.add(*Permission.objects.filter(codename__in=['add_book', 'change_book']))
+        cls.authors = Author.objects.bulk_create(
+            [Author(first_name='Имя{0}'.format(number), last_name='Фамилия{0}'.format(number)) for number in range(60)]
+            + [Author(first_name='Лев', last_name='Толстой'), Author(first_name='Алексей', last_name='Толстой'),
+               Author(first_name='Толя', last_name='Абрамов')])
+        cls.genres = [Genre.objects.create(name=name) for name in ('Роман', 'Рассказ', 'Поэма')]
+        cls.language = Language.objects.create(name='Русский')
+        cls.book = Book.objects.create(title='Война и мир', summary='-', isbn='1', author=cls.authors[60],
+                                       language=cls.language)
+        cls.book.genre.set(cls.genres[:1])
+
+    def autocomplete(self, url_name, q, **params):
+        response = self.client.get(reverse(url_name), dict(params, q=q))
+        self.assertEqual(response.status_code, 200)
+        return [item['text'] for item in response.json()['results']]
+
+    def test_author_prefix_search(self):
+        # Совпадения по фамилии идут перед совпадениями по имени
+        self.assertEqual(self.autocomplete('api-autocomplete-authors', 'Тол'),
+                         ['Толстой, Алексей', 'Толстой, Лев', 'Абрамов, Толя'])
+        self.assertEqual(self.autocomplete('api-autocomplete-authors', 'Тол', limit=2),
+                         ['Толстой, Алексей', 'Толстой, Лев'])
+        self.assertEqual(self.autocomplete('api-autocomplete-authors', 'Лев Т'), ['Толстой, Лев'])
+        self.assertEqual(self.autocomplete('api-autocomplete-authors', 'Толстой, Ал'), ['Толстой, Алексей'])
+        # LIKE в SQLite не учитывает регистр только для латиницы
+        if connection.vendor == 'postgresql':
+            self.assertEqual(self.autocomplete('api-autocomplete-authors', 'тол', limit=2),
+                             ['Толстой, Алексей', 'Толстой, Лев'])
+        self.assertEqual(self.autocomplete('api-autocomplete-authors', 'Имя5', limit=2),
+                         ['Фамилия5, Имя5', 'Фамилия50, Имя50'])
+        self.assertEqual(len(self.autocomplete('api-autocomplete-authors', 'Фам', limit=7)), 7)
+        self.assertEqual(self.autocomplete('api-autocomplete-authors', 'стой'), [])
+        self.assertEqual(self.autocomplete('api-autocomplete-genres', 'Р'), ['Рассказ', 'Роман'])
+        self.assertEqual(self.autocomplete('api-autocomplete-languages', 'Рус'), ['Русский'])
+
+    # Поиск и сортировка идут по индексу: найденные строки не сортируются
+    def test_prefix_search_uses_index(self):
+        queryset = api.starting_with(Author.objects.all(), 'last_name', 'Тол', 'first_name')[:20]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+                cursor.execute('SET enable_sort = off')
+                try:
+                    plan = queryset.explain()
+                finally:
+                    cursor.execute('RESET enable_seqscan')
+                    cursor.execute('RESET enable_sort')
+            self.assertNotIn('Sort', plan)
+        else:
+            plan = queryset.explain()
+            self.assertNotIn('TEMP B-TREE', plan)
+        self.assertIn('author_last_name_prefix_idx', plan)
+
+    def test_form_renders_only_selected_options(self):
+        self.client.force_login(self.users['librarian'])
+        response = self.client.get(reverse('book-create'))
+        self.assertContains(response, 'js/autocomplete.js')
+        self.assertContains(response, 'data-autocomplete-url="{0}"'.format(reverse('api-autocomplete-authors')))
+        self.assertEqual(response.content.decode().count('<option'), 2)
+        response = self.client.get(reverse('book-update', args=[self.book.pk]))
+        self.assertInHTML('<option value="{0}" selected>Толстой, Лев</option>'.format(self.authors[60].pk),
+                          response.content.decode())
+        self.assertInHTML('<option value="{0}" selected>Роман</option>'.format(self.genres[0].pk),
+                          response.content.decode())
+        self.assertNotContains(response, 'Фамилия1')
+        # Значения, выбранные автодополнением, сохраняются как раньше
+        response = self.client.post(reverse('book-update', args=[self.book.pk]), {
+            'title': 'Война и мир', 'summary': '-', 'isbn': '1', 'author': self.authors[61].pk,
+            'genre': [self.genres[0].pk, self.genres[2].pk], 'language': self.language.pk, 'loaded_version': 0})
+        self.assertEqual(response.status_code, 302)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.author, self.book.genre_names()), (self.authors[61], ['Поэма', 'Роман']))
+
+class RequestTimingMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(authors=5, books=10, copies=20)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_server_timing_header_counts_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book'))
+        timing = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+        self.assertEqual(set(timing), {'sql', 'render', 'total'})
+        self.assertIn('desc="{0} queries"'.format(len(queries)), timing['sql'])
+
+    def test_request_log_line(self):
+        with self.assertLogs('catalog.timing', 'INFO') as logs:
+            self.client.get(reverse('book-detail', args=[Book.objects.first().pk]))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logs.records[0].levelname, 'INFO')
+        self.assertEqual(record['view'], 'book-detail')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['render_ms'], 0)
+        self.assertNotIn('slowest', record)
+
+    # Запрос в цикле (N+1) попадает в предупреждение о медленном запросе одной нормализованной строкой
+    @override_settings(CATALOG_SLOW_REQUEST_QUERIES=5, CATALOG_DUPLICATE_QUERY_THRESHOLD=3)
+    def test_slow_request_warning_lists_duplicates(self):
+        def view(request):
+            titles = [Book.objects.get(pk=pk).title for pk in Book.objects.values_list('pk', flat=True)]
+            return HttpResponse(', '.join(titles))
+
+        request = RequestFactory().get('/slow/')
+        with self.assertLogs('catalog.timing', 'WARNING') as logs:
+            response = RequestTimingMiddleware(view)(request)
+        self.assertIn('desc="11 queries"', response['Server-Timing'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['queries'], 11)
+        self.assertEqual(len(record['slowest']), 5)
+        [(sql, count)] = record['duplicates'].items()
+        self.assertEqual(count, 10)
+        self.assertIn('WHERE "catalog_book"."id" = ?', sql)
+
+    # В асинхронной цепочке учитываются запросы и отрисовка шаблонов, выполненные в потоках sync_to_async
+    def test_async_request_is_timed(self):
+        async def view(request):
+            books = await sync_to_async(list)(Book.objects.all())
+            template = engines['django'].from_string('{% for book in books %}{{ book.title }} {% endfor %}')
+            return HttpResponse(await sync_to_async(template.render)({'books': books}))
+
+        middleware = RequestTimingMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        with self.assertLogs('catalog.timing', 'INFO') as logs:
+            response = async_to_sync(middleware)(RequestFactory().get('/async/'))
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['queries'], 1)
+        self.assertGreater(record['render_ms'], 0)
+
+    def test_normalize_sql(self):
+        self.assertEqual(normalize_sql("SELECT * FROM t WHERE a = 'x''y' AND b IN (1, 2,3) AND c = %s\n LIMIT 21"),
+                         'SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ? LIMIT ?')
+
+
+class RequestProfilingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(authors=5, books=10, copies=20)
+        cls.staff = User.objects.create_superuser('profiler', 'profiler@example.com', 'password')
+        cls.book = Book.objects.first()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.staff)
+
+    def test_cprofile_profile_is_stored_and_shown_in_admin(self):
+        response = self.client.get(reverse('book-detail', args=[self.book.pk]), {'profile': 'cprofile'})
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((profile.mode, profile.view_name, profile.status_code), ('cprofile', 'book-detail', 200))
+        self.assertEqual(profile.user, self.staff)
+        self.assertIn('function calls', profiling.summary(profile))
+
+        self.assertContains(self.client.get(reverse('admin:catalog_requestprofile_changelist')), profile.path)
+        self.assertContains(self.client.get(reverse('admin:catalog_requestprofile_change', args=[profile.pk])),
+                            'function calls')
+        download = self.client.get(reverse('admin:catalog_requestprofile_download', args=[profile.pk]))
+        self.assertEqual(download['Content-Disposition'], 'attachment; filename="profile-{0}.prof"'.format(profile.pk))
+        # Файл - дамп pstats
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'profile.prof')
+            with open(path, 'wb') as file:
+                file.write(download.content)
+            self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+    def test_sampling_profile_is_folded_stacks(self):
+        def slow_view(request):
+            time.sleep(0.05)
+            return HttpResponse('ok')
+
+        request = RequestFactory().get('/slow/', HTTP_X_PROFILE='sample')
+        request.user = self.staff
+        response = ProfilingMiddleware(slow_view)(request)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        lines = bytes(profile.data).decode().splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        self.assertIn('slow_view', stack)
+        self.assertIn('slow_view', profiling.summary(profile))
+
+    # В асинхронной цепочке запрос без профилирования не покидает цикл событий,
+    # а синхронное представление профилируемого запроса попадает в профиль
+    def test_async_chain(self):
+        def slow_view(request):
+            time.sleep(0.05)
+            return HttpResponse('ok')
+
+        async def get_response(request):
+            return await sync_to_async(slow_view)(request)
+
+        middleware = ProfilingMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        request = RequestFactory().get('/slow/')
+        request.user = self.staff
+        with mock.patch.object(profiling, 'can_profile') as can_profile:
+            response = async_to_sync(middleware)(request)
+        can_profile.assert_not_called()
+        self.assertFalse(response.has_header('X-Profile-Id'))
+
+        request = RequestFactory().get('/slow/', HTTP_X_PROFILE='sample')
+        request.user = self.staff
+        response = async_to_sync(middleware)(request)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertIn('slow_view', profiling.summary(profile))
+
+    @override_settings(CATALOG_PROFILE_KEEP=2)
+    def test_only_staff_can_profile_and_old_profiles_are_removed(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        for _ in range(3):
+            self.client.get(url, {'profile': '1'})
+        self.assertEqual(RequestProfile.objects.count(), 2)
+
+        users = benchmark_users()
+        self.client.force_login(users['reader'])
+        response = self.client.get(url, {'profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('X-Profile-Id'))
+        self.assertEqual(RequestProfile.objects.count(), 2)
+
+        # Библиотекарь снимает профиль страницы, на которой заметил замедление
+        self.client.force_login(users['librarian'])
+        response = self.client.get(url, HTTP_X_PROFILE='sample')
+        self.assertEqual(RequestProfile.objects.get(pk=response['X-Profile-Id']).user, users['librarian'])
+
+
+# Нагрузочный тест против живого сервера (LiveServerTestCase запускает сервер в отдельном потоке)
+class LoadTestCommandTest(LiveServerTestCase):
+
+    def setUp(self):
+        users = benchmark_users()
+        seed_catalog(authors=10, books=30, copies=120, borrowers=[users['reader']], loans_per_user=10)
+
+    def test_report_per_route(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'report.json')
+            # SQLite в памяти не допускает одновременной записи из потоков сервера
+            concurrency = 1 if connection.vendor == 'sqlite' else 2
+            call_command('loadtest', url=self.live_server_url, duration=2, concurrency=concurrency, output=path,
+                         label='test', stdout=StringIO())
+            with open(path, encoding='utf-8') as file:
+                report = json.load(file)
+        self.assertEqual(report['label'], 'test')
+        self.assertEqual(report['total']['errors'], 0, report['routes'])
+        self.assertGreater(report['total']['requests'], 0)
+        self.assertEqual(report['total']['requests'], sum(route['requests'] for route in report['routes'].values()))
+        for route in report['routes'].values():
+            if route['requests']:
+                self.assertLessEqual(route['p50_ms'], route['p95_ms'])
+                self.assertLessEqual(route['p95_ms'], route['p99_ms'])
+        # Книги, созданные тестом, удалены
+        self.assertFalse(Book.objects.filter(title__startswith='Нагрузочный тест').exists())
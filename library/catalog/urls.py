@@ -1,5 +1,5 @@
 from django.urls import path
-from .import views
+from .import api, async_views, views
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -7,6 +7,35 @@ urlpatterns = [
     path('book/<int:pk>', views.BookDetailView.as_view(), name='book-detail'),
     path('authors/', views.AuthorListView.as_view(), name='authors'),
     path('author/<int:pk>', views.AuthorDetailView.as_view(), name='author-detail'),
+    path('search/', views.search, name='search'),  # Полнотекстовый поиск книг
+    path('api/search/', views.search_api, name='api-search'),
+]
+
+# Асинхронные варианты страниц для развёртывания через ASGI (см. catalog/async_views.py)
+urlpatterns += [
+    path('async/', async_views.index, name='async-index'),
+    path('async/books/', async_views.book_list, name='async-book'),
+    path('async/book/<int:pk>', async_views.book_detail, name='async-book-detail'),
+    path('async/authors/', async_views.author_list, name='async-authors'),
+    path('async/author/<int:pk>', async_views.author_detail, name='async-author-detail'),
+    path('async/mybooks/', async_views.loaned_books_by_user, name='async-my-borrowed'),
+    path('async/borrowed/', async_views.loaned_books_all, name='async-all-borrowed'),
+    path('async/allbooks/', async_views.loaned_books_all_books, name='async-all-books'),
+]
+
+# JSON API каталога только для чтения с условными запросами (ETag / Last-Modified), см. catalog/api.py
+urlpatterns += [
+    path('api/books/', api.book_list, name='api-books'),
+    path('api/books/<int:pk>/', api.book_detail, name='api-book-detail'),
+    path('api/books/<int:pk>/copies/', api.book_copies, name='api-book-copies'),
+    path('api/authors/', api.author_list, name='api-authors'),
+    path('api/authors/<int:pk>/', api.author_detail, name='api-author-detail'),
+    path('api/genres/', api.genre_list, name='api-genres'),
+    path('api/languages/', api.language_list, name='api-languages'),
+    # Автодополнение для полей форм книги
+    path('api/autocomplete/authors/', api.author_autocomplete, name='api-autocomplete-authors'),
+    path('api/autocomplete/genres/', api.genre_autocomplete, name='api-autocomplete-genres'),
+    path('api/autocomplete/languages/', api.language_autocomplete, name='api-autocomplete-languages'),
 ]
 
 urlpatterns += [
@@ -22,6 +51,15 @@ urlpatterns += [
 # туда же передаём идентификатор id записи BookInstance в качестве параметра с именем pk.
 urlpatterns += [
     path('book/<uuid:pk>/renew', views.renew_book_librarian, name='renew-book-librarian'),
+    # Массовое продление и возврат экземпляров
+    path('loans/bulk/', views.bulk_loans, name='bulk-loans'),
+    path('api/loans/bulk/', views.bulk_loans_api, name='api-bulk-loans'),
+    # Выдача, возврат и заявки (checkout, return, hold)
+    path('api/circulation/<str:action>/', views.circulation_api, name='api-circulation'),
+    # Выгрузка каталога в CSV/JSONL
+    path('export/<str:name>.<str:file_format>', views.export_catalog, name='export'),
+    # Счётчики попаданий в кэш страниц
+    path('cache/stats/', views.cache_stats, name='cache-stats'),
 ]
 
 
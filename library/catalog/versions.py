@@ -0,0 +1,62 @@
+# Версии данных каталога для условных запросов JSON API (ETag / Last-Modified).
+# Версия модели - время последнего изменения в микросекундах; хранится в таблице CatalogCounter
+# (строки 'version:<модель>'), поэтому одинакова для всех процессов сервера.
+# Версии увеличиваются сигналами при сохранении и удалении записей (см. catalog/signals.py).
+import datetime
+import hashlib
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import CatalogCounter
+
+BOOK = 'version:book'
+AUTHOR = 'version:author'
+GENRE = 'version:genre'
+LANGUAGE = 'version:language'
+BOOK_INSTANCE = 'version:bookinstance'
+NAMES = (BOOK, AUTHOR, GENRE, LANGUAGE, BOOK_INSTANCE)
+
+
+def now():
+    return int(time.time() * 1000000)
+
+
+# Новая версия: текущее время, но не меньше предыдущей версии + 1 (при одинаковом времени версия всё равно растёт)
+def bump(*names):
+    value = now()
+    for name in names:
+        if not CatalogCounter.objects.filter(name=name).update(value=Greatest(F('value') + 1, value)):
+            try:
+                with transaction.atomic():
+                    CatalogCounter.objects.create(name=name, value=value)
+            except IntegrityError:
+                # Строку одновременно создал другой процесс
+                CatalogCounter.objects.filter(name=name).update(value=Greatest(F('value') + 1, value))
+
+
+def bump_all():
+    bump(*NAMES)
+
+
+# Версии указанных моделей одним запросом; отсутствующие версии создаются
+def get_versions(names):
+    versions = dict(CatalogCounter.objects.filter(name__in=names).values_list('name', 'value'))
+    missing = [name for name in names if name not in versions]
+    if missing:
+        bump(*missing)
+        versions.update(CatalogCounter.objects.filter(name__in=missing).values_list('name', 'value'))
+    return versions
+
+
+# Время изменения по версии (для заголовка Last-Modified)
+def modified_at(versions):
+    return datetime.datetime.fromtimestamp(max(versions.values()) / 1000000, tz=datetime.timezone.utc)
+
+
+# ETag: версии моделей и полный путь запроса (разные страницы и параметры - разные ETag)
+def make_etag(versions, path):
+    data = ','.join('{0}={1}'.format(name, versions[name]) for name in sorted(versions)) + '|' + path
+    return hashlib.md5(data.encode()).hexdigest()
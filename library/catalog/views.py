@@ -1,13 +1,15 @@
 from django.shortcuts import render
 # Библиотека для предоставления страницы списка объектов
 from django.views import generic
-from .models import Book, Author, BookInstance, Genre
+# Prefetch - предварительная загрузка связанных объектов с заданным набором запросов
+from django.db.models import Prefetch
+from .models import Book, Author, BookInstance, Genre, ConcurrentUpdateError
 # LoginRequiredMixin обеспечивает проверку статуса входа в систему
 # PermissionRequiredMixin проверяет что текущий пользователь имеет все указанные права доступа.
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.shortcuts import get_object_or_404
 # HttpResponseRedirect: Данный класс перенаправляет на другой адрес
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 # reverse(): Генерирует URL-адрес при помощи соответствующего имени URL  и дополнительных аргументов.
 from django.urls import reverse
 # datetime: Библиотека Python для работы с датами и временим.
@@ -15,67 +17,182 @@ import datetime
 from django.contrib.auth.decorators import login_required, permission_required
 from .forms import RenewBookForm
 from .forms import RenewBookModelForm
+from .forms import BulkLoanForm
+from .forms import CheckoutForm, HoldForm, ReturnForm
+from .forms import BookForm
 # CreateView, UpdateView, DeleteView - для создания, обновления и удаления объектов
 from django.views.generic import CreateView, UpdateView, DeleteView
 # reverse_lazy() - Для перехода на страницу списка авторов после удаления одного из них
 from django.urls import reverse_lazy
-
+# Постраничный вывод по ключу вместо OFFSET
+from .pagination import KeysetPaginationMixin
+# Полнотекстовый поиск книг
+from .search import search_books
+# Счётчики для домашней страницы
+from . import counters
+# Массовое продление и возврат экземпляров, выдача и заявки
+from . import circulation
+from .circulation import bulk_update_loans
+# Потоковая выгрузка каталога
+from . import export
+# Кэш страниц с версионированными ключами
+from . import caching
+from .caching import CachedPageMixin
+import json
+from django.views.decorators.http import require_POST
+
+
+
+# Счётчик посещений домашней страницы в подписанной cookie (подпись не даёт подделать значение)
+VISITS_COOKIE = 'num_visits'
+VISITS_COOKIE_SALT = 'catalog.visits'
+VISITS_COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+# Количество предыдущих посещений. Если cookie нет (или подпись неверна), берётся значение,
+# которое раньше хранилось в сессии; сессия при этом только читается.
+def get_visits(request):
+    value = request.get_signed_cookie(VISITS_COOKIE, default=None, salt=VISITS_COOKIE_SALT)
+    if value is None:
+        return request.session.get('num_visits', 0)
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        return 0
 
 
 # Функция отображения для домашней страницы сайта.
 def index(request):
-    # Генерация "количеств" некоторых главных объектов
-    num_books = Book.objects.all().count()
-    num_instances = BookInstance.objects.all().count()
+    # "Количества" главных объектов берутся из материализованных счётчиков одним запросом
+    # (счётчики обновляются сигналами, см. catalog/counters.py)
+    counts = counters.get_counts()
+    num_books = counts[counters.BOOKS]
+    num_instances = counts[counters.INSTANCES]
 
     # Доступные книги (статус = 'д')
-    num_instances_available = BookInstance.objects.filter(status__exact='д').count()
-    num_authors = Author.objects.count()  # Метод 'all()' применён по умолчанию.
+    num_instances_available = counts[counters.INSTANCES_AVAILABLE]
+    num_authors = counts[counters.AUTHORS]
 
-    # Количество посещений домашней страницы библиотеки, подсчитанное в переменной сессии.
-    # Получаем значение 'num_visits' из сессии. Возвращаем 0, если оно не было установлено ранее.
-    num_visits = request.session.get('num_visits', 0)
-    # При получении запроса увеличиваем значение сессии на 1
-    request.session['num_visits'] = num_visits + 1
+    # Количество посещений домашней страницы библиотеки хранится в подписанной cookie,
+    # а не в сессии: так домашняя страница не записывает сессию в БД при каждом запросе.
+    num_visits = get_visits(request)
 
     # Отрисовка HTML-шаблона index.html с данными внутри
     # переменной контекста context
-    return render(
+    response = render(
         request,
         'index.html', context={'num_books': num_books, 'num_instances': num_instances,
                                'num_instances_available': num_instances_available,
                                'num_authors': num_authors,
                                'num_visits': num_visits},
     )
+    # При получении запроса увеличиваем счётчик посещений на 1
+    response.set_signed_cookie(VISITS_COOKIE, num_visits + 1, salt=VISITS_COOKIE_SALT,
+                               max_age=VISITS_COOKIE_MAX_AGE, httponly=True, samesite='Lax')
+    return response
 
 
 # Определение класса предстовления на основе базового класса ListView
-class BookListView(generic.ListView):
+class BookListView(CachedPageMixin, KeysetPaginationMixin, generic.ListView):
     model = Book
     # Количество книг для постраничного отображения
     paginate_by = 10
+    page_name = caching.BOOK_LIST
+
+    # В списке - названия книг, имена авторов и доступность экземпляров
+    def get_page_versions(self):
+        return [caching.CATALOG, caching.BOOKS, caching.AUTHORS, caching.AVAILABILITY]
+
+    # Автор подгружается тем же запросом (JOIN), иначе шаблон делает по запросу на каждую книгу.
+    # Доступность берётся из сводки в строке книги (см. catalog/availability.py), экземпляры не подсчитываются.
+    # Сортировка (название, id) совпадает с индексом book_title_id_idx: страница читается по индексу
+    # без сортировки всех книг. Сортировка модели (название, автор) раскрывается в имена автора
+    # и потребовала бы соединения с таблицей авторов и сортировки всей таблицы.
+    def get_queryset(self):
+        return Book.objects.select_related('author').order_by('title', 'pk')
+
 
 
+# Поиск книг по названию, аннотации, ISBN и автору. Результаты отсортированы по релевантности.
+def search(request):
+    query = request.GET.get('q', '')
+    return render(request, 'catalog/book_search.html', {'query': query, 'book_list': search_books(query)})
+
+
+# То же в формате JSON: /catalog/api/search/?q=...&limit=20 (не более 100 результатов)
+def search_api(request):
+    query = request.GET.get('q', '')
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 20)), 100))
+    except ValueError:
+        limit = 20
+    results = [{
+        'id': book.pk,
+        'title': book.title,
+        'author': str(book.author) if book.author else None,
+        'isbn': book.isbn,
+        'url': book.get_absolute_url(),
+        'rank': book.rank,
+    } for book in search_books(query, limit)]
+    return JsonResponse({'query': query, 'results': results}, json_dumps_params={'ensure_ascii': False})
+
 
 # Определение класса предстовления на основе базового класса DetalView
-class BookDetailView(generic.DetailView):
+class BookDetailView(CachedPageMixin, generic.DetailView):
     model = Book
+    page_name = caching.BOOK_DETAIL
+
+    # Изменение экземпляров другой книги эту страницу не сбрасывает
+    def get_page_versions(self):
+        return [caching.CATALOG, caching.book_version(self.kwargs['pk']), caching.GENRES, caching.LANGUAGES]
+
+    # Версия автора книги. Смена автора книги меняет версию книги, поэтому имя версии,
+    # сохранённое со страницей, остаётся верным, пока страница действительна.
+    def get_data_versions(self):
+        author_id = Book.objects.filter(pk=self.kwargs['pk']).values_list('author_id', flat=True).first()
+        return [caching.author_version(author_id)] if author_id is not None else []
+
+    # Автор, экземпляры и их количество загружаются заранее фиксированным числом запросов,
+    # шаблон только выводит готовые данные
+    def get_queryset(self):
+        return Book.objects.with_copy_counts().select_related('author').prefetch_related(
+            Prefetch('bookinstance_set', queryset=BookInstance.objects.order_by('due_back', 'pk')),
+        )
+
+    # Названия языка и жанров - из справочников в памяти (catalog/lookups.py), жанры книги - одним запросом
+    # к промежуточной таблице
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['language_name'] = self.object.language_name
+        context['genre_names'] = self.object.genre_names()
+        return context
 
 
 # Общее представление списка на основе классов для списка авторов.
-class AuthorListView(generic.ListView):
+class AuthorListView(KeysetPaginationMixin, generic.ListView):
     model = Author
     paginate_by = 10
 
 
 # Общий вид подробностей на основе классов для автора.
-class AuthorDetailView(generic.DetailView):
+class AuthorDetailView(CachedPageMixin, generic.DetailView):
     model = Author
+    page_name = caching.AUTHOR_DETAIL
+
+    # Книги автора и количество их экземпляров: книги и экземпляры сбрасывают версию автора книги (catalog/signals.py)
+    def get_page_versions(self):
+        return [caching.CATALOG, caching.author_version(self.kwargs['pk'])]
+
+    # Книги автора загружаются одним запросом вместе с количеством экземпляров
+    def get_queryset(self):
+        return Author.objects.prefetch_related(
+            Prefetch('book_set', queryset=Book.objects.with_copy_counts().order_by('title', 'pk')),
+        )
 
 
 # Представление для получения списка всех книг, которые были предоставлены текущему пользователю.
 # LoginRequiredMixin, наследуется для того, чтобы только вошедший пользователь смог вызвать это представление.
-class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
+class LoanedBooksByUserListView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     model = BookInstance
     # Форма списка экземпляров книг, взятых пользователем
     template_name = 'catalog/bookinstance_list_borrowed_user.html'
@@ -83,11 +200,12 @@ class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
 
     # Показывает всзятые книги пользователя, отсортированные начиная с самых старых due_back
     def get_queryset(self):
-        return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='в').order_by('due_back')
+        return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='в')\
+            .select_related('book').order_by('due_back')
 
 
 # Представление для получения списка всех книг, предоставленных всем пользователям.
-class LoanedBooksAllListView(PermissionRequiredMixin, generic.ListView):
+class LoanedBooksAllListView(PermissionRequiredMixin, KeysetPaginationMixin, generic.ListView):
     model = BookInstance
     permission_required = 'catalog.can_mark_returned'
     template_name = 'catalog/bookinstance_list_borrowed_all.html'
@@ -95,12 +213,12 @@ class LoanedBooksAllListView(PermissionRequiredMixin, generic.ListView):
 
     # Показывает всзятые книги пользователей, отсортированные начиная с самых старых due_back
     def get_queryset(self):
-        return BookInstance.objects.filter(status__exact='в').order_by('due_back')
+        return BookInstance.objects.filter(status__exact='в').select_related('book', 'borrower').order_by('due_back')
 
 
 
 # Представление для получения списка всех книг из библиотеки.
-class LoanedBooksAllListViewAll(PermissionRequiredMixin, generic.ListView):
+class LoanedBooksAllListViewAll(PermissionRequiredMixin, KeysetPaginationMixin, generic.ListView):
     model = BookInstance
     permission_required = 'catalog.can_mark_returned'
     template_name = 'catalog/bookinstance_list_borrowed_all_books.html'
@@ -108,7 +226,8 @@ class LoanedBooksAllListViewAll(PermissionRequiredMixin, generic.ListView):
 
     # Показывает все книги отсортированные по названию
     def get_queryset(self):
-        return BookInstance.objects.order_by('book')
+        # Автор книги нужен для курсора страницы: сортировка по книге раскрывается в название и автора
+        return BookInstance.objects.select_related('book__author', 'borrower').order_by('book')
 
 
 
@@ -125,16 +244,21 @@ def renew_book_librarian(request, pk):
     if request.method == 'POST':
         # Создаём экземпляр формы и заполняем данными из запроса:
         # form = RenewBookForm(request.POST)
-        form = RenewBookModelForm(request.POST)
+        # Форма проверяет, что экземпляр не изменили после её открытия (скрытое поле версии)
+        form = RenewBookModelForm(request.POST, instance=book_instance)
 
         # Проверка валидности формы:
         if form.is_valid():
             # Обработка данных из form.cleaned_data и  присваивание их полю due_back
-            book_instance.due_back = form.cleaned_data['renewal_date']
-            book_instance.save()
-
-            # Перенаправление на новый URL.  Переход по адресу 'all-borrowed':
-            return HttpResponseRedirect(reverse('all-borrowed'))
+            book_instance.due_back = form.cleaned_data['due_back']
+            # Записывается только дата возврата; изменение экземпляра между загрузкой и записью - ошибка формы
+            try:
+                book_instance.save(update_fields=['due_back'])
+            except ConcurrentUpdateError as error:
+                form.add_error(None, str(error))
+            else:
+                # Перенаправление на новый URL.  Переход по адресу 'all-borrowed':
+                return HttpResponseRedirect(reverse('all-borrowed'))
 
         return render(request, 'catalog/book_renew_librarian.html', {'form': form, 'book_instance': book_instance})
 
@@ -145,7 +269,7 @@ def renew_book_librarian(request, pk):
         proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=3)
         # initial - начальное значение для поля renewal_date
         # form = RenewBookForm(initial={'renewal_date': proposed_renewal_date})
-        form = RenewBookModelForm(initial={'due_back': proposed_renewal_date})
+        form = RenewBookModelForm(initial={'due_back': proposed_renewal_date}, instance=book_instance)
 
         # Создаём HTML-страницу, в качестве параметров шаблон и контекст, который содержит объект формы.
         context = {
@@ -155,6 +279,115 @@ def renew_book_librarian(request, pk):
         return render(request, 'catalog/book_renew_librarian.html', context)
 
 
+# Массовое продление и возврат экземпляров книг: список ID экземпляров и новая дата возврата или статус.
+# Все изменения применяются одним запросом, ошибки показываются для каждого экземпляра отдельно.
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def bulk_loans(request):
+    context = {}
+    if request.method == 'POST':
+        form = BulkLoanForm(request.POST)
+        if form.is_valid():
+            context['updated'], context['failures'] = bulk_update_loans(
+                form.cleaned_data['copies'], form.cleaned_data['due_back'], form.cleaned_data['status'])
+    else:
+        form = BulkLoanForm(initial={'due_back': datetime.date.today() + datetime.timedelta(weeks=3)})
+    context['form'] = form
+    return render(request, 'catalog/bookinstance_bulk.html', context)
+
+
+# То же в формате JSON:
+# POST /catalog/api/loans/bulk/ {"copies": ["<id>", ...], "due_back": "ГГГГ-ММ-ДД", "status": "д"}
+# Ответ: {"updated": [...], "failed": {"<id>": "причина"}}; ошибки в запросе - статус 400.
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+@require_POST
+def bulk_loans_api(request):
+    form, error = json_form(request, BulkLoanForm)
+    if error is not None:
+        return error
+    updated, failures = bulk_update_loans(
+        form.cleaned_data['copies'], form.cleaned_data['due_back'], form.cleaned_data['status'])
+    return JsonResponse({'updated': updated, 'failed': failures}, json_dumps_params={'ensure_ascii': False})
+
+
+# Проверка тела запроса JSON формой form_class: (форма, None) или (None, ответ с ошибками и статусом 400)
+def json_form(request, form_class):
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return None, JsonResponse({'errors': {'__all__': ['Ожидается объект JSON']}}, status=400,
+                                  json_dumps_params={'ensure_ascii': False})
+    form = form_class(data)
+    if not form.is_valid():
+        errors = {field: [error['message'] for error in field_errors]
+                  for field, field_errors in form.errors.get_json_data().items()}
+        return None, JsonResponse({'errors': errors}, status=400, json_dumps_params={'ensure_ascii': False})
+    return form, None
+
+
+def copy_data(copy):
+    return {'copy': str(copy.pk), 'book': copy.book_id, 'status': copy.status, 'borrower': copy.borrower_id,
+            'due_back': copy.due_back.isoformat() if copy.due_back else None}
+
+
+def hold_data(hold):
+    return {'hold': hold.pk, 'book': hold.book_id, 'user': hold.user_id,
+            'copy': str(hold.copy_id) if hold.copy_id else None, 'position': circulation.queue_position(hold)}
+
+
+# Выдача, возврат и заявки для столов выдачи (см. catalog/circulation.py):
+# POST /catalog/api/circulation/checkout/ {"book": <id>, "user": <id>, "due_back": "ГГГГ-ММ-ДД"} - выданный экземпляр
+# POST /catalog/api/circulation/return/ {"copy": "<id>"} - заявка, для которой зарезервирован экземпляр, или null
+# POST /catalog/api/circulation/hold/ {"book": <id>, "user": <id>} - заявка и её место в очереди
+# Ошибки в запросе - статус 400, невозможная операция (нет экземпляров, экземпляр не выдан) - 409.
+CIRCULATION_FORMS = {'checkout': CheckoutForm, 'return': ReturnForm, 'hold': HoldForm}
+
+
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+@require_POST
+def circulation_api(request, action):
+    if action not in CIRCULATION_FORMS:
+        raise Http404('Неизвестная операция')
+    form, error = json_form(request, CIRCULATION_FORMS[action])
+    if error is not None:
+        return error
+    data = form.cleaned_data
+    try:
+        if action == 'checkout':
+            result = copy_data(circulation.checkout(data['book'], data['user'], data['due_back']))
+        elif action == 'return':
+            hold = circulation.return_copy(data['copy'])
+            result = {'hold': hold_data(hold) if hold else None}
+        else:
+            result = hold_data(circulation.place_hold(data['book'], data['user']))
+    except circulation.CirculationError as error:
+        return JsonResponse({'errors': {'__all__': [str(error)]}}, status=409,
+                            json_dumps_params={'ensure_ascii': False})
+    return JsonResponse(result, json_dumps_params={'ensure_ascii': False})
+
+
+# Счётчики попаданий в кэш страниц для сотрудников: /catalog/cache/stats/
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def cache_stats(request):
+    return JsonResponse(caching.stats())
+
+
+# Выгрузка каталога для библиотекарей: /catalog/export/<books|authors|copies|loans>.<csv|jsonl>
+# Строки передаются клиенту по мере чтения из БД (StreamingHttpResponse), таблица целиком в память не загружается.
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def export_catalog(request, name, file_format):
+    if name not in export.EXPORTS or file_format not in export.FORMATS:
+        raise Http404('Неизвестная выгрузка')
+    response = StreamingHttpResponse(export.export_lines(name, file_format),
+                                     content_type=export.CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = 'attachment; filename="{0}.{1}"'.format(name, file_format)
+    return response
+
+
 # Классы для создания, изменения и удаления авторов
 class AuthorCreate(PermissionRequiredMixin, CreateView):
     model = Author
@@ -176,12 +409,23 @@ class AuthorDelete(PermissionRequiredMixin, DeleteView):
 # Классы для создания, изменения и удаления книг
 class BookCreate(PermissionRequiredMixin, CreateView):
     model = Book
-    fields = ['title', 'author', 'summary', 'isbn', 'genre', 'language']
+    form_class = BookForm
     permission_required = 'catalog.can_mark_returned'
 
-class BookUpdate(PermissionRequiredMixin, UpdateView):
+
+# Изменение книги, которую успели изменить другие, показывается ошибкой формы, а не перезаписывает их изменение
+class VersionedUpdateMixin:
+    def form_valid(self, form):
+        try:
+            return super().form_valid(form)
+        except ConcurrentUpdateError as error:
+            form.add_error(None, str(error))
+            return self.form_invalid(form)
+
+
+class BookUpdate(PermissionRequiredMixin, VersionedUpdateMixin, UpdateView):
     model = Book
-    fields = ['title', 'author', 'summary', 'isbn', 'genre', 'language']
+    form_class = BookForm
     permission_required = 'catalog.can_mark_returned'
 
 class BookDelete(PermissionRequiredMixin, DeleteView):
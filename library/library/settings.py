@@ -39,12 +39,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Замер SQL и времени каждого запроса: заголовок Server-Timing и журнал 'catalog.timing'.
+    # Стоит первым, чтобы учитывать запросы остальных middleware (сессия, пользователь).
+    'catalog.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware', # Управление сессиями между запросами
     'django.middleware.common.CommonMiddleware',
     # Из-за строки ниже могут не работать формы на html
     'django.middleware.csrf.CsrfViewMiddleware',  # Возможно нужно будет закоментить
     'django.contrib.auth.middleware.AuthenticationMiddleware',  # Связывает пользователей, использующих сессии, запросами.
+    # Профилирование запроса сотрудником: ?profile=cprofile|sample (см. catalog/profiling.py)
+    'catalog.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -95,6 +100,61 @@ DATABASES = {
     }
 }
 
+# Кэш страниц каталога (catalog/caching.py). По умолчанию - память процесса; если сервер запущен
+# в нескольких процессах, нужен общий кэш, например Redis: REDIS_URL=redis://127.0.0.1:6379/1
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'catalog',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Время хранения страниц и фрагментов в кэше каталога, секунд (0 - кэш отключён)
+CATALOG_CACHE_TIMEOUT = 300
+
+
+# Пороги медленного запроса для RequestTimingMiddleware: время в миллисекундах или количество SQL-запросов.
+# Медленный запрос записывается в журнал предупреждением с самыми медленными и повторяющимися
+# (не меньше CATALOG_DUPLICATE_QUERY_THRESHOLD раз) SQL-запросами.
+CATALOG_SLOW_REQUEST_MS = 500
+CATALOG_SLOW_REQUEST_QUERIES = 50
+CATALOG_DUPLICATE_QUERY_THRESHOLD = 3
+
+# Первичные ключи новых экземпляров книг: False - случайные UUID v4, True - упорядоченные по времени
+# UUID v7 (вставка в конец индекса, см. catalog/ids.py). Существующие ключи не меняются.
+CATALOG_UUID7 = False
+
+# Профилирование запросов: интервал семплирования и сколько последних профилей хранить
+CATALOG_PROFILE_INTERVAL_MS = 1
+CATALOG_PROFILE_KEEP = 100
+
+# Журнал замеров запросов. По умолчанию - только медленные запросы;
+# CATALOG_TIMING_LOG_LEVEL=INFO - строка JSON на каждый запрос.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'catalog.timing': {
+            'handlers': ['console'],
+            'level': os.environ.get('CATALOG_TIMING_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 